@@ -0,0 +1,151 @@
+"""On-disk cache of preprocessed point clouds.
+
+Each cache file holds a small JSON header followed by raw arrays: float32
+XYZ points and, optionally, float32 normals, uint8 colours and int32 labels.
+Arrays are opened with np.memmap, so readers share the pages with the OS
+cache instead of parsing PLY/OBJ files on every run.
+
+Cache files are named after the source file and a hash of its absolute
+path, so sources with the same name (every subject's model_mesh.obj) get
+their own entries in a shared cache_dir. The header records the path, size,
+mtime and content hash of the source file. load_cached rebuilds an entry when
+the source hash changes. It only re-hashes the source when its size or mtime
+differ from the header.
+
+The cache covers the point clouds read by infer and finding_centroids. The
+E3DTools apps keep pv.read: they display the textured mesh, which needs
+the faces and texture coordinates that are not stored here. The HDF5
+training files are already binary and read in chunks by provider.H5Dataset.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+MAGIC = b"DEMPCC1\n"
+ALIGN = 64
+FIELDS = {"points": np.float32, "normals": np.float32, "colors": np.uint8, "labels": np.int32}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """Content hash of a file, read in chunks."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def path_hash(path):
+    """Short hash of the absolute path of a file."""
+    return hashlib.blake2b(os.path.abspath(path).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def default_cache_file(source_file, cache_dir=None, tag=None):
+    """Cache path for a source file: <cache_dir or source dir/.dem_cache>/<name>.<path hash>[.<tag>].pcc"""
+    source_file = os.path.abspath(source_file)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(source_file), ".dem_cache")
+    name = f"{os.path.basename(source_file)}.{path_hash(source_file)}" + (f".{tag}" if tag else "")
+    return os.path.join(cache_dir, name + ".pcc")
+
+
+def _data_start(header_len):
+    return -(-(len(MAGIC) + 8 + header_len) // ALIGN) * ALIGN
+
+
+class PointCloudCache:
+    """A cache file opened with np.memmap. Missing fields are None."""
+
+    def __init__(self, cache_file, mode="r"):
+        with open(cache_file, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{cache_file} is not a point cloud cache file")
+            header_len = int.from_bytes(f.read(8), "little")
+            self.header = json.loads(f.read(header_len).decode("utf-8"))
+        self.cache_file = cache_file
+        for name in FIELDS:
+            info = self.header["arrays"].get(name)
+            array = None
+            if info is not None:
+                array = np.memmap(cache_file, dtype=np.dtype(info["dtype"]), mode=mode,
+                                  offset=_data_start(header_len) + info["offset"],
+                                  shape=tuple(info["shape"]))
+            setattr(self, name, array)
+
+    def __len__(self):
+        return self.header["n_points"]
+
+
+def write_cache(cache_file, points, normals=None, colors=None, labels=None, source_file=None, source_hash=None):
+    """Write arrays to cache_file, atomically replacing any existing entry."""
+    arrays = {"points": points, "normals": normals, "colors": colors, "labels": labels}
+    arrays = {name: np.ascontiguousarray(a, dtype=FIELDS[name]) for name, a in arrays.items() if a is not None}
+    n_points = len(arrays["points"])
+    for name, a in arrays.items():
+        if len(a) != n_points:
+            raise ValueError(f"{name} has {len(a)} rows, expected {n_points}")
+
+    header = {"version": 1, "n_points": n_points, "arrays": {}}
+    if source_file is not None:
+        stat = os.stat(source_file)
+        header["source"] = {"path": os.path.abspath(source_file), "size": stat.st_size,
+                            "mtime_ns": stat.st_mtime_ns,
+                            "hash": source_hash or file_hash(source_file)}
+    offset = 0  # relative to the aligned start of the data section
+    for name, a in arrays.items():
+        header["arrays"][name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": offset}
+        offset += -(-a.nbytes // ALIGN) * ALIGN
+    encoded = json.dumps(header).encode("utf-8")
+    data_start = _data_start(len(encoded))
+
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    tmp_file = f"{cache_file}.tmp{os.getpid()}"
+    with open(tmp_file, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(encoded).to_bytes(8, "little"))
+        f.write(encoded)
+        for name, a in arrays.items():
+            f.seek(data_start + header["arrays"][name]["offset"])
+            f.write(a.tobytes())
+    os.replace(tmp_file, cache_file)
+    return cache_file
+
+
+def is_fresh(cache, source_file):
+    """True if the cache entry was built from the current content of source_file."""
+    source = cache.header.get("source")
+    if source is None or source["path"] != os.path.abspath(source_file):
+        return False
+    stat = os.stat(source_file)
+    if stat.st_size != source["size"]:
+        return False
+    if stat.st_mtime_ns == source["mtime_ns"]:
+        return True
+    return file_hash(source_file) == source["hash"]
+
+
+def load_cached(source_file, loader, cache_dir=None, tag=None):
+    """Open the cache entry for source_file, rebuilding it if missing or stale.
+
+    loader(source_file) must return an (N, 3) points array or a dict with
+    'points' and any of 'normals', 'colors' and 'labels'. tag names the
+    entry when one source has several cached versions, e.g. per settings.
+    """
+    cache_file = default_cache_file(source_file, cache_dir, tag)
+    if os.path.exists(cache_file):
+        try:
+            cache = PointCloudCache(cache_file)
+            if is_fresh(cache, source_file):
+                return cache
+        except (ValueError, KeyError, OSError):
+            pass  # unreadable entry, rebuild it
+    data = loader(source_file)
+    if not isinstance(data, dict):
+        data = {"points": data}
+    write_cache(cache_file, source_file=source_file, **data)
+    cache = PointCloudCache(cache_file)
+    if cache.header["source"]["path"] != os.path.abspath(source_file):
+        raise RuntimeError(f"{cache_file} was overwritten with the cache of {cache.header['source']['path']}")
+    return cache
@@ -0,0 +1,264 @@
+"""Electrode coordinates from segmented electrode points.
+
+The points the model labels as electrode are grouped into one cluster per
+electrode and each cluster is reduced to its centroid. Two strategies are
+available, as in the original tests/finding_centroids.py:
+
+- 'dbscan' searches eps over the range suggested by the k-distance
+  statistics and keeps the clustering whose cluster count is closest to the
+  target. The neighbour pairs are computed once, so trying an eps is cheap.
+- 'kmeans' always returns exactly the target number of clusters. It is
+  warm-started from template electrode positions or DBSCAN centroids when
+  available, instead of running ten k-means++ initialisations.
+
+'auto' uses DBSCAN when it finds exactly the target count and falls back to
+KMeans otherwise. The k-distance statistics, the eps search and the outlier
+filtering share one NeighborGraph per cloud. Centroids can be weighted by the
+per-point electrode probability and snapped onto the scanned surface.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from DeepElectrodeMapper.neighbors import NeighborGraph
+
+METHODS = ("auto", "kmeans", "dbscan")
+
+# centroids (K, 3), sizes (K,) points per cluster, labels (N,) cluster of each
+# point with -1 for noise, method 'kmeans' or 'dbscan', eps of the DBSCAN fit or None
+CentroidResult = namedtuple("CentroidResult", ["centroids", "sizes", "labels", "method", "eps"])
+
+
+def cluster_centroids(points, labels, weights=None):
+    """Centroid and size of every cluster label >= 0, optionally weighting the points.
+
+    All clusters are reduced in one np.bincount pass per coordinate. Clusters
+    whose weights sum to zero fall back to the plain mean.
+    """
+    clustered = labels >= 0
+    cluster_ids, index = np.unique(labels[clustered], return_inverse=True)
+    points = points[clustered]
+    n_clusters = len(cluster_ids)
+    sizes = np.bincount(index, minlength=n_clusters)
+    w = np.ones(len(points)) if weights is None else weights[clustered]
+    total = np.bincount(index, weights=w, minlength=n_clusters)
+    unweighted = total <= 0
+    if unweighted.any():
+        w = np.where(unweighted[index], 1.0, w)
+        total = np.where(unweighted, sizes, total)
+    centroids = np.stack([np.bincount(index, weights=w * points[:, d], minlength=n_clusters)
+                          for d in range(3)], axis=1) / np.maximum(total, 1)[:, None]
+    return centroids, sizes.astype(np.int64)
+
+
+def snap_to_surface(centroids, surface_points, surface_normals=None):
+    """Move centroids onto the scanned surface.
+
+    Without normals each centroid moves to its nearest surface point. With
+    (M, 3) unit normals it is projected onto the tangent plane of that
+    point, which keeps the sub-point position along the surface.
+    """
+    from scipy.spatial import cKDTree
+
+    centroids = np.asarray(centroids, dtype=np.float64)
+    if len(centroids) == 0:
+        return centroids
+    _, nearest = cKDTree(surface_points).query(centroids)
+    anchor = np.asarray(surface_points, dtype=np.float64)[nearest]
+    if surface_normals is None:
+        return anchor
+    normals = np.asarray(surface_normals, dtype=np.float64)[nearest]
+    return centroids - np.sum((centroids - anchor) * normals, axis=1, keepdims=True) * normals
+
+
+def suggest_eps_range(graph, k=4):
+    """The 10th and 90th percentiles of the distance of every point to its k-th nearest neighbour.
+
+    graph is a NeighborGraph or an (N, 3) array.
+    """
+    if not isinstance(graph, NeighborGraph):
+        graph = NeighborGraph(graph)
+    distances = graph.k_distance(k)
+    return np.percentile(distances, 10), np.percentile(distances, 90)
+
+
+def dbscan_from_pairs(n_points, pairs, distances, eps, min_samples=5):
+    """DBSCAN labels for any eps no larger than the radius the pairs were collected with.
+
+    Core points have at least min_samples points (themselves included) within
+    eps, clusters are the connected components of the core points, and border
+    points join the cluster of their nearest core point. The clusters are
+    those of sklearn's DBSCAN, only the assignment of border points within
+    eps of two clusters may differ. Returns (labels, n_clusters).
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    i, j = pairs[distances <= eps].T
+    d = distances[distances <= eps]
+    core = 1 + np.bincount(i, minlength=n_points) + np.bincount(j, minlength=n_points) >= min_samples
+    both = core[i] & core[j]
+    graph = coo_matrix((np.ones(np.count_nonzero(both)), (i[both], j[both])), shape=(n_points, n_points))
+    _, components = connected_components(graph, directed=False)
+
+    labels = np.full(n_points, -1, dtype=np.int64)
+    cluster_ids, labels[core] = np.unique(components[core], return_inverse=True)
+
+    # border points: the nearest core point within eps
+    one = core[i] != core[j]
+    border = np.where(core[i[one]], j[one], i[one])
+    nearest_core = np.where(core[i[one]], i[one], j[one])
+    order = np.lexsort((d[one], border))
+    border, first = np.unique(border[order], return_index=True)
+    labels[border] = labels[nearest_core[order][first]]
+    return labels, len(cluster_ids)
+
+
+def dbscan_search(graph, n_clusters, eps_min, eps_max, steps=50, min_samples=5, max_iter=30):
+    """Search eps in [eps_min, eps_max] for a DBSCAN clustering with n_clusters clusters.
+
+    graph is a NeighborGraph or an (N, 3) array. The neighbour pairs are
+    collected once at eps_max, after which every eps costs one
+    connected-components pass. The counts are evaluated on
+    linspace(eps_min, eps_max, steps). The first eps hitting n_clusters is
+    returned. Otherwise the first interval where the count crosses n_clusters
+    is bisected. Returns (labels, eps) of the fit with the count closest to
+    n_clusters, the smallest such eps on ties.
+    """
+    if not isinstance(graph, NeighborGraph):
+        graph = NeighborGraph(graph)
+    pairs, distances = graph.radius_pairs(eps_max)
+    best = None
+
+    def fit(eps):
+        nonlocal best
+        labels, found = dbscan_from_pairs(len(graph), pairs, distances, eps, min_samples)
+        if best is None or abs(found - n_clusters) < abs(best[0] - n_clusters):
+            best = (found, labels, eps)
+        return found
+
+    grid = np.linspace(eps_min, eps_max, steps)
+    counts = []
+    for eps in grid:
+        counts.append(fit(eps))
+        if counts[-1] == n_clusters:
+            return best[1], best[2]
+
+    signs = np.sign(np.array(counts) - n_clusters)
+    crossings = np.flatnonzero(signs[:-1] != signs[1:])
+    if len(crossings):
+        lo, hi = grid[crossings[0]], grid[crossings[0] + 1]
+        lo_sign = signs[crossings[0]]
+        for _ in range(max_iter):
+            mid = (lo + hi) / 2
+            found = fit(mid)
+            if found == n_clusters:
+                break
+            if np.sign(found - n_clusters) == lo_sign:
+                lo = mid
+            else:
+                hi = mid
+    return best[1], best[2]
+
+
+def kmeans_init(points, init, n_clusters, sizes=None):
+    """n_clusters starting centres for KMeans from the (K, 3) centres in init.
+
+    Extra centres are dropped, keeping the largest clusters when sizes is
+    given and the first rows otherwise. Missing centres are filled in with
+    the points farthest from the centres chosen so far.
+    """
+    init = np.asarray(init, dtype=np.float64).reshape(-1, 3)
+    if len(init) > n_clusters:
+        order = np.argsort(-np.asarray(sizes), kind="stable") if sizes is not None else np.arange(len(init))
+        init = init[np.sort(order[:n_clusters])]
+    if len(init) < n_clusters:
+        from scipy.spatial import cKDTree
+
+        centres = [init]
+        min_distance = cKDTree(init).query(points)[0] if len(init) else np.full(len(points), np.inf)
+        for _ in range(n_clusters - len(init)):
+            farthest = points[np.argmax(min_distance)]
+            centres.append(farthest[None])
+            min_distance = np.minimum(min_distance, np.linalg.norm(points - farthest, axis=1))
+        init = np.concatenate(centres)
+    return init
+
+
+def kmeans_clusters(points, n_clusters, seed=0, n_init=10, init=None, tol=1e-4, batch_size=None):
+    """KMeans labels of the points, exactly n_clusters clusters.
+
+    Without init, the best of n_init k-means++ runs is kept. With init, e.g.
+    DBSCAN centroids or template electrode positions (see kmeans_init), a
+    single warm-started run is made, and cluster i starts at init[i].
+    batch_size switches to MiniBatchKMeans. Iterations stop once the centres
+    move by less than tol.
+    """
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+
+    n_runs = n_init
+    if init is not None:
+        init, n_runs = kmeans_init(points, init, n_clusters), 1
+    else:
+        init = "k-means++"
+    if batch_size:
+        model = MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=n_runs, tol=tol,
+                                batch_size=batch_size, random_state=seed)
+    else:
+        model = KMeans(n_clusters=n_clusters, init=init, n_init=n_runs, tol=tol, random_state=seed)
+    return model.fit_predict(points)
+
+
+def find_centroids(points, n_electrodes=126, method="auto", weights=None, seed=0, min_samples=5, k=4,
+                   outlier_std_ratio=None, template=None, kmeans_batch_size=None, surface=None,
+                   surface_normals=None):
+    """Cluster electrode points into n_electrodes centroids.
+
+    points: (N, 3) electrode points. weights: optional (N,) per-point weights,
+    e.g. electrode probabilities, used for the centroid means. method: one of
+    METHODS. seed fixes the KMeans initialisation, so repeated runs give the
+    same centroids. With outlier_std_ratio set, statistical outliers (see
+    NeighborGraph.statistical_outliers) are labelled -1 before clustering.
+
+    The KMeans fallback is warm-started from template, (M, 3) template
+    electrode positions aligned to the cloud, if given. Otherwise, in 'auto'
+    mode, it starts from the DBSCAN centroids. With a template and
+    n_electrodes == M, centroid i belongs to template electrode i.
+    kmeans_batch_size switches the fallback to MiniBatchKMeans.
+    With surface, (M, 3) points of the scan, the centroids are snapped onto it
+    (see snap_to_surface). Returns a CentroidResult.
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, got {method!r}")
+    points = np.asarray(points, dtype=np.float64)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.float64)
+    labels = np.full(len(points), -1, dtype=np.int64)
+    keep = np.arange(len(points))
+    graph = NeighborGraph(points)
+    if outlier_std_ratio is not None and len(points) > k:
+        keep = np.flatnonzero(~graph.statistical_outliers(k, outlier_std_ratio))
+        graph = graph.subset(keep)
+    kept_weights = None if weights is None else weights[keep]
+
+    n_clusters = min(n_electrodes, len(keep))
+    if n_clusters == 0:
+        return CentroidResult(np.zeros((0, 3)), np.zeros(0, dtype=np.int64), labels, method, None)
+
+    init = None if template is None else kmeans_init(graph.points, template, n_clusters)
+    if method in ("auto", "dbscan") and len(keep) > k:
+        eps_min, eps_max = suggest_eps_range(graph, k)
+        labels[keep], eps = dbscan_search(graph, n_clusters, eps_min, eps_max, min_samples=min_samples)
+        centroids, sizes = cluster_centroids(graph.points, labels[keep], kept_weights)
+        if method == "dbscan" or len(centroids) == n_clusters:
+            if surface is not None:
+                centroids = snap_to_surface(centroids, surface, surface_normals)
+            return CentroidResult(centroids, sizes, labels, "dbscan", eps)
+        if init is None and len(centroids):
+            init = kmeans_init(graph.points, centroids, n_clusters, sizes)
+
+    labels[keep] = kmeans_clusters(graph.points, n_clusters, seed, init=init, batch_size=kmeans_batch_size)
+    centroids, sizes = cluster_centroids(graph.points, labels[keep], kept_weights)
+    if surface is not None:
+        centroids = snap_to_surface(centroids, surface, surface_normals)
+    return CentroidResult(centroids, sizes, labels, "kmeans", None)
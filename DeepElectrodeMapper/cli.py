@@ -0,0 +1,229 @@
+"""Command line entry point.
+
+    deepelectrodemapper infer DATA_DIR --checkpoint model.weights.h5
+    deepelectrodemapper report DATA_DIR
+
+runs segmentation on every sub-XXX_* folder in DATA_DIR and writes
+{subj}_electrodes.txt (label x y z per line, the format the E3DTools apps
+read) next to each model_mesh.obj. Meshes are loaded and sampled by a process
+pool while the main process runs the model, so reading the next subjects
+overlaps with TensorFlow compute on the current one. `report` renders QC
+views and centroid statistics of those results, see report.py.
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+
+import numpy as np
+
+from DeepElectrodeMapper.data_io import ELECTRODE_LABEL, FIDUCIAL_LABELS, read_coordinates, write_coordinates
+from DeepElectrodeMapper.preprocessing import load_preprocessed
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def find_subjects(data_dir):
+    """Return (subj_id, folder) for every sub-XXX_* folder holding a model_mesh.obj."""
+    subjects = []
+    for name in sorted(os.listdir(data_dir)):
+        folder = os.path.join(data_dir, name)
+        if name.startswith("sub-") and os.path.isfile(os.path.join(folder, "model_mesh.obj")):
+            subjects.append((name.split("_")[0], folder))
+    return subjects
+
+
+def load_subject(subj, folder, num_points, voxel_size=None, normals=False, use_cache=True, cache_dir=None,
+                 surface_samples=None, seed=0):
+    """Worker side of the pipeline: load a subject mesh, preprocess it and sample its points.
+
+    Returns (subj, folder, points, normals), normals is None unless requested.
+    """
+    obj_file = os.path.join(folder, "model_mesh.obj")
+    cloud = load_preprocessed(obj_file, voxel_size=voxel_size, normals=normals, use_cache=use_cache,
+                              cache_dir=cache_dir, surface_samples=surface_samples, seed=seed)
+    points, point_normals = cloud["points"], cloud.get("normals")
+    if num_points and len(points) > num_points:
+        rng = np.random.default_rng(seed)
+        keep = np.sort(rng.choice(len(points), num_points, replace=False))
+        points = points[keep]
+        point_normals = None if point_normals is None else point_normals[keep]
+    return subj, folder, np.asarray(points), None if point_normals is None else np.asarray(point_normals)
+
+
+def iter_loaded(subjects, workers, **load_args):
+    """Yield load_subject results in order, keeping at most 2*workers subjects in flight."""
+    if workers <= 1:
+        for subj, folder in subjects:
+            yield load_subject(subj, folder, **load_args)
+        return
+    # spawn, so the workers never inherit an initialised TensorFlow runtime
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+        pending = deque()
+        todo = iter(subjects)
+
+        def submit_next():
+            item = next(todo, None)
+            if item is not None:
+                pending.append(pool.submit(load_subject, item[0], item[1], **load_args))
+
+        for _ in range(2 * workers):
+            submit_next()
+        while pending:
+            result = pending.popleft().result()
+            submit_next()
+            yield result
+
+
+def build_predict_fn(checkpoint, num_class):
+    """Load the Keras segmentation model and return its compiled inference function."""
+    sys.path.append(os.path.join(ROOT_DIR, "pointnet2", "models"))
+    import tensorflow as tf
+    import pointnet2_sem_seg
+
+    model = pointnet2_sem_seg.SemSegModel(num_class)
+    model(tf.zeros((1, 1024, 3)), training=False)  # create the variables before loading
+    model.load_weights(checkpoint)
+    return pointnet2_sem_seg.get_inference_fn(model)
+
+
+def extract_coordinates(points, labels, n_electrodes, method="auto", template=None, probabilities=None,
+                        snap=False, normals=None, seed=0):
+    """Turn per-point labels into (label, xyz) rows: fiducial means, then electrode centroids.
+
+    template: optional (label, xyz) rows of template electrode positions aligned to
+    the scan. They seed the KMeans fallback and name the centroids when it is used.
+    probabilities: optional (N, num_class) class probabilities, weighting each point
+    by the probability of its label. snap: move the electrode centroids onto the scan,
+    onto the tangent planes of the points if their (N, 3) normals are given.
+    """
+    from DeepElectrodeMapper.centroids import find_centroids
+
+    rows = []
+    for name, code in FIDUCIAL_LABELS.items():
+        mask = labels == code
+        if mask.any():
+            weights = None if probabilities is None else probabilities[mask, code]
+            rows.append((name, np.average(points[mask], axis=0, weights=weights)))
+    template = [(name, xyz) for name, xyz in template or [] if name not in FIDUCIAL_LABELS]
+    positions = np.array([xyz for _, xyz in template]).reshape(-1, 3) if template else None
+    mask = labels == ELECTRODE_LABEL
+    weights = None if probabilities is None else probabilities[mask, ELECTRODE_LABEL]
+    result = find_centroids(points[mask], n_electrodes, method, weights=weights, seed=seed, template=positions,
+                            surface=points if snap else None, surface_normals=normals)
+    names = [f"E{i + 1}" for i in range(len(result.centroids))]
+    if result.method == "kmeans" and len(template) == len(result.centroids):
+        names = [name for name, _ in template]
+    rows.extend(zip(names, result.centroids))
+    return rows
+
+
+def infer(args):
+    from DeepElectrodeMapper.inference import class_probabilities, predict_cloud
+
+    if not os.path.isfile(args.checkpoint):
+        print(f"Checkpoint {args.checkpoint} not found")
+        return 1
+    subjects = find_subjects(args.data_dir)
+    if not subjects:
+        print(f"No sub-XXX_* folders with a model_mesh.obj found in {args.data_dir}")
+        return 1
+    print(f"Found {len(subjects)} subjects")
+    if args.output_dir:
+        # results are named by subject ID, two folders of one subject would overwrite each other
+        folders = {}
+        for subj, folder in subjects:
+            folders.setdefault(subj, []).append(os.path.basename(folder))
+        duplicates = {subj: names for subj, names in folders.items() if len(names) > 1}
+        if duplicates:
+            for subj, names in duplicates.items():
+                print(f"{subj} has several folders: {', '.join(names)}")
+            print("Their results would overwrite each other in --output-dir, "
+                  "run them separately or write the results into the subject folders")
+            return 1
+
+    predict_fn = build_predict_fn(args.checkpoint, args.num_class)
+    loaded = iter_loaded(subjects, args.workers, num_points=args.num_points, voxel_size=args.voxel_size,
+                         normals=args.snap, use_cache=not args.no_cache, cache_dir=args.cache_dir,
+                         surface_samples=args.surface_samples)
+    for subj, folder, points, normals in loaded:
+        start = time.time()
+        scores = predict_cloud(points, predict_fn, block_size=args.block_size, stride=args.stride,
+                               num_point=args.block_points, batch_size=args.batch_size,
+                               aggregate=args.aggregate)
+        labels = scores.argmax(axis=1)
+        template = None
+        if args.template:
+            template_file = os.path.join(folder, args.template.format(subj=subj))
+            if os.path.isfile(template_file):
+                template = read_coordinates(template_file)
+        rows = extract_coordinates(points, labels, args.n_electrodes, args.centroid_method, template,
+                                   class_probabilities(scores, args.aggregate), args.snap, normals)
+
+        out_dir = args.output_dir or folder
+        os.makedirs(out_dir, exist_ok=True)
+        write_coordinates(os.path.join(out_dir, f"{subj}_electrodes.txt"), rows)
+        if args.save_points:
+            np.savez_compressed(os.path.join(out_dir, f"{subj}_segmentation.npz"),
+                                points=points, labels=labels, scores=scores.astype(np.float32))
+        print(f"{subj}: {len(points)} points, {int((labels == ELECTRODE_LABEL).sum())} electrode points, "
+              f"{len(rows)} coordinates ({time.time() - start:.1f}s)")
+    return 0
+
+
+def report(args):
+    from DeepElectrodeMapper.report import build_report
+
+    html_file = build_report(args.results_dir, args.output_dir, args.n_electrodes, args.workers)
+    print(f"Wrote {html_file}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="deepelectrodemapper")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("infer", help="segment every sub-XXX_* folder and write electrode coordinates")
+    p.add_argument("data_dir", help="directory holding the sub-XXX_* subject folders")
+    p.add_argument("--checkpoint", required=True, help="Keras weights of the segmentation model")
+    p.add_argument("--output-dir", help="write results here instead of into each subject folder")
+    p.add_argument("--num-class", type=int, default=5)
+    p.add_argument("--num-points", type=int, default=200000, help="points sampled per subject (0 keeps all)")
+    p.add_argument("--surface-samples", type=int,
+                   help="sample this many points over the mesh surface instead of using its vertices")
+    p.add_argument("--voxel-size", type=float, help="voxel downsample the mesh points first (same units as the mesh)")
+    p.add_argument("--block-size", type=float, default=0.1)
+    p.add_argument("--stride", type=float, default=0.05)
+    p.add_argument("--block-points", type=int, default=4096, help="points per block fed to the model")
+    p.add_argument("--batch-size", type=int, default=16, help="blocks per model call")
+    p.add_argument("--aggregate", choices=["mean", "vote"], default="mean")
+    p.add_argument("--n-electrodes", type=int, default=126)
+    p.add_argument("--centroid-method", choices=["auto", "kmeans", "dbscan"], default="auto",
+                   help="clustering of the electrode points, auto uses DBSCAN if it finds --n-electrodes clusters")
+    p.add_argument("--template", help="per-subject file of template electrode positions seeding KMeans, "
+                                      "e.g. '{subj}_aligned_electrodes.txt'")
+    p.add_argument("--snap", action="store_true", help="snap the electrode centroids onto the scanned surface")
+    p.add_argument("--workers", type=int, default=max(1, min(4, (os.cpu_count() or 2) - 1)),
+                   help="processes loading meshes")
+    p.add_argument("--cache-dir", help="where to keep the preprocessed clouds (default: .dem_cache in each subject folder)")
+    p.add_argument("--no-cache", action="store_true", help="always re-parse the meshes")
+    p.add_argument("--save-points", action="store_true", help="also save points, labels and scores as .npz")
+    p.set_defaults(func=infer)
+
+    p = subparsers.add_parser("report", help="render QC views and centroid statistics of inferred subjects")
+    p.add_argument("results_dir", help="directory searched for {subj}_electrodes.txt (and {subj}_segmentation.npz)")
+    p.add_argument("--output-dir", help="where to write the report (default: RESULTS_DIR/qc_report)")
+    p.add_argument("--n-electrodes", type=int, default=126)
+    p.add_argument("--workers", type=int, default=max(1, min(4, (os.cpu_count() or 2) - 1)),
+                   help="processes rendering subjects")
+    p.set_defaults(func=report)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""Readers and writers of the files shared by the pipeline stages.
+
+Meshes are OBJ files, and electrode coordinates are text files with one
+`label x y z` row per electrode or fiducial, the format the E3DTools apps read.
+"""
+import numpy as np
+
+# label codes used when building the training data
+FIDUCIAL_LABELS = {"lhj": 2, "rhj": 3, "nas": 4}
+ELECTRODE_LABEL = 1
+
+
+def read_obj_records(obj_file, keys=("v",)):
+    """Group the lines of an OBJ file by record type, {key: [rest of line, ...]} for the given keys.
+
+    Fields may be separated by any whitespace.
+    """
+    records = {key: [] for key in keys}
+    with open(obj_file, "r") as f:
+        for line in f:
+            fields = line.split(None, 1)
+            if fields and fields[0] in records:
+                records[fields[0]].append(fields[1] if len(fields) > 1 else "")
+    return records
+
+
+def parse_obj_rows(lines, columns, dtype=np.float64):
+    """The first columns fields of each OBJ record as an (N, columns) array, or None if there are none."""
+    if not lines:
+        return None
+    return np.loadtxt(lines, usecols=range(columns), dtype=dtype, ndmin=2)
+
+
+def load_obj_vertices(obj_file):
+    """Read the vertex positions of an OBJ file as an (N, 3) float32 array."""
+    vertices = parse_obj_rows(read_obj_records(obj_file)["v"], 3, np.float32)
+    return np.zeros((0, 3), dtype=np.float32) if vertices is None else vertices
+
+
+def read_coordinates(txt_file):
+    """Read (label, xyz) rows as written by write_coordinates."""
+    rows = []
+    with open(txt_file, "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 4:
+                rows.append((fields[0], np.array([float(v) for v in fields[1:]])))
+    return rows
+
+
+def write_coordinates(txt_file, rows):
+    with open(txt_file, "w") as f:
+        for label, (x, y, z) in rows:
+            f.write(f"{label}\t{x:.6f}\t{y:.6f}\t{z:.6f}\n")
@@ -0,0 +1,123 @@
+"""Whole-head inference with the PointNet++ segmentation model.
+
+A head scan has around 200k points, while the model is trained on blocks of a
+few thousand. The cloud is tiled into overlapping cubic blocks, the blocks are
+run through the model in batches, and the per-point logits are merged back
+onto the original points, by averaging or by voting.
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def make_blocks(points, block_size=0.1, stride=0.05, num_point=4096, min_points=32, seed=0,
+                chunk_pairs=1 << 22):
+    """Tile a cloud into cubes of side block_size, placed every stride along each axis.
+
+    A block with more than num_point points is split into several samples, so
+    every point in it is used at least once. Smaller blocks are padded by
+    repeating points. Blocks with fewer than min_points points are skipped.
+    The candidate (point, block) pairs are tested about chunk_pairs at a time.
+
+    Returns (indices, centers): an (n_samples, num_point) array of indices into
+    points and the (n_samples, 3) centre of the block each sample came from.
+    """
+    points = np.asarray(points)
+    rng = np.random.default_rng(seed)
+    lo = points.min(axis=0)
+    extent = points.max(axis=0) - lo
+    n_steps = np.maximum(np.ceil((extent - block_size) / stride), 0).astype(np.int64) + 1
+    reach = int(np.floor(block_size / stride)) + 1
+
+    # every (point, block) pair: a point lies in the blocks whose origin is at
+    # most block_size below it, i.e. the last `reach` origins along each axis
+    last = np.minimum(np.floor((points - lo) / stride).astype(np.int64), n_steps - 1)
+    offsets = np.stack(np.meshgrid(*[np.arange(reach)] * 3, indexing='ij'), -1).reshape(-1, 3)
+    chunk = max(1, chunk_pairs // len(offsets))
+    point_idx, keys = [], []
+    for start in range(0, len(points), chunk):
+        cells = last[start:start + chunk, None, :] - offsets[None, :, :]  # (chunk, reach**3, 3)
+        inside = np.all((cells >= 0) & (points[start:start + chunk, None, :] <= lo + cells * stride + block_size),
+                        axis=-1)
+        rows, _ = np.nonzero(inside)
+        point_idx.append(rows + start)
+        keys.append(np.ravel_multi_index(cells[inside].T, n_steps))
+    point_idx, keys = np.concatenate(point_idx), np.concatenate(keys)
+
+    order = np.argsort(keys, kind='stable')
+    keys, point_idx = keys[order], point_idx[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)]
+
+    indices, centers = [], []
+    for start, end in zip(starts, ends):
+        count = end - start
+        if count < min_points:
+            continue
+        members = point_idx[start:end][rng.permutation(count)]
+        n_samples = -(-count // num_point)
+        pad = n_samples * num_point - count
+        members = np.concatenate([members, members[rng.integers(0, count, pad)]])
+        indices.append(members.reshape(n_samples, num_point))
+        origin = lo + np.array(np.unravel_index(keys[start], n_steps)) * stride
+        centers.append(np.repeat((origin + block_size / 2)[None], n_samples, 0))
+    if not indices:
+        return np.zeros((0, num_point), dtype=np.int64), np.zeros((0, 3))
+    return np.concatenate(indices), np.concatenate(centers)
+
+
+def predict_cloud(points, predict_fn, block_size=0.1, stride=0.05, num_point=4096, batch_size=16,
+                  aggregate='mean', min_points=32, seed=0):
+    """Segment a whole cloud by running predict_fn on overlapping blocks.
+
+    predict_fn takes a (B, num_point, 3) float32 array of block-centred points
+    and returns (B, num_point, num_class) logits. pointnet2_sem_seg.get_inference_fn
+    returns such a function. With aggregate='mean' the logits of every block a
+    point falls in are averaged. With 'vote' each block casts one vote for its
+    argmax class. Points in no block take the scores of their nearest covered
+    neighbour.
+
+    Returns an (N, num_class) float array. Its argmax over axis 1 gives the per-point labels.
+    """
+    if aggregate not in ('mean', 'vote'):
+        raise ValueError(f"aggregate must be 'mean' or 'vote', got {aggregate!r}")
+    points = np.asarray(points, dtype=np.float32)
+    n = len(points)
+    indices, centers = make_blocks(points, block_size, stride, num_point, min_points, seed)
+    if len(indices) == 0:
+        raise ValueError("No block has enough points, lower min_points or increase block_size")
+
+    scores = None
+    counts = np.zeros(n)
+    for s in range(0, len(indices), batch_size):
+        idx = indices[s:s + batch_size]
+        batch = points[idx] - centers[s:s + batch_size, None, :].astype(np.float32)
+        logits = np.asarray(predict_fn(batch))
+        num_class = logits.shape[-1]
+        if scores is None:
+            scores = np.zeros((n, num_class))
+        flat_idx = idx.ravel()
+        if aggregate == 'vote':
+            votes = logits.reshape(-1, num_class).argmax(-1)
+            scores += np.bincount(flat_idx * num_class + votes, minlength=n * num_class).reshape(n, num_class)
+        else:
+            logits = logits.reshape(-1, num_class)
+            for c in range(num_class):
+                scores[:, c] += np.bincount(flat_idx, weights=logits[:, c], minlength=n)
+        counts += np.bincount(flat_idx, minlength=n)
+
+    covered = counts > 0
+    scores[covered] /= counts[covered, None]
+    if not covered.all():
+        _, nearest = cKDTree(points[covered]).query(points[~covered])
+        scores[~covered] = scores[covered][nearest]
+    return scores
+
+
+def class_probabilities(scores, aggregate='mean'):
+    """Per-point class probabilities from predict_cloud scores: the softmax of the
+    averaged logits, or the vote fractions for aggregate='vote'."""
+    scores = np.asarray(scores, dtype=np.float64)
+    if aggregate == 'vote':
+        return scores / np.maximum(scores.sum(axis=1, keepdims=True), 1e-12)
+    exp = np.exp(scores - scores.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
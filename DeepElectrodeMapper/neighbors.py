@@ -0,0 +1,131 @@
+"""Neighbourhoods of a point cloud, computed once and shared.
+
+The k-distance statistics, the DBSCAN eps search and outlier filtering all
+need the neighbours of every point. NeighborGraph builds one KD-tree per cloud,
+caches the k-nearest-neighbour table and the sparse radius graph, and answers
+smaller k or radius queries from the cache. Queries run over chunks of
+chunk_size points, which bounds the temporary memory, and the kNN queries use
+`workers` threads. subset() drops points, e.g. outliers, without building a
+second tree: it shares the KD-tree and keeps the cached neighbours of the
+remaining points.
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class NeighborGraph:
+    """KD-tree over an (N, 3) cloud with cached kNN and radius neighbourhoods."""
+
+    def __init__(self, points, chunk_size=65536, workers=-1):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.tree = cKDTree(self.points)
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self._knn = None
+        self._radius = None
+        self._tree_index = None  # tree point -> index in self.points, -1 if dropped; None for all points
+
+    def __len__(self):
+        return len(self.points)
+
+    def subset(self, keep):
+        """Graph of points[keep] (indices or a boolean mask) sharing this graph's KD-tree.
+
+        Cached kNN rows of the kept points are reused, minus the dropped
+        neighbours. Rows left with too few neighbours are queried again.
+        """
+        keep = np.asarray(keep)
+        keep = np.flatnonzero(keep) if keep.dtype == bool else keep
+        graph = NeighborGraph.__new__(NeighborGraph)
+        graph.points = self.points[keep]
+        graph.tree = self.tree
+        graph.chunk_size = self.chunk_size
+        graph.workers = self.workers
+        graph._radius = None
+        new_index = np.full(len(self), -1, dtype=np.int64)
+        new_index[keep] = np.arange(len(keep))
+        graph._tree_index = new_index if self._tree_index is None else \
+            np.where(self._tree_index >= 0, new_index[np.maximum(self._tree_index, 0)], -1)
+        graph._knn = None
+        if self._knn is not None:
+            distances, indices = self._knn
+            graph._knn = graph._compact(distances[keep], new_index[indices[keep]], indices.shape[1])
+        return graph
+
+    @staticmethod
+    def _compact(distances, indices, k):
+        """Move the neighbours with index -1 to the end of each row and keep k columns."""
+        order = np.argsort(indices < 0, axis=1, kind="stable")[:, :k]
+        distances = np.take_along_axis(distances, order, axis=1)
+        indices = np.take_along_axis(indices, order, axis=1)
+        distances[indices < 0] = np.inf
+        return distances, indices
+
+    def _query(self, rows, k):
+        """k nearest kept neighbours of points[rows], padded with index -1 when there are fewer."""
+        n_hidden = 0 if self._tree_index is None else self.tree.n - len(self)
+        k_query = min(k + n_hidden, self.tree.n)
+        distances = np.empty((len(rows), k_query))
+        indices = np.empty((len(rows), k_query), dtype=np.int64)
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            d, i = self.tree.query(self.points[rows[chunk]], k=k_query, workers=self.workers)
+            distances[chunk], indices[chunk] = d.reshape(-1, k_query), i.reshape(-1, k_query)
+        if self._tree_index is not None:
+            indices = self._tree_index[indices]
+        if k_query < k:
+            pad = k - k_query
+            distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=np.inf)
+            indices = np.pad(indices, ((0, 0), (0, pad)), constant_values=-1)
+        return self._compact(distances, indices, k)
+
+    def knn(self, k):
+        """(N, k) distances and indices of the k nearest neighbours, the point itself first."""
+        k = min(k, len(self))
+        if self._knn is None or self._knn[0].shape[1] < k:
+            self._knn = self._query(np.arange(len(self)), k)
+        distances, indices = self._knn
+        missing = np.flatnonzero(indices[:, k - 1] < 0) if k else []
+        if len(missing):  # rows of a subset that lost some of their cached neighbours
+            distances[missing], indices[missing] = self._query(missing, distances.shape[1])
+        return distances[:, :k], indices[:, :k]
+
+    def k_distance(self, k):
+        """Distance of every point to its k-th nearest neighbour, counting the point itself."""
+        return self.knn(k)[0][:, k - 1]
+
+    def radius_pairs(self, radius):
+        """All pairs (i < j) within radius, as an (M, 2) index array and their (M,) distances."""
+        if self._radius is None or self._radius[0] < radius:
+            pairs, distances = [], []
+            for start in range(0, len(self), self.chunk_size):
+                chunk_tree = cKDTree(self.points[start:start + self.chunk_size])
+                found = chunk_tree.sparse_distance_matrix(self.tree, radius, output_type="ndarray")
+                i = found["i"] + start
+                j = found["j"] if self._tree_index is None else self._tree_index[found["j"]]
+                keep = i < j  # also drops the points left out of a subset (-1)
+                pairs.append(np.stack([i[keep], j[keep]], axis=1))
+                distances.append(found["v"][keep])
+            pairs = np.concatenate(pairs) if pairs else np.zeros((0, 2), dtype=np.int64)
+            distances = np.concatenate(distances) if distances else np.zeros(0)
+            self._radius = (radius, pairs, distances)
+        cached_radius, pairs, distances = self._radius
+        if cached_radius == radius:
+            return pairs, distances
+        within = distances <= radius
+        return pairs[within], distances[within]
+
+    def radius_counts(self, radius):
+        """Number of points within radius of every point, the point itself included."""
+        pairs, _ = self.radius_pairs(radius)
+        return 1 + np.bincount(pairs[:, 0], minlength=len(self)) + np.bincount(pairs[:, 1], minlength=len(self))
+
+    def statistical_outliers(self, k=20, std_ratio=2.0):
+        """Points whose mean distance to their k neighbours is more than std_ratio standard
+        deviations above the average, as Open3D's remove_statistical_outlier."""
+        mean_distance = self.knn(k + 1)[0][:, 1:].mean(axis=1)
+        return mean_distance > mean_distance.mean() + std_ratio * mean_distance.std()
+
+    def radius_outliers(self, radius, min_neighbors=5):
+        """Points with fewer than min_neighbors other points within radius."""
+        return self.radius_counts(radius) - 1 < min_neighbors
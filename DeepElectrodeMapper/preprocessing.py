@@ -0,0 +1,138 @@
+"""Preprocessing of scanned point clouds shared by every stage.
+
+Voxel downsampling (as Open3D's voxel_down_sample) and normal estimation
+(PCA over the k nearest neighbours, flipped to point away from the centroid
+of the cloud) in NumPy/SciPy, with no GUI stack needed. Meshes can also be
+sampled over their surface first (see mesh_sampling.py). load_preprocessed
+caches the result next to the source file (see cache.py), keyed by the
+settings. Segmentation and clustering then read the same preprocessed cloud
+instead of recomputing it.
+"""
+import numpy as np
+
+from DeepElectrodeMapper.cache import load_cached
+from DeepElectrodeMapper.data_io import load_obj_vertices
+from DeepElectrodeMapper.neighbors import NeighborGraph
+
+ORIENTATIONS = ("outward", "inward", None)
+
+
+def voxel_downsample(points, voxel_size, normals=None, colors=None, labels=None):
+    """Replace the points of every occupied voxel by their mean.
+
+    Voxels are found by hashing the integer voxel coordinates of each point,
+    with np.unique giving the voxel of every point. Normals and colours are
+    averaged, labels take the most common label of the voxel. Returns a dict
+    with 'points' and the optional fields that were given.
+    """
+    points = np.asarray(points)
+    cells = np.floor((points - points.min(axis=0)) / voxel_size).astype(np.int64)
+    keys = np.ravel_multi_index(cells.T, cells.max(axis=0) + 1)
+    _, index, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    n_voxels = len(counts)
+
+    def voxel_mean(values):
+        values = np.asarray(values, dtype=np.float64)
+        return np.stack([np.bincount(index, weights=values[:, d], minlength=n_voxels)
+                         for d in range(values.shape[1])], axis=1) / counts[:, None]
+
+    result = {"points": voxel_mean(points).astype(points.dtype)}
+    if normals is not None:
+        mean_normals = voxel_mean(normals)
+        result["normals"] = mean_normals / np.maximum(np.linalg.norm(mean_normals, axis=1, keepdims=True), 1e-12)
+    if colors is not None:
+        result["colors"] = np.round(voxel_mean(colors)).astype(np.asarray(colors).dtype)
+    if labels is not None:
+        labels = np.asarray(labels)
+        label_values, label_index = np.unique(labels, return_inverse=True)
+        votes = np.bincount(index * len(label_values) + label_index, minlength=n_voxels * len(label_values))
+        result["labels"] = label_values[votes.reshape(n_voxels, -1).argmax(axis=1)]
+    return result
+
+
+def estimate_normals(points, k=30, orient="outward", graph=None, chunk_size=65536):
+    """Unit normals from the smallest principal axis of the k nearest neighbours of each point.
+
+    orient 'outward' (or 'inward') flips normals to point away from (towards)
+    the centroid of the cloud, None leaves the PCA sign. graph: a NeighborGraph
+    of the points to reuse. The covariances are computed chunk_size points at a time.
+    """
+    if orient not in ORIENTATIONS:
+        raise ValueError(f"orient must be one of {ORIENTATIONS}, got {orient!r}")
+    points = np.asarray(points, dtype=np.float64)
+    graph = graph if graph is not None else NeighborGraph(points)
+    _, neighbors = graph.knn(min(k, len(points)))
+    normals = np.empty_like(points)
+    for start in range(0, len(points), chunk_size):
+        local = points[neighbors[start:start + chunk_size]]
+        local -= local.mean(axis=1, keepdims=True)
+        _, vectors = np.linalg.eigh(np.einsum("nki,nkj->nij", local, local))
+        normals[start:start + chunk_size] = vectors[:, :, 0]
+    if orient is not None:
+        inward = np.sum(normals * (points - points.mean(axis=0)), axis=1) < 0
+        normals[inward if orient == "outward" else ~inward] *= -1
+    return normals
+
+
+def preprocess(points, voxel_size=None, normals=True, k=30, orient="outward", colors=None, labels=None,
+               point_normals=None):
+    """Voxel downsample (if voxel_size) and estimate normals (if normals). Returns a dict of arrays.
+
+    point_normals: normals that came with the points, e.g. from mesh sampling,
+    kept (averaged per voxel) instead of estimating new ones.
+    """
+    if voxel_size:
+        result = voxel_downsample(points, voxel_size, normals=point_normals if normals else None,
+                                  colors=colors, labels=labels)
+    else:
+        result = {"points": np.asarray(points), "normals": point_normals if normals else None,
+                  "colors": colors, "labels": labels}
+        result = {name: value for name, value in result.items() if value is not None}
+    if normals and "normals" not in result and len(result["points"]):
+        result["normals"] = estimate_normals(result["points"], k, orient)
+    return result
+
+
+def load_points(source_file, surface_samples=None, seed=0):
+    """Read an OBJ or PLY file: a dict with 'points' and, if present, 'normals' and 'colors'.
+
+    With surface_samples, an OBJ mesh is sampled uniformly over its surface
+    (see mesh_sampling.sample_mesh) instead of returning its vertices.
+    """
+    if source_file.lower().endswith(".obj"):
+        if surface_samples:
+            from DeepElectrodeMapper.mesh_sampling import sample_mesh
+
+            return sample_mesh(source_file, surface_samples, seed=seed)
+        return {"points": load_obj_vertices(source_file)}
+    from plyfile import PlyData
+
+    vertex = PlyData.read(source_file)["vertex"].data
+    data = {"points": np.stack([vertex["x"], vertex["y"], vertex["z"]], axis=1)}
+    if all(name in vertex.dtype.names for name in ("red", "green", "blue")):
+        data["colors"] = np.stack([vertex["red"], vertex["green"], vertex["blue"]], axis=1)
+    return data
+
+
+def load_preprocessed(source_file, voxel_size=None, normals=True, k=30, orient="outward",
+                      use_cache=True, cache_dir=None, surface_samples=None, seed=0):
+    """Load and preprocess a cloud, reusing the cached result for the same file and settings.
+
+    surface_samples and seed are passed to load_points. Returns a dict with
+    'points' and, when available, 'normals', 'colors' and 'labels'. The arrays
+    are memory-mapped when the cache is used.
+    """
+    def loader(path):
+        data = load_points(path, surface_samples, seed)
+        return preprocess(data["points"], voxel_size, normals, k, orient, colors=data.get("colors"),
+                          labels=data.get("labels"), point_normals=data.get("normals"))
+
+    if not use_cache:
+        return loader(source_file)
+    tag = f"voxel{voxel_size or 0:g}" + (f"_normals{k}{orient or ''}" if normals else "")
+    if surface_samples:
+        tag = f"surface{surface_samples}_seed{seed}_" + tag
+    cache = load_cached(source_file, loader, cache_dir, tag=tag)
+    return {name: getattr(cache, name) for name in ("points", "normals", "colors", "labels")
+            if getattr(cache, name) is not None}
+
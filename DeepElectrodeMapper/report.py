@@ -0,0 +1,207 @@
+"""Headless QC report for a batch of segmented subjects.
+
+    deepelectrodemapper report RESULTS_DIR
+
+looks for the {subj}_electrodes.txt files written by `deepelectrodemapper infer`
+(and the {subj}_segmentation.npz files written with --save-points) under
+RESULTS_DIR. For each subject it renders three views of the segmented cloud
+and the centroids, and computes the centroid statistics printed by
+tests/finding_centroids.py. Subjects are processed by a process pool. The
+result is one folder per study holding index.html, report.json and one PNG
+per subject, plus a top-level index.html linking the studies. A study is the
+folder holding the sub-XXX_* subject folders, or the folder holding the
+results themselves when they were written with --output-dir.
+"""
+import html
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import pdist
+
+from DeepElectrodeMapper.data_io import ELECTRODE_LABEL, FIDUCIAL_LABELS, read_coordinates
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# RGB colours of the rendered layers
+SCAN_COLOR = np.array([0.8, 0.8, 0.8])
+ELECTRODE_COLOR = np.array([0.9, 0.15, 0.1])
+CENTROID_COLOR = np.array([1.0, 0.85, 0.0])
+
+
+def find_results(results_dir):
+    """Return (subj_id, electrodes_txt, segmentation_npz or None) for every subject under results_dir."""
+    results = []
+    for folder, _, files in os.walk(results_dir):
+        for name in files:
+            subj = name[:-len("_electrodes.txt")]
+            if name.endswith("_electrodes.txt") and "_" not in subj:  # not {subj}_aligned_electrodes.txt
+                npz_file = os.path.join(folder, f"{subj}_segmentation.npz")
+                results.append((subj, os.path.join(folder, name), npz_file if os.path.isfile(npz_file) else None))
+    return sorted(results)
+
+
+def study_name(results_dir, txt_file):
+    """Name of the study a result file belongs to, relative to results_dir."""
+    folder = os.path.dirname(os.path.abspath(txt_file))
+    study_dir = os.path.dirname(folder) if os.path.basename(folder).startswith("sub-") else folder
+    name = os.path.relpath(study_dir, os.path.abspath(results_dir))
+    if name == "." or name.startswith(".."):
+        name = os.path.basename(study_dir)
+    return name
+
+
+def centroid_stats(centroids, target=None):
+    """Centroid count against the target, and the distances between centroids."""
+    stats = {"n_centroids": len(centroids), "target": target}
+    if len(centroids) > 1:
+        distances = pdist(centroids)
+        nearest, _ = cKDTree(centroids).query(centroids, k=2)
+        stats.update(min_distance=float(distances.min()), mean_distance=float(distances.mean()),
+                     max_distance=float(distances.max()), mean_nearest=float(nearest[:, 1].mean()))
+    return stats
+
+
+def render_views(points=None, labels=None, centroids=None, canvas_size=300):
+    """Three RGB views (canvas_size x 3*canvas_size x 3, floats in [0, 1]): the scan in grey,
+    electrode points in red and centroids as yellow disks."""
+    sys.path.append(os.path.join(ROOT_DIR, "pointnet2", "utils"))
+    import pc_util
+
+    layers = []
+    if points is not None and len(points):
+        layers.append((points, SCAN_COLOR, 3))
+        if labels is not None:
+            layers.append((points[labels == ELECTRODE_LABEL], ELECTRODE_COLOR, 3))
+    if centroids is not None and len(centroids):
+        layers.append((centroids, CENTROID_COLOR, 9))
+    image = np.zeros((canvas_size, 3 * canvas_size, 3))
+    if not layers:
+        return image
+
+    # normalise every layer with the first one, so they line up
+    reference = layers[0][0]
+    center = reference.mean(axis=0)
+    scale = np.linalg.norm(reference - center, axis=1).max() or 1.0
+    for layer_points, color, diameter in layers:
+        if len(layer_points) == 0:
+            continue
+        views = pc_util.point_cloud_three_views((layer_points - center) / scale, canvasSize=canvas_size,
+                                                space=0.45 * canvas_size, diameter=diameter, normalize=False)
+        drawn = views > 0
+        image[drawn] = (0.3 + 0.7 * views[drawn])[:, None] * color
+    return image
+
+
+def subject_report(subj, txt_file, npz_file, out_dir, n_electrodes=None, canvas_size=300, image_name=None):
+    """Worker side of the report: stats and rendered views of one subject, saved as out_dir/image_name."""
+    from PIL import Image
+
+    rows = read_coordinates(txt_file)
+    centroids = np.array([xyz for label, xyz in rows if label not in FIDUCIAL_LABELS]).reshape(-1, 3)
+    stats = centroid_stats(centroids, n_electrodes)
+    stats.update(subject=subj, source=txt_file, fiducials=[label for label, _ in rows if label in FIDUCIAL_LABELS])
+
+    points = labels = None
+    if npz_file is not None:
+        with np.load(npz_file) as data:
+            points, labels = data["points"], data["labels"]
+        stats.update(n_points=int(len(points)), n_electrode_points=int((labels == ELECTRODE_LABEL).sum()))
+
+    image = render_views(points, labels, centroids, canvas_size)
+    stats["image"] = image_name or f"{subj}.png"
+    Image.fromarray(np.uint8(image * 255.0)).save(os.path.join(out_dir, stats["image"]))
+    return stats
+
+
+def _format(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.6f}"
+    return html.escape(str(value))
+
+
+def write_html(html_file, reports, title="DeepElectrodeMapper QC report"):
+    """One table row per subject, rows whose centroid count or fiducials are off are highlighted."""
+    columns = [("n_points", "points"), ("n_electrode_points", "electrode points"),
+               ("min_distance", "min distance"), ("mean_nearest", "mean NN distance"),
+               ("mean_distance", "mean distance")]
+    lines = ["<!DOCTYPE html>", "<html><head><meta charset='utf-8'>", f"<title>{html.escape(title)}</title>",
+             "<style>body{font-family:sans-serif} table{border-collapse:collapse} "
+             "td,th{border:1px solid #ccc;padding:4px 8px;text-align:right} "
+             "tr.warn td{background:#fde2e1} img{max-width:900px}</style>",
+             "</head><body>", f"<h1>{html.escape(title)}</h1>",
+             "<table><tr><th>subject</th><th>centroids</th><th>fiducials</th>"
+             + "".join(f"<th>{name}</th>" for _, name in columns) + "<th>views</th></tr>"]
+    for report in reports:
+        missing = [name for name in FIDUCIAL_LABELS if name not in report["fiducials"]]
+        off_target = report["target"] is not None and report["n_centroids"] != report["target"]
+        count = str(report["n_centroids"]) + (f" / {report['target']}" if report["target"] is not None else "")
+        lines.append(f"<tr class='{'warn' if off_target or missing else 'ok'}'>"
+                     f"<td>{html.escape(report['subject'])}</td><td>{count}</td>"
+                     f"<td>{'missing ' + ', '.join(missing) if missing else 'ok'}</td>"
+                     + "".join(f"<td>{_format(report.get(key))}</td>" for key, _ in columns)
+                     + f"<td><img src='{html.escape(report['image'])}'></td></tr>")
+    lines += ["</table>", "</body></html>"]
+    with open(html_file, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_index(html_file, studies, title="DeepElectrodeMapper QC report"):
+    """One row per study: subjects, subjects to check, and a link to the study report."""
+    lines = ["<!DOCTYPE html>", "<html><head><meta charset='utf-8'>", f"<title>{html.escape(title)}</title>",
+             "<style>body{font-family:sans-serif} table{border-collapse:collapse} "
+             "td,th{border:1px solid #ccc;padding:4px 8px}</style>",
+             "</head><body>", f"<h1>{html.escape(title)}</h1>",
+             "<table><tr><th>study</th><th>subjects</th><th>to check</th></tr>"]
+    for name, link, reports in studies:
+        warnings = sum(report["target"] is not None and report["n_centroids"] != report["target"]
+                       or any(label not in report["fiducials"] for label in FIDUCIAL_LABELS) for report in reports)
+        lines.append(f"<tr><td><a href='{html.escape(link)}'>{html.escape(name)}</a></td>"
+                     f"<td>{len(reports)}</td><td>{warnings}</td></tr>")
+    lines += ["</table>", "</body></html>"]
+    with open(html_file, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def build_report(results_dir, out_dir=None, n_electrodes=126, workers=1, canvas_size=300):
+    """Write one bundle per study to out_dir/<study>: index.html, report.json and one PNG
+    per subject, and out_dir/index.html linking them. Returns the path of the top-level page."""
+    results = find_results(results_dir)
+    if not results:
+        raise ValueError(f"No *_electrodes.txt files found in {results_dir}")
+    out_dir = out_dir or os.path.join(results_dir, "qc_report")
+
+    studies = {}
+    jobs = []
+    for subj, txt_file, npz_file in results:
+        study = study_name(results_dir, txt_file)
+        images = studies.setdefault(study, [])
+        # the same subject can have several folders in a study, e.g. sub-001_scan and sub-001_rescan
+        image = f"{subj}.png" if f"{subj}.png" not in images else f"{subj}_{len(images)}.png"
+        images.append(image)
+        study_dir = os.path.join(out_dir, study)
+        os.makedirs(study_dir, exist_ok=True)
+        jobs.append((subj, txt_file, npz_file, study_dir, n_electrodes, canvas_size, image))
+    if workers <= 1:
+        reports = [subject_report(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            reports = list(pool.map(subject_report, *zip(*jobs)))
+
+    index = []
+    for study in sorted(studies):
+        study_dir = os.path.join(out_dir, study)
+        study_reports = [report for report, job in zip(reports, jobs) if job[3] == study_dir]
+        with open(os.path.join(study_dir, "report.json"), "w") as f:
+            json.dump(study_reports, f, indent=2)
+        write_html(os.path.join(study_dir, "index.html"), study_reports,
+                   title=f"DeepElectrodeMapper QC report: {study}")
+        index.append((study, os.path.join(study, "index.html").replace(os.sep, "/"), study_reports))
+    html_file = os.path.join(out_dir, "index.html")
+    write_index(html_file, index)
+    return html_file
@@ -9,15 +9,15 @@ import tf_util
 from pointnet_util import pointnet_sa_module, pointnet_sa_module_msg
 
 def placeholder_inputs(batch_size, num_point):
-    pointclouds_pl = tf.placeholder(tf.float32, shape=(batch_size, num_point, 3))
-    labels_pl = tf.placeholder(tf.int32, shape=(batch_size))
+    pointclouds_pl = tf.compat.v1.placeholder(tf.float32, shape=(batch_size, num_point, 3))
+    labels_pl = tf.compat.v1.placeholder(tf.int32, shape=(batch_size))
     return pointclouds_pl, labels_pl
 
 
 def get_model(point_cloud, is_training, bn_decay=None):
     """ Classification PointNet, input is BxNx3, output Bx40 """
-    batch_size = point_cloud.get_shape()[0].value
-    num_point = point_cloud.get_shape()[1].value
+    batch_size = tf.compat.dimension_value(point_cloud.get_shape()[0])
+    num_point = tf.compat.dimension_value(point_cloud.get_shape()[1])
     end_points = {}
 
     l0_xyz = point_cloud
@@ -44,8 +44,8 @@ def get_loss(pred, label, end_points):
         label: B, """
     loss = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=pred, labels=label)
     classify_loss = tf.reduce_mean(loss)
-    tf.summary.scalar('classify loss', classify_loss)
-    tf.add_to_collection('losses', classify_loss)
+    tf.compat.v1.summary.scalar('classify loss', classify_loss)
+    tf.compat.v1.add_to_collection('losses', classify_loss)
     return classify_loss
 
 
@@ -8,16 +8,14 @@ import numpy as np
 import tf_util
 from pointnet_util import pointnet_sa_module, pointnet_fp_module
 
-def placeholder_inputs(batch_size, num_point):
-    pointclouds_pl = tf.placeholder(tf.float32, shape=(batch_size, num_point, 6))
-    labels_pl = tf.placeholder(tf.int32, shape=(batch_size, num_point))
+def placeholder_inputs(batch_size=None, num_point=None):
+    pointclouds_pl = tf.compat.v1.placeholder(tf.float32, shape=(batch_size, num_point, 6))
+    labels_pl = tf.compat.v1.placeholder(tf.int32, shape=(batch_size, num_point))
     return pointclouds_pl, labels_pl
 
 
 def get_model(point_cloud, is_training, bn_decay=None):
     """ Part segmentation PointNet, input is BxNx6 (XYZ NormalX NormalY NormalZ), output Bx50 """
-    batch_size = point_cloud.get_shape()[0].value
-    num_point = point_cloud.get_shape()[1].value
     end_points = {}
     l0_xyz = tf.slice(point_cloud, [0,0,0], [-1,-1,3])
     l0_points = tf.slice(point_cloud, [0,0,3], [-1,-1,3])
@@ -46,8 +44,8 @@ def get_loss(pred, label):
         label: BxN, """
     loss = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=pred, labels=label)
     classify_loss = tf.reduce_mean(loss)
-    tf.summary.scalar('classify loss', classify_loss)
-    tf.add_to_collection('losses', classify_loss)
+    tf.compat.v1.summary.scalar('classify loss', classify_loss)
+    tf.compat.v1.add_to_collection('losses', classify_loss)
     return classify_loss
 
 if __name__=='__main__':
@@ -8,18 +8,17 @@ import numpy as np
 import tf_util
 from pointnet_util import pointnet_sa_module, pointnet_sa_module_msg, pointnet_fp_module
 
-def placeholder_inputs(batch_size, num_point):
-    pointclouds_pl = tf.placeholder(tf.float32, shape=(batch_size, num_point, 6))
-    labels_pl = tf.placeholder(tf.int32, shape=(batch_size, num_point))
-    cls_labels_pl = tf.placeholder(tf.int32, shape=(batch_size))
+def placeholder_inputs(batch_size=None, num_point=None):
+    pointclouds_pl = tf.compat.v1.placeholder(tf.float32, shape=(batch_size, num_point, 6))
+    labels_pl = tf.compat.v1.placeholder(tf.int32, shape=(batch_size, num_point))
+    cls_labels_pl = tf.compat.v1.placeholder(tf.int32, shape=(batch_size,))
     return pointclouds_pl, labels_pl, cls_labels_pl
 
 NUM_CATEGORIES = 16
 
 def get_model(point_cloud, cls_label, is_training, bn_decay=None):
     """ Classification PointNet, input is BxNx3, output Bx40 """
-    batch_size = point_cloud.get_shape()[0].value
-    num_point = point_cloud.get_shape()[1].value
+    num_point = tf.shape(point_cloud)[1]
     end_points = {}
     l0_xyz = tf.slice(point_cloud, [0,0,0], [-1,-1,3])
     l0_points = tf.slice(point_cloud, [0,0,3], [-1,-1,3])
@@ -34,7 +33,7 @@ def get_model(point_cloud, cls_label, is_training, bn_decay=None):
     l1_points = pointnet_fp_module(l1_xyz, l2_xyz, l1_points, l2_points, [256,128], is_training, bn_decay, scope='fa_layer2')
 
     cls_label_one_hot = tf.one_hot(cls_label, depth=NUM_CATEGORIES, on_value=1.0, off_value=0.0)
-    cls_label_one_hot = tf.reshape(cls_label_one_hot, [batch_size, 1, NUM_CATEGORIES])
+    cls_label_one_hot = tf.expand_dims(cls_label_one_hot, 1)
     cls_label_one_hot = tf.tile(cls_label_one_hot, [1,num_point,1])
     l0_points = pointnet_fp_module(l0_xyz, l1_xyz, tf.concat([cls_label_one_hot, l0_xyz, l0_points],axis=-1), l1_points, [128,128], is_training, bn_decay, scope='fp_layer3')
 
@@ -52,8 +51,8 @@ def get_loss(pred, label):
         label: BxN, """
     loss = tf.nn.sparse_softmax_cross_entropy_with_logits(logits=pred, labels=label)
     classify_loss = tf.reduce_mean(loss)
-    tf.summary.scalar('classify loss', classify_loss)
-    tf.add_to_collection('losses', classify_loss)
+    tf.compat.v1.summary.scalar('classify loss', classify_loss)
+    tf.compat.v1.add_to_collection('losses', classify_loss)
     return classify_loss
 
 
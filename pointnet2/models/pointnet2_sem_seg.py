@@ -6,19 +6,17 @@ sys.path.append(os.path.join(BASE_DIR, '../utils'))
 import tensorflow as tf
 import numpy as np
 import tf_util
-from pointnet_util import pointnet_sa_module, pointnet_fp_module
+from pointnet_util import pointnet_sa_module, pointnet_fp_module, PointNetSAModule, PointNetFPModule
 
-def placeholder_inputs(batch_size, num_point):
-    pointclouds_pl = tf.placeholder(tf.float32, shape=(batch_size, num_point, 3))
-    labels_pl = tf.placeholder(tf.int32, shape=(batch_size, num_point))
-    smpws_pl = tf.placeholder(tf.float32, shape=(batch_size, num_point))
+def placeholder_inputs(batch_size=None, num_point=None):
+    pointclouds_pl = tf.compat.v1.placeholder(tf.float32, shape=(batch_size, num_point, 3))
+    labels_pl = tf.compat.v1.placeholder(tf.int32, shape=(batch_size, num_point))
+    smpws_pl = tf.compat.v1.placeholder(tf.float32, shape=(batch_size, num_point))
     return pointclouds_pl, labels_pl, smpws_pl
 
 
 def get_model(point_cloud, is_training, num_class, bn_decay=None):
     """ Semantic segmentation PointNet, input is BxNx3, output Bxnum_class """
-    batch_size = point_cloud.get_shape()[0].value
-    num_point = point_cloud.get_shape()[1].value
     end_points = {}
     l0_xyz = point_cloud
     l0_points = None
@@ -49,13 +47,60 @@ def get_loss(pred, label, smpw):
     """ pred: BxNxC,
         label: BxN, 
 	smpw: BxN """
-    classify_loss = tf.losses.sparse_softmax_cross_entropy(labels=label, logits=pred, weights=smpw)
-    tf.summary.scalar('classify loss', classify_loss)
-    tf.add_to_collection('losses', classify_loss)
+    classify_loss = tf.compat.v1.losses.sparse_softmax_cross_entropy(labels=label, logits=pred, weights=smpw)
+    tf.compat.v1.summary.scalar('classify loss', classify_loss)
+    tf.compat.v1.add_to_collection('losses', classify_loss)
     return classify_loss
 
+class SemSegModel(tf.keras.Model):
+    """ Keras version of get_model, input is BxNx3, output BxNxnum_class logits """
+    def __init__(self, num_class, bn_decay=None, jit_compile=False, **kwargs):
+        super().__init__(**kwargs)
+        sa_args = dict(bn_decay=bn_decay, jit_compile=jit_compile)
+        self.sa1 = PointNetSAModule(npoint=1024, radius=0.1, nsample=32, mlp=[32,32,64], name='layer1', **sa_args)
+        self.sa2 = PointNetSAModule(npoint=256, radius=0.2, nsample=32, mlp=[64,64,128], name='layer2', **sa_args)
+        self.sa3 = PointNetSAModule(npoint=64, radius=0.4, nsample=32, mlp=[128,128,256], name='layer3', **sa_args)
+        self.sa4 = PointNetSAModule(npoint=16, radius=0.8, nsample=32, mlp=[256,256,512], name='layer4', **sa_args)
+        self.fp1 = PointNetFPModule([256,256], name='fa_layer1', **sa_args)
+        self.fp2 = PointNetFPModule([256,256], name='fa_layer2', **sa_args)
+        self.fp3 = PointNetFPModule([256,128], name='fa_layer3', **sa_args)
+        self.fp4 = PointNetFPModule([128,128,128], name='fa_layer4', **sa_args)
+        self.fc1 = tf_util.SharedMLP([128], name='fc1', **sa_args)
+        self.dp1 = tf.keras.layers.Dropout(0.5, name='dp1')
+        self.fc2 = tf_util.SharedMLP([num_class], bn=False, activation_fn=None, name='fc2', jit_compile=jit_compile)
+
+    def call(self, point_cloud, training=None):
+        l0_xyz = point_cloud
+        l1_xyz, l1_points, _ = self.sa1(l0_xyz, None, training=training)
+        l2_xyz, l2_points, _ = self.sa2(l1_xyz, l1_points, training=training)
+        l3_xyz, l3_points, _ = self.sa3(l2_xyz, l2_points, training=training)
+        l4_xyz, l4_points, _ = self.sa4(l3_xyz, l3_points, training=training)
+
+        l3_points = self.fp1(l3_xyz, l4_xyz, l3_points, l4_points, training=training)
+        l2_points = self.fp2(l2_xyz, l3_xyz, l2_points, l3_points, training=training)
+        l1_points = self.fp3(l1_xyz, l2_xyz, l1_points, l2_points, training=training)
+        l0_points = self.fp4(l0_xyz, l1_xyz, None, l1_points, training=training)
+
+        net = self.fc1(l0_points, training=training)
+        net = self.dp1(net, training=training)
+        return self.fc2(net, training=training)
+
+
+def get_inference_fn(model):
+    """ Wraps a SemSegModel in a tf.function that runs it in inference mode,
+        BxNx3 point clouds in, BxNxnum_class logits out. Batch size and N are
+        left unknown in the signature, so any scan size is served by one trace """
+    @tf.function(input_signature=[tf.TensorSpec([None, None, 3], tf.float32)])
+    def predict(point_cloud):
+        return model(point_cloud, training=False)
+    return predict
+
+
 if __name__=='__main__':
     with tf.Graph().as_default():
         inputs = tf.zeros((32,2048,3))
         net, _ = get_model(inputs, tf.constant(True), 10)
         print(net)
+    model = SemSegModel(10, jit_compile=True)
+    predict = get_inference_fn(model)
+    print(predict(tf.zeros((2,2048,3))).shape, predict(tf.zeros((1,5000,3))).shape)
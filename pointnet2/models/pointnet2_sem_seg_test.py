@@ -0,0 +1,19 @@
+import tensorflow as tf
+import numpy as np
+import pointnet2_sem_seg
+
+class SemSegModelTest(tf.test.TestCase):
+  def test_inference_reads_current_weights(self):
+    # the first call builds the model symbolically, the fused inference path
+    # must not keep the weights it read there
+    model = pointnet2_sem_seg.SemSegModel(4)
+    xyz = tf.constant(np.random.random((1,1024,3)).astype('float32'))
+    before = model(xyz, training=False).numpy()
+    for w in model.weights:
+      w.assign(w + 0.1*tf.random.normal(w.shape))
+    after = model(xyz, training=False).numpy()
+    self.assertGreater(np.abs(after-before).max(), 1e-3)
+    self.assertAllClose(after, pointnet2_sem_seg.get_inference_fn(model)(xyz), rtol=1e-3, atol=1e-3)
+
+if __name__=='__main__':
+  tf.test.main()
@@ -0,0 +1,48 @@
+''' NumPy reference implementation of the interpolation ops.
+
+Used by tf_interpolate when tf_interpolate_so.so is not available, and as a
+correctness oracle for the compiled kernels.
+'''
+import numpy as np
+
+CHUNK_ELEMENTS = 1 << 24 # distance matrix entries held at once
+
+def three_nn(xyz1, xyz2):
+    '''
+    Input:
+        xyz1: (b,n,3) float32 array, unknown points
+        xyz2: (b,m,3) float32 array, known points
+    Output:
+        dist: (b,n,3) float32 array, distances to known points
+        idx: (b,n,3) int32 array, indices to known points
+    '''
+    xyz1 = np.asarray(xyz1, dtype=np.float32)
+    xyz2 = np.asarray(xyz2, dtype=np.float32)
+    b, n = xyz1.shape[0:2]
+    m = xyz2.shape[1]
+    dist = np.full((b,n,3), 1e38, dtype=np.float32)
+    idx = np.zeros((b,n,3), dtype=np.int32)
+    kk = min(3, m)
+    step = max(1, CHUNK_ELEMENTS // max(m, 1))
+    for i in range(b):
+        for s in range(0, n, step):
+            d = np.sum((xyz1[i,s:s+step,None,:]-xyz2[i,None,:,:])**2, -1)
+            nearest = np.argpartition(d, kk-1, -1)[:,:kk] if kk < m else np.tile(np.arange(m), (d.shape[0],1))
+            nearest_d = np.take_along_axis(d, nearest, -1)
+            order = np.lexsort((nearest, nearest_d), -1)
+            idx[i,s:s+step,:kk] = np.take_along_axis(nearest, order, -1)
+            dist[i,s:s+step,:kk] = np.take_along_axis(nearest_d, order, -1)
+    return dist, idx
+
+def three_interpolate(points, idx, weight):
+    '''
+    Input:
+        points: (b,m,c) float32 array, known points
+        idx: (b,n,3) int32 array, indices to known points
+        weight: (b,n,3) float32 array, weights on known points
+    Output:
+        out: (b,n,c) float32 array, interpolated point values
+    '''
+    points = np.asarray(points, dtype=np.float32)
+    grouped = points[np.arange(points.shape[0])[:,None,None], np.asarray(idx)] # (b,n,3,c)
+    return np.einsum('bnkc,bnk->bnc', grouped, np.asarray(weight, dtype=np.float32))
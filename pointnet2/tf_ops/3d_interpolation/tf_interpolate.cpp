@@ -7,9 +7,13 @@
 #include "tensorflow/core/framework/op_kernel.h"
 #include "tensorflow/core/framework/shape_inference.h"
 #include "tensorflow/core/framework/common_shape_fns.h"
+#include "tensorflow/core/util/work_sharder.h"
+#include <algorithm>
+#include <vector>
 using namespace tensorflow;
 
 REGISTER_OP("ThreeNN")
+    .Attr("brute_force: bool = false")
     .Input("xyz1: float32")
     .Input("xyz2: float32")
     .Output("dist: float32")
@@ -54,53 +58,171 @@ static double get_time(){
     return tp.tv_sec+tp.tv_nsec*1e-9;
 }
 
+// Uniform grid over the known points of one batch element, with about two
+// points per cell. Indices are bucketed by cell with a counting sort.
+struct KnownGrid {
+    float lo[3];
+    float cell;
+    int dim[3];
+    std::vector<int> cell_start; // (ncell+1) offsets into order
+    std::vector<int> order;      // point indices sorted by cell
+
+    void build(const float *xyz, int m) {
+        float hi[3];
+        for (int a=0;a<3;++a) {
+            lo[a] = m>0 ? xyz[a] : 0;
+            hi[a] = lo[a];
+        }
+        for (int k=1;k<m;++k) {
+            for (int a=0;a<3;++a) {
+                lo[a] = std::min(lo[a], xyz[k*3+a]);
+                hi[a] = std::max(hi[a], xyz[k*3+a]);
+            }
+        }
+        int64 max_cells = std::max(m/2, 1);
+        float extent = std::max(hi[0]-lo[0], std::max(hi[1]-lo[1], hi[2]-lo[2]));
+        cell = std::max(extent/float(std::cbrt(double(max_cells))), 1e-6f);
+        while (true) {
+            int64 ncell = 1;
+            for (int a=0;a<3;++a) {
+                dim[a] = int(std::min((hi[a]-lo[a])/cell, 1e6f))+1;
+                ncell *= dim[a];
+            }
+            if (ncell<=max_cells)
+                break;
+            cell *= 1.5f;
+        }
+        cell_start.assign(dim[0]*dim[1]*dim[2]+1, 0);
+        std::vector<int> cell_of(m);
+        for (int k=0;k<m;++k) {
+            cell_of[k] = cell_index(coord(xyz[k*3+0],0), coord(xyz[k*3+1],1), coord(xyz[k*3+2],2));
+            cell_start[cell_of[k]+1]++;
+        }
+        for (size_t c=1;c<cell_start.size();++c)
+            cell_start[c] += cell_start[c-1];
+        order.resize(m);
+        std::vector<int> fill(cell_start.begin(), cell_start.end()-1);
+        for (int k=0;k<m;++k)
+            order[fill[cell_of[k]]++] = k;
+    }
+    // cell coordinate along axis a, clamped to the grid
+    int coord(float v, int a) const {
+        int c = int((v-lo[a])/cell);
+        return std::max(0, std::min(c, dim[a]-1));
+    }
+    int cell_index(int cx, int cy, int cz) const {
+        return (cx*dim[1]+cy)*dim[2]+cz;
+    }
+};
+
 // Find three nearest neigbors with square distance
 // input: xyz1 (b,n,3), xyz2(b,m,3)
 // output: dist (b,n,3), idx (b,n,3)
-void threenn_cpu(int b, int n, int m, const float *xyz1, const float *xyz2, float *dist, int *idx) {
-     for (int i=0;i<b;++i) {
+// xyz2 is indexed with a grid once per batch element; every unknown point then
+// visits rings of cells around itself until no unvisited cell can beat the
+// third neighbour. Unknown points are split across the CPU worker threads.
+void threenn_cpu(const DeviceBase::CpuWorkerThreads& workers, int b, int n, int m, const float *xyz1, const float *xyz2, float *dist, int *idx) {
+    std::vector<KnownGrid> grids(b);
+    Shard(workers.num_threads, workers.workers, b, int64(m)*20, [&](int64 start, int64 limit) {
+        for (int64 i=start;i<limit;++i)
+            grids[i].build(xyz2+i*m*3, m);
+    });
+    Shard(workers.num_threads, workers.workers, int64(b)*n, 500, [&](int64 start, int64 limit) {
+        for (int64 t=start;t<limit;++t) {
+            int64 i = t/n;
+            const KnownGrid &grid = grids[i];
+            const float *known = xyz2+i*m*3;
+            float x1=xyz1[t*3+0];
+            float y1=xyz1[t*3+1];
+            float z1=xyz1[t*3+2];
+            float best[3] = {1e38f, 1e38f, 1e38f};
+            int besti[3] = {0, 0, 0};
+            int cq[3] = {grid.coord(x1,0), grid.coord(y1,1), grid.coord(z1,2)};
+            for (int r=0;m>0;++r) {
+                for (int ix=std::max(cq[0]-r,0);ix<=std::min(cq[0]+r,grid.dim[0]-1);++ix) {
+                    for (int iy=std::max(cq[1]-r,0);iy<=std::min(cq[1]+r,grid.dim[1]-1);++iy) {
+                        for (int iz=std::max(cq[2]-r,0);iz<=std::min(cq[2]+r,grid.dim[2]-1);++iz) {
+                            if (std::max(std::abs(ix-cq[0]), std::max(std::abs(iy-cq[1]), std::abs(iz-cq[2])))!=r)
+                                continue; // visited in an earlier ring
+                            int c = grid.cell_index(ix,iy,iz);
+                            for (int s=grid.cell_start[c];s<grid.cell_start[c+1];++s) {
+                                int k = grid.order[s];
+                                float x2=known[k*3+0];
+                                float y2=known[k*3+1];
+                                float z2=known[k*3+2];
+                                float d=(x2-x1)*(x2-x1)+(y2-y1)*(y2-y1)+(z2-z1)*(z2-z1);
+                                // ties go to the lower index, as in a linear scan
+                                if (d<best[0] || (d==best[0] && k<besti[0])) {
+                                    best[2]=best[1]; besti[2]=besti[1];
+                                    best[1]=best[0]; besti[1]=besti[0];
+                                    best[0]=d; besti[0]=k;
+                                } else if (d<best[1] || (d==best[1] && k<besti[1])) {
+                                    best[2]=best[1]; besti[2]=besti[1];
+                                    best[1]=d; besti[1]=k;
+                                } else if (d<best[2] || (d==best[2] && k<besti[2])) {
+                                    best[2]=d; besti[2]=k;
+                                }
+                            }
+                        }
+                    }
+                }
+                // distance from the query to the nearest cell outside the visited block
+                float bound = 1e38f;
+                for (int a=0;a<3;++a) {
+                    float q = a==0 ? x1 : (a==1 ? y1 : z1);
+                    if (cq[a]-r>0)
+                        bound = std::min(bound, q-(grid.lo[a]+(cq[a]-r)*grid.cell));
+                    if (cq[a]+r<grid.dim[a]-1)
+                        bound = std::min(bound, grid.lo[a]+(cq[a]+r+1)*grid.cell-q);
+                }
+                if (bound>=1e38f || (bound>0 && best[2]<=bound*bound))
+                    break;
+            }
+            for (int l=0;l<3;++l) {
+                dist[t*3+l]=best[l];
+                idx[t*3+l]=besti[l];
+            }
+        }
+    });
+}
+
+// Reference linear scan over every known point, on one thread: the kernel the
+// grid replaced, kept for benchmarks and as an oracle (brute_force=true)
+void threenn_linear_cpu(int b, int n, int m, const float *xyz1, const float *xyz2, float *dist, int *idx) {
+    for (int i=0;i<b;++i) {
         for (int j=0;j<n;++j) {
-	    float x1=xyz1[j*3+0];
-	    float y1=xyz1[j*3+1];
-	    float z1=xyz1[j*3+2];
-            double best1=1e40; double best2=1e40; double best3=1e40;
-            int besti1=0; int besti2=0; int besti3=0;
+            float x1=xyz1[j*3+0];
+            float y1=xyz1[j*3+1];
+            float z1=xyz1[j*3+2];
+            float best[3] = {1e38f, 1e38f, 1e38f};
+            int besti[3] = {0, 0, 0};
             for (int k=0;k<m;++k) {
                 float x2=xyz2[k*3+0];
-	        float y2=xyz2[k*3+1];
-	        float z2=xyz2[k*3+2];
-		//float d=max(sqrtf((x2-x1)*(x2-x1)+(y2-y1)*(y2-y1)+(z2-z1)*(z2-z1)),1e-20f);
-		double d=(x2-x1)*(x2-x1)+(y2-y1)*(y2-y1)+(z2-z1)*(z2-z1);
-                if (d<best1) {
-                    best3=best2;
-                    besti3=besti2;
-                    best2=best1;
-                    besti2=besti1;
-                    best1=d;
-                    besti1=k;
-                } else if (d<best2) {
-                    best3=best2;
-                    besti3=besti2;
-                    best2=d;
-                    besti2=k;
-                } else if (d<best3) {
-                    best3=d;
-                    besti3=k;
+                float y2=xyz2[k*3+1];
+                float z2=xyz2[k*3+2];
+                float d=(x2-x1)*(x2-x1)+(y2-y1)*(y2-y1)+(z2-z1)*(z2-z1);
+                if (d<best[0]) {
+                    best[2]=best[1]; besti[2]=besti[1];
+                    best[1]=best[0]; besti[1]=besti[0];
+                    best[0]=d; besti[0]=k;
+                } else if (d<best[1]) {
+                    best[2]=best[1]; besti[2]=besti[1];
+                    best[1]=d; besti[1]=k;
+                } else if (d<best[2]) {
+                    best[2]=d; besti[2]=k;
                 }
-            } 
-            dist[j*3]=best1;
-            idx[j*3]=besti1;
-            dist[j*3+1]=best2;
-            idx[j*3+1]=besti2;
-            dist[j*3+2]=best3;
-            idx[j*3+2]=besti3;
-        } 
+            }
+            for (int l=0;l<3;++l) {
+                dist[j*3+l]=best[l];
+                idx[j*3+l]=besti[l];
+            }
+        }
         xyz1+=n*3;
         xyz2+=m*3;
         dist+=n*3;
         idx+=n*3;
     }
-} 
+}
 
 // input: points (b,m,c), idx (b,n,3), weight (b,n,3)
 // output: out (b,n,c)
@@ -156,7 +278,9 @@ void threeinterpolate_grad_cpu(int b, int n, int c, int m, const float *grad_out
 
 class ThreeNNOp : public OpKernel {
     public:
-        explicit ThreeNNOp(OpKernelConstruction* context) : OpKernel(context) {}
+        explicit ThreeNNOp(OpKernelConstruction* context) : OpKernel(context) {
+            OP_REQUIRES_OK(context, context->GetAttr("brute_force", &brute_force_));
+        }
 
         void Compute(OpKernelContext* context) override {
             const Tensor& xyz1_tensor = context->input(0);
@@ -165,13 +289,15 @@ class ThreeNNOp : public OpKernel {
             int n = xyz1_tensor.shape().dim_size(1);
 
             const Tensor& xyz2_tensor = context->input(1);
-            OP_REQUIRES(context, xyz2_tensor.dims()==3 && xyz2_tensor.shape().dim_size(2)==3, errors::InvalidArgument("ThreeNN expects (b,m,3) xyz2 shape."));
+            OP_REQUIRES(context, xyz2_tensor.dims()==3 && xyz2_tensor.shape().dim_size(0)==b && xyz2_tensor.shape().dim_size(2)==3, errors::InvalidArgument("ThreeNN expects (b,m,3) xyz2 shape."));
             int m = xyz2_tensor.shape().dim_size(1);
 
             Tensor *dist_tensor = nullptr;
             OP_REQUIRES_OK(context, context->allocate_output(0, TensorShape{b,n,3}, &dist_tensor));
             Tensor *idx_tensor = nullptr;
             OP_REQUIRES_OK(context, context->allocate_output(1, TensorShape{b,n,3}, &idx_tensor));
+            if (b==0 || n==0) return;
+            OP_REQUIRES(context, m>0, errors::InvalidArgument("ThreeNN expects at least one known point"));
 
             auto xyz1_flat = xyz1_tensor.flat<float>();
             const float *xyz1 = &(xyz1_flat(0));
@@ -181,8 +307,13 @@ class ThreeNNOp : public OpKernel {
             float *dist = &(dist_flat(0));
             auto idx_flat = idx_tensor->flat<int>();
             int *idx = &(idx_flat(0));
-            threenn_cpu(b,n,m,xyz1,xyz2,dist,idx);
+            if (brute_force_)
+                threenn_linear_cpu(b,n,m,xyz1,xyz2,dist,idx);
+            else
+                threenn_cpu(*context->device()->tensorflow_cpu_worker_threads(),b,n,m,xyz1,xyz2,dist,idx);
         }
+    private:
+        bool brute_force_;
 };
 REGISTER_KERNEL_BUILDER(Name("ThreeNN").Device(DEVICE_CPU), ThreeNNOp);
 
@@ -2,19 +2,33 @@ import tensorflow as tf
 from tensorflow.python.framework import ops
 import sys
 import os
+import warnings
 BASE_DIR = os.path.dirname(__file__)
 sys.path.append(BASE_DIR)
-interpolate_module=tf.load_op_library(os.path.join(BASE_DIR, 'tf_interpolate_so.so'))
-def three_nn(xyz1, xyz2):
+import np_interpolate
+try:
+    interpolate_module=tf.load_op_library(os.path.join(BASE_DIR, 'tf_interpolate_so.so'))
+except tf.errors.NotFoundError:
+    # compiled ops are missing, use the (slower) NumPy reference implementation
+    warnings.warn('tf_interpolate_so.so not found, falling back to NumPy interpolation ops')
+    interpolate_module=None
+def three_nn(xyz1, xyz2, brute_force=False):
     '''
     Input:
         xyz1: (b,n,3) float32 array, unknown points
         xyz2: (b,m,3) float32 array, known points
+        brute_force: bool, use the single-threaded linear scan instead of the grid (for benchmarks)
     Output:
         dist: (b,n,3) float32 array, distances to known points
         idx: (b,n,3) int32 array, indices to known points
     '''
-    return interpolate_module.three_nn(xyz1, xyz2)
+    if interpolate_module is None:
+        xyz1 = tf.convert_to_tensor(xyz1)
+        dist, idx = tf.numpy_function(np_interpolate.three_nn, [xyz1, xyz2], [tf.float32, tf.int32])
+        dist.set_shape(xyz1.get_shape())
+        idx.set_shape(xyz1.get_shape())
+        return dist, idx
+    return interpolate_module.three_nn(xyz1, xyz2, brute_force=brute_force)
 ops.NoGradient('ThreeNN')
 def three_interpolate(points, idx, weight):
     '''
@@ -25,6 +39,9 @@ def three_interpolate(points, idx, weight):
     Output:
         out: (b,n,c) float32 array, interpolated point values
     '''
+    if interpolate_module is None:
+        # differentiable, no custom gradient needed
+        return tf.reduce_sum(tf.gather(points, idx, batch_dims=1) * tf.expand_dims(weight, -1), axis=2)
     return interpolate_module.three_interpolate(points, idx, weight)
 @tf.RegisterGradient('ThreeInterpolate')
 def _three_interpolate_grad(op, grad_out):
@@ -47,13 +64,13 @@ if __name__=='__main__':
         dist, idx = three_nn(xyz1, xyz2)
         weight = tf.ones_like(dist)/3.0
         interpolated_points = three_interpolate(points, idx, weight)
-    with tf.Session('') as sess:
-        now = time.time() 
+        now = time.time()
         for _ in range(100):
-            ret = sess.run(interpolated_points)
-        print time.time() - now
-        print ret.shape, ret.dtype
-        #print ret
+            dist, idx = three_nn(xyz1, xyz2)
+            ret = three_interpolate(points, idx, weight).numpy()
+        print(time.time() - now)
+        print(ret.shape, ret.dtype)
+        #print(ret)
     
     
     
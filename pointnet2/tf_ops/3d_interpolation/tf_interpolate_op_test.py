@@ -1,24 +1,94 @@
+import time
 import tensorflow as tf
 import numpy as np
-from tf_interpolate import three_nn, three_interpolate
+from tf_interpolate import three_nn, three_interpolate, interpolate_module
+import np_interpolate
 
 class GroupPointTest(tf.test.TestCase):
   def test(self):
     pass
 
+  def test_three_nn(self):
+    xyz1 = (np.random.random((2,2000,3))*1.2-0.1).astype('float32') # some unknown points outside the known cloud
+    xyz2 = np.random.random((2,300,3)).astype('float32')
+    with tf.device('/cpu:0'):
+      dist, idx = self.evaluate(three_nn(tf.constant(xyz1), tf.constant(xyz2)))
+    if interpolate_module is not None: # otherwise this would compare np_interpolate with itself
+      ref_dist, ref_idx = np_interpolate.three_nn(xyz1, xyz2)
+      self.assertAllEqual(idx, ref_idx)
+      self.assertAllClose(dist, ref_dist, atol=1e-6)
+
+  def test_three_nn_linear_scan(self):
+    # the grid and the linear scan it replaced agree, ties included
+    if interpolate_module is None:
+      self.skipTest('tf_interpolate_so.so not built')
+    xyz1 = (np.random.random((2,2000,3))*1.2-0.1).astype('float32')
+    xyz2 = np.round(np.random.random((2,300,3)), 1).astype('float32') # duplicate known points
+    with tf.device('/cpu:0'):
+      grid = self.evaluate(three_nn(tf.constant(xyz1), tf.constant(xyz2)))
+      scan = self.evaluate(three_nn(tf.constant(xyz1), tf.constant(xyz2), brute_force=True))
+    self.assertAllEqual(grid[1], scan[1])
+    self.assertAllClose(grid[0], scan[0], atol=1e-6)
+
+  def test_hand_computed(self):
+    xyz1 = np.array([[[0.1,0,0],[4,0,0]]], dtype='float32')
+    xyz2 = np.array([[[0,0,0],[1,0,0],[0,2,0],[5,0,0]]], dtype='float32')
+    points = np.array([[[1],[2],[3],[4]]], dtype='float32')
+    weight = np.array([[[0.5,0.25,0.25],[1,0,0]]], dtype='float32')
+    with tf.device('/cpu:0'):
+      dist, idx = self.evaluate(three_nn(tf.constant(xyz1), tf.constant(xyz2)))
+      out = self.evaluate(three_interpolate(tf.constant(points), tf.constant(idx), tf.constant(weight)))
+    # squared distances, nearest first
+    self.assertAllEqual(idx, [[[0,1,2],[3,1,0]]])
+    self.assertAllClose(dist, [[[0.01,0.81,4.01],[1,9,16]]], atol=1e-5)
+    self.assertAllClose(out, [[[0.5*1+0.25*2+0.25*3],[4]]])
+
   def test_grad(self):
-    with self.test_session():
+    with tf.device('/cpu:0'):
       points = tf.constant(np.random.random((1,8,16)).astype('float32'))
-      print points
       xyz1 = tf.constant(np.random.random((1,128,3)).astype('float32'))
       xyz2 = tf.constant(np.random.random((1,8,3)).astype('float32'))
       dist, idx = three_nn(xyz1, xyz2)
       weight = tf.ones_like(dist)/3.0
-      interpolated_points = three_interpolate(points, idx, weight)
-      print interpolated_points
-      err = tf.test.compute_gradient_error(points, (1,8,16), interpolated_points, (1,128,16))
-      print err
-      self.assertLess(err, 1e-4) 
+      theoretical, numerical = tf.test.compute_gradient(lambda p: three_interpolate(p, idx, weight), [points])
+    err = np.max(np.abs(theoretical[0]-numerical[0]))
+    print(err)
+    self.assertLess(err, 1e-4)
+
+class ThreeNNBenchmark(tf.test.Benchmark):
+  ''' Run with: python tf_interpolate_op_test.py --benchmark_filter=ThreeNN
+
+  Times the grid kernel against the single-threaded linear scan it replaced
+  (three_nn(..., brute_force=True)), best of `iters` runs each. '''
+  def _time(self, fn, iters):
+    fn() # warm up
+    times = []
+    for _ in range(iters):
+      start = time.time()
+      fn()
+      times.append(time.time() - start)
+    return min(times)
+
+  def benchmark_three_nn(self, iters=5):
+    if interpolate_module is None:
+      print('tf_interpolate_so.so not built, nothing to benchmark')
+      return
+    np.random.seed(0)
+    m = 1024 # l1 points in the last FP layer of pointnet2_sem_seg
+    for n in [16384, 65536, 200000]:
+      # points on a sphere, closer to a head scan than a filled cube
+      xyz1 = np.random.randn(1,n,3)
+      xyz1 /= np.linalg.norm(xyz1, axis=-1, keepdims=True)
+      xyz1 = xyz1.astype('float32')
+      xyz2 = xyz1[:, np.random.choice(n, m, replace=False)]
+      with tf.device('/cpu:0'):
+        inp1 = tf.constant(xyz1)
+        inp2 = tf.constant(xyz2)
+        grid_time = self._time(lambda: three_nn(inp1, inp2)[1].numpy(), iters)
+        scan_time = self._time(lambda: three_nn(inp1, inp2, brute_force=True)[1].numpy(), iters)
+      print('ThreeNN n=%d m=%d: grid %.4fs, linear scan %.4fs, speed-up %.1fx' % (n, m, grid_time, scan_time, scan_time/grid_time))
+      self.report_benchmark(name='three_nn_%d' % n, iters=iters, wall_time=grid_time,
+                            extras={'linear_scan_time': scan_time, 'speedup': scan_time/grid_time})
 
 if __name__=='__main__':
-  tf.test.main() 
+  tf.test.main()
@@ -0,0 +1,105 @@
+''' NumPy reference implementation of the grouping ops.
+
+Used by tf_grouping when tf_grouping_so.so is not available, and as a
+correctness oracle for the compiled kernels. Distances are computed in
+chunks of query points so memory stays bounded for large clouds.
+'''
+import numpy as np
+
+CHUNK_ELEMENTS = 1 << 24 # distance matrix entries held at once
+
+def _query_chunks(n, m):
+    step = max(1, CHUNK_ELEMENTS // max(n, 1))
+    return range(0, m, step), step
+
+def query_ball_point(radius, nsample, xyz1, xyz2):
+    '''
+    Input:
+        radius: float32, ball search radius
+        nsample: int32, number of points selected in each ball region
+        xyz1: (batch_size, ndataset, 3) float32 array, input points
+        xyz2: (batch_size, npoint, 3) float32 array, query points
+    Output:
+        idx: (batch_size, npoint, nsample) int32 array, indices to input points
+        pts_cnt: (batch_size, npoint) int32 array, number of unique points in each local region
+    '''
+    xyz1 = np.asarray(xyz1, dtype=np.float32)
+    xyz2 = np.asarray(xyz2, dtype=np.float32)
+    b, n = xyz1.shape[0:2]
+    m = xyz2.shape[1]
+    idx = np.zeros((b, m, nsample), dtype=np.int32)
+    pts_cnt = np.zeros((b, m), dtype=np.int32)
+    starts, step = _query_chunks(n, m)
+    for i in range(b):
+        for s in starts:
+            d = np.sqrt(np.sum((xyz2[i,s:s+step,None,:]-xyz1[i,None,:,:])**2, -1))
+            rows, cols = np.nonzero(np.maximum(d, 1e-20) < radius) # cols ascending within a row
+            row_start = np.searchsorted(rows, np.arange(d.shape[0]))
+            rank = np.arange(len(rows)) - row_start[rows]
+            keep = rank < nsample
+            cnt = np.minimum(np.bincount(rows, minlength=d.shape[0]), nsample)
+            # pad every row with its first index, as the kernels do
+            first = np.zeros(d.shape[0], dtype=np.int32)
+            first[cnt>0] = cols[row_start[cnt>0]]
+            block = np.repeat(first[:,None], nsample, 1)
+            block[rows[keep], rank[keep]] = cols[keep]
+            idx[i,s:s+step] = block
+            pts_cnt[i,s:s+step] = cnt
+    return idx, pts_cnt
+
+def select_top_k(k, dist):
+    '''
+    Input:
+        k: int32, number of k SMALLEST elements selected
+        dist: (b,m,n) float32 array, distance matrix, m query points, n dataset points
+    Output:
+        idx: (b,m,n) int32 array, first k in n are indices to the top k
+        dist_out: (b,m,n) float32 array, first k in n are the top k
+    '''
+    dist = np.asarray(dist, dtype=np.float32)
+    outi = np.argsort(dist, -1, kind='stable').astype(np.int32)
+    return outi, np.take_along_axis(dist, outi, -1)
+
+def group_point(points, idx):
+    '''
+    Input:
+        points: (batch_size, ndataset, channel) float32 array, points to sample from
+        idx: (batch_size, npoint, nsample) int32 array, indices to points
+    Output:
+        out: (batch_size, npoint, nsample, channel) float32 array, values sampled from points
+    '''
+    points = np.asarray(points)
+    idx = np.asarray(idx)
+    return points[np.arange(points.shape[0])[:,None,None], idx]
+
+def knn_point(k, xyz1, xyz2):
+    '''
+    Input:
+        k: int32, number of k in k-nn search
+        xyz1: (batch_size, ndataset, c) float32 array, input points
+        xyz2: (batch_size, npoint, c) float32 array, query points
+    Output:
+        val: (batch_size, npoint, k) float32 array, squared L2 distances, nearest first
+        idx: (batch_size, npoint, k) int32 array, indices to input points
+    '''
+    xyz1 = np.asarray(xyz1, dtype=np.float32)
+    xyz2 = np.asarray(xyz2, dtype=np.float32)
+    b, n = xyz1.shape[0:2]
+    m = xyz2.shape[1]
+    kk = min(k, n)
+    val = np.zeros((b, m, k), dtype=np.float32)
+    idx = np.zeros((b, m, k), dtype=np.int32)
+    starts, step = _query_chunks(n, m)
+    for i in range(b):
+        for s in starts:
+            d = np.sum((xyz2[i,s:s+step,None,:]-xyz1[i,None,:,:])**2, -1)
+            nearest = np.argpartition(d, kk-1, -1)[:,:kk] if kk < n else np.tile(np.arange(n), (d.shape[0],1))
+            nearest_d = np.take_along_axis(d, nearest, -1)
+            order = np.lexsort((nearest, nearest_d), -1)
+            nearest = np.take_along_axis(nearest, order, -1)
+            nearest_d = np.take_along_axis(nearest_d, order, -1)
+            # if n<k the remaining slots repeat the nearest neighbour
+            fill = np.where(np.arange(k) < kk, np.arange(k), 0)
+            idx[i,s:s+step] = nearest[:,fill]
+            val[i,s:s+step] = nearest_d[:,fill]
+    return val, idx
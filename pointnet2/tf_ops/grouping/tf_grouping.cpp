@@ -7,7 +7,12 @@
 #include "tensorflow/core/framework/op_kernel.h"
 #include "tensorflow/core/framework/shape_inference.h"
 #include "tensorflow/core/framework/common_shape_fns.h"
+#include "tensorflow/core/util/work_sharder.h"
+#include <algorithm>
+#include <vector>
+#if GOOGLE_CUDA
 #include <cuda_runtime.h>
+#endif
 using namespace tensorflow;
 
 REGISTER_OP("QueryBallPoint")
@@ -28,6 +33,22 @@ REGISTER_OP("QueryBallPoint")
         c->set_output(1, output2);
         return tsl::OkStatus();
     });
+REGISTER_OP("KnnPoint")
+    .Attr("k: int")
+    .Input("xyz1: float32")
+    .Input("xyz2: float32")
+    .Output("val: float32")
+    .Output("idx: int32")
+    .SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+        ::tensorflow::shape_inference::ShapeHandle dims2; // batch_size * npoint * channel
+        c->WithRank(c->input(1), 3, &dims2);
+        int k;
+        TF_RETURN_IF_ERROR(c->GetAttr("k", &k));
+        ::tensorflow::shape_inference::ShapeHandle output = c->MakeShape({c->Dim(dims2, 0), c->Dim(dims2, 1), k});
+        c->set_output(0, output);
+        c->set_output(1, output);
+        return tsl::OkStatus();
+    });
 REGISTER_OP("SelectionSort")
     .Attr("k: int")
     .Input("dist: float32")
@@ -63,6 +84,412 @@ REGISTER_OP("GroupPointGrad")
     });
 
 
+// Uniform voxel grid over one batch element of xyz1. Point indices are
+// bucketed by cell with a counting sort, so indices stay ascending inside a
+// cell and a query only has to visit the cells that overlap its search range.
+struct PointGrid {
+    float lo[3];
+    float cell;
+    int dim[3];
+    std::vector<int> cell_start; // (ncell+1) offsets into order
+    std::vector<int> order;      // point indices sorted by cell
+
+    // cell_size is the preferred edge length (<=0 picks one from the bounding
+    // box); it is grown until the grid has at most max_cells cells so sparse
+    // or degenerate inputs stay bounded.
+    void build(const float *xyz, int n, float cell_size, int64 max_cells) {
+        float hi[3];
+        for (int a=0;a<3;++a) {
+            lo[a] = n>0 ? xyz[a] : 0;
+            hi[a] = lo[a];
+        }
+        for (int k=1;k<n;++k) {
+            for (int a=0;a<3;++a) {
+                lo[a] = std::min(lo[a], xyz[k*3+a]);
+                hi[a] = std::max(hi[a], xyz[k*3+a]);
+            }
+        }
+        cell = cell_size;
+        if (cell<=0) {
+            float extent = std::max(hi[0]-lo[0], std::max(hi[1]-lo[1], hi[2]-lo[2]));
+            cell = std::max(extent/float(std::cbrt(double(max_cells))), 1e-6f);
+        }
+        while (true) {
+            int64 ncell = 1;
+            for (int a=0;a<3;++a) {
+                dim[a] = int(std::min((hi[a]-lo[a])/cell, 1e6f))+1;
+                ncell *= dim[a];
+            }
+            if (ncell<=max_cells)
+                break;
+            cell *= 1.5f;
+        }
+        cell_start.assign(dim[0]*dim[1]*dim[2]+1, 0);
+        std::vector<int> cell_of(n);
+        for (int k=0;k<n;++k) {
+            cell_of[k] = cell_index(coord(xyz[k*3+0],0), coord(xyz[k*3+1],1), coord(xyz[k*3+2],2));
+            cell_start[cell_of[k]+1]++;
+        }
+        for (size_t c=1;c<cell_start.size();++c)
+            cell_start[c] += cell_start[c-1];
+        order.resize(n);
+        std::vector<int> fill(cell_start.begin(), cell_start.end()-1);
+        for (int k=0;k<n;++k)
+            order[fill[cell_of[k]]++] = k;
+    }
+    // cell coordinate along axis a, clamped to the grid
+    int coord(float v, int a) const {
+        int c = int((v-lo[a])/cell);
+        return std::max(0, std::min(c, dim[a]-1));
+    }
+    int cell_index(int cx, int cy, int cz) const {
+        return (cx*dim[1]+cy)*dim[2]+cz;
+    }
+};
+
+// input: radius (1), nsample (1), xyz1 (b,n,3), xyz2 (b,m,3)
+// output: idx (b,m,nsample), pts_cnt (b,m)
+// Same result as the GPU kernel: the nsample smallest indices inside the ball,
+// padded with the first one.
+void query_ball_point_cpu(const DeviceBase::CpuWorkerThreads& workers, int b, int n, int m, float radius, int nsample, const float *xyz1, const float *xyz2, int *idx, int *pts_cnt) {
+    std::vector<PointGrid> grids(b);
+    Shard(workers.num_threads, workers.workers, b, int64(n)*20, [&](int64 start, int64 limit) {
+        for (int64 i=start;i<limit;++i)
+            grids[i].build(xyz1+i*n*3, n, radius, std::max<int64>(2*int64(n), 1));
+    });
+    Shard(workers.num_threads, workers.workers, int64(b)*m, int64(nsample)*200, [&](int64 start, int64 limit) {
+        std::vector<int> found;
+        for (int64 t=start;t<limit;++t) {
+            int64 i = t/m;
+            const PointGrid &grid = grids[i];
+            const float *pts = xyz1+i*n*3;
+            float x2=xyz2[t*3+0];
+            float y2=xyz2[t*3+1];
+            float z2=xyz2[t*3+2];
+            int r = int(std::ceil(radius/grid.cell));
+            int cx=grid.coord(x2,0), cy=grid.coord(y2,1), cz=grid.coord(z2,2);
+            found.clear();
+            for (int ix=std::max(cx-r,0);ix<=std::min(cx+r,grid.dim[0]-1);++ix) {
+                for (int iy=std::max(cy-r,0);iy<=std::min(cy+r,grid.dim[1]-1);++iy) {
+                    for (int iz=std::max(cz-r,0);iz<=std::min(cz+r,grid.dim[2]-1);++iz) {
+                        int c = grid.cell_index(ix,iy,iz);
+                        for (int s=grid.cell_start[c];s<grid.cell_start[c+1];++s) {
+                            int k = grid.order[s];
+                            float x1=pts[k*3+0];
+                            float y1=pts[k*3+1];
+                            float z1=pts[k*3+2];
+                            float d=std::max(sqrtf((x2-x1)*(x2-x1)+(y2-y1)*(y2-y1)+(z2-z1)*(z2-z1)),1e-20f);
+                            if (d<radius)
+                                found.push_back(k);
+                        }
+                    }
+                }
+            }
+            int cnt = std::min(int(found.size()), nsample);
+            if (int(found.size())>nsample)
+                std::nth_element(found.begin(), found.begin()+nsample, found.end());
+            std::sort(found.begin(), found.begin()+cnt);
+            int *out = idx+t*nsample;
+            for (int l=0;l<nsample;++l)
+                out[l] = l<cnt ? found[l] : (cnt>0 ? found[0] : 0);
+            pts_cnt[t] = cnt;
+        }
+    });
+}
+
+// input: k (1), xyz1 (b,n,c), xyz2 (b,m,c)
+// output: val (b,m,k) squared distances, idx (b,m,k), nearest first
+// For c==3, xyz1 is bucketed into a grid with about two points per cell and
+// each query walks rings of cells outwards until no unvisited cell can hold a
+// closer point than the current k-th neighbour. Other channel counts use a
+// bounded heap over all points. Either way only O(k) state is kept per query.
+// If n<k, the remaining slots repeat the nearest neighbour.
+void knn_point_cpu(const DeviceBase::CpuWorkerThreads& workers, int b, int n, int c, int m, int k, const float *xyz1, const float *xyz2, float *val, int *idx) {
+    typedef std::pair<float,int> Neighbor;
+    std::vector<PointGrid> grids(c==3 ? b : 0);
+    if (c==3) {
+        Shard(workers.num_threads, workers.workers, b, int64(n)*20, [&](int64 start, int64 limit) {
+            for (int64 i=start;i<limit;++i)
+                grids[i].build(xyz1+i*n*3, n, 0, std::max<int64>(n/2, 1));
+        });
+    }
+    int64 cost = c==3 ? int64(k)*200 : int64(n)*c*2;
+    Shard(workers.num_threads, workers.workers, int64(b)*m, cost, [&](int64 start, int64 limit) {
+        std::vector<Neighbor> heap; // max-heap on (distance, index)
+        heap.reserve(k+1);
+        for (int64 t=start;t<limit;++t) {
+            int64 i = t/m;
+            const float *pts = xyz1+i*n*c;
+            const float *q = xyz2+t*c;
+            heap.clear();
+            auto visit = [&](int p) {
+                float d = 0;
+                for (int l=0;l<c;++l)
+                    d += (pts[p*c+l]-q[l])*(pts[p*c+l]-q[l]);
+                Neighbor nb(d, p);
+                if (int(heap.size())<k) {
+                    heap.push_back(nb);
+                    std::push_heap(heap.begin(), heap.end());
+                } else if (nb<heap.front()) {
+                    std::pop_heap(heap.begin(), heap.end());
+                    heap.back() = nb;
+                    std::push_heap(heap.begin(), heap.end());
+                }
+            };
+            if (c!=3) {
+                for (int p=0;p<n;++p)
+                    visit(p);
+            } else {
+                const PointGrid &grid = grids[i];
+                int cq[3] = {grid.coord(q[0],0), grid.coord(q[1],1), grid.coord(q[2],2)};
+                for (int r=0;;++r) {
+                    for (int ix=std::max(cq[0]-r,0);ix<=std::min(cq[0]+r,grid.dim[0]-1);++ix) {
+                        for (int iy=std::max(cq[1]-r,0);iy<=std::min(cq[1]+r,grid.dim[1]-1);++iy) {
+                            for (int iz=std::max(cq[2]-r,0);iz<=std::min(cq[2]+r,grid.dim[2]-1);++iz) {
+                                if (std::max(std::abs(ix-cq[0]), std::max(std::abs(iy-cq[1]), std::abs(iz-cq[2])))!=r)
+                                    continue; // visited in an earlier ring
+                                int cell = grid.cell_index(ix,iy,iz);
+                                for (int s=grid.cell_start[cell];s<grid.cell_start[cell+1];++s)
+                                    visit(grid.order[s]);
+                            }
+                        }
+                    }
+                    // distance from q to the nearest cell outside the visited block
+                    float bound = 1e38f;
+                    for (int a=0;a<3;++a) {
+                        if (cq[a]-r>0)
+                            bound = std::min(bound, q[a]-(grid.lo[a]+(cq[a]-r)*grid.cell));
+                        if (cq[a]+r<grid.dim[a]-1)
+                            bound = std::min(bound, grid.lo[a]+(cq[a]+r+1)*grid.cell-q[a]);
+                    }
+                    if (bound>=1e38f)
+                        break; // whole grid visited
+                    if (int(heap.size())==k && bound>0 && heap.front().first<=bound*bound)
+                        break;
+                }
+            }
+            std::sort_heap(heap.begin(), heap.end());
+            for (int l=0;l<k;++l) {
+                const Neighbor &nb = l<int(heap.size()) ? heap[l] : heap[0];
+                val[t*k+l] = nb.first;
+                idx[t*k+l] = nb.second;
+            }
+        }
+    });
+}
+
+// input: points (b,n,c), idx (b,m,nsample)
+// output: out (b,m,nsample,c)
+void group_point_cpu(const DeviceBase::CpuWorkerThreads& workers, int b, int n, int c, int m, int nsample, const float *points, const int *idx, float *out) {
+    Shard(workers.num_threads, workers.workers, int64(b)*m, int64(nsample)*c, [&](int64 start, int64 limit) {
+        for (int64 t=start;t<limit;++t) {
+            const float *p = points+(t/m)*n*c;
+            for (int k=0;k<nsample;++k) {
+                int ii = idx[t*nsample+k];
+                std::copy(p+ii*c, p+(ii+1)*c, out+(t*nsample+k)*c);
+            }
+        }
+    });
+}
+
+// Each thread owns whole batch elements, so the scatter needs no atomics.
+// input: grad_out (b,m,nsample,c), idx (b,m,nsample),
+// output: grad_points (b,n,c)
+void group_point_grad_cpu(const DeviceBase::CpuWorkerThreads& workers, int b, int n, int c, int m, int nsample, const float *grad_out, const int *idx, float *grad_points) {
+    Shard(workers.num_threads, workers.workers, b, int64(m)*nsample*c, [&](int64 start, int64 limit) {
+        for (int64 i=start;i<limit;++i) {
+            float *g = grad_points+i*n*c;
+            std::fill(g, g+int64(n)*c, 0.0f);
+            for (int64 j=i*m;j<(i+1)*m;++j) {
+                for (int k=0;k<nsample;++k) {
+                    int ii = idx[j*nsample+k];
+                    const float *go = grad_out+(j*nsample+k)*c;
+                    for (int l=0;l<c;++l)
+                        g[ii*c+l] += go[l];
+                }
+            }
+        }
+    });
+}
+
+// input: k (1), distance matrix dist (b,m,n)
+// output: idx (b,m,n), dist_out (b,m,n)
+// only the top k results within n are useful
+void selection_sort_cpu(const DeviceBase::CpuWorkerThreads& workers, int b, int n, int m, int k, const float *dist, int *outi, float *out) {
+    k = std::min(k, n);
+    Shard(workers.num_threads, workers.workers, int64(b)*m, int64(n)*5, [&](int64 start, int64 limit) {
+        std::vector<int> order(n);
+        for (int64 t=start;t<limit;++t) {
+            const float *d = dist+t*n;
+            for (int s=0;s<n;++s)
+                order[s] = s;
+            std::partial_sort(order.begin(), order.begin()+k, order.end(),
+                              [d](int x, int y) { return d[x]<d[y] || (d[x]==d[y] && x<y); });
+            for (int s=0;s<n;++s) {
+                outi[t*n+s] = order[s];
+                out[t*n+s] = d[order[s]];
+            }
+        }
+    });
+}
+
+class QueryBallPointOp : public OpKernel {
+    public:
+        explicit QueryBallPointOp(OpKernelConstruction* context) : OpKernel(context) {
+            OP_REQUIRES_OK(context, context->GetAttr("radius", &radius_));
+            OP_REQUIRES(context, radius_ > 0, errors::InvalidArgument("QueryBallPoint expects positive radius"));
+
+            OP_REQUIRES_OK(context, context->GetAttr("nsample", &nsample_));
+            OP_REQUIRES(context, nsample_ > 0, errors::InvalidArgument("QueryBallPoint expects positive nsample"));
+        }
+
+        void Compute(OpKernelContext* context) override {
+            const Tensor& xyz1_tensor = context->input(0);
+            OP_REQUIRES(context, xyz1_tensor.dims()==3 && xyz1_tensor.shape().dim_size(2)==3, errors::InvalidArgument("QueryBallPoint expects (batch_size, ndataset, 3) xyz1 shape."));
+            int b = xyz1_tensor.shape().dim_size(0);
+            int n = xyz1_tensor.shape().dim_size(1);
+
+            const Tensor& xyz2_tensor = context->input(1);
+            OP_REQUIRES(context, xyz2_tensor.dims()==3 && xyz2_tensor.shape().dim_size(0)==b && xyz2_tensor.shape().dim_size(2)==3, errors::InvalidArgument("QueryBallPoint expects (batch_size, npoint, 3) xyz2 shape."));
+            int m = xyz2_tensor.shape().dim_size(1);
+
+            Tensor *idx_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(0, TensorShape{b,m,nsample_}, &idx_tensor));
+            Tensor *pts_cnt_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(1, TensorShape{b,m}, &pts_cnt_tensor));
+            if (b==0 || m==0) return;
+
+            query_ball_point_cpu(*context->device()->tensorflow_cpu_worker_threads(), b, n, m, radius_, nsample_,
+                                 xyz1_tensor.flat<float>().data(), xyz2_tensor.flat<float>().data(),
+                                 idx_tensor->flat<int>().data(), pts_cnt_tensor->flat<int>().data());
+        }
+    private:
+        float radius_;
+        int nsample_;
+};
+REGISTER_KERNEL_BUILDER(Name("QueryBallPoint").Device(DEVICE_CPU), QueryBallPointOp);
+
+class SelectionSortOp : public OpKernel {
+    public:
+        explicit SelectionSortOp(OpKernelConstruction* context) : OpKernel(context) {
+            OP_REQUIRES_OK(context, context->GetAttr("k", &k_));
+            OP_REQUIRES(context, k_ > 0, errors::InvalidArgument("SelectionSort expects positive k"));
+        }
+
+        void Compute(OpKernelContext* context) override {
+            const Tensor& dist_tensor = context->input(0);
+            OP_REQUIRES(context, dist_tensor.dims()==3, errors::InvalidArgument("SelectionSort expects (b,m,n) dist shape."));
+            int b = dist_tensor.shape().dim_size(0);
+            int m = dist_tensor.shape().dim_size(1);
+            int n = dist_tensor.shape().dim_size(2);
+
+            Tensor *outi_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(0, TensorShape{b,m,n}, &outi_tensor));
+            Tensor *out_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(1, TensorShape{b,m,n}, &out_tensor));
+            if (b==0 || m==0 || n==0) return;
+
+            selection_sort_cpu(*context->device()->tensorflow_cpu_worker_threads(), b, n, m, k_,
+                               dist_tensor.flat<float>().data(), outi_tensor->flat<int>().data(),
+                               out_tensor->flat<float>().data());
+        }
+    private:
+        int k_;
+};
+REGISTER_KERNEL_BUILDER(Name("SelectionSort").Device(DEVICE_CPU), SelectionSortOp);
+
+class KnnPointOp : public OpKernel {
+    public:
+        explicit KnnPointOp(OpKernelConstruction* context) : OpKernel(context) {
+            OP_REQUIRES_OK(context, context->GetAttr("k", &k_));
+            OP_REQUIRES(context, k_ > 0, errors::InvalidArgument("KnnPoint expects positive k"));
+        }
+
+        void Compute(OpKernelContext* context) override {
+            const Tensor& xyz1_tensor = context->input(0);
+            OP_REQUIRES(context, xyz1_tensor.dims()==3, errors::InvalidArgument("KnnPoint expects (batch_size, ndataset, c) xyz1 shape."));
+            int b = xyz1_tensor.shape().dim_size(0);
+            int n = xyz1_tensor.shape().dim_size(1);
+            int c = xyz1_tensor.shape().dim_size(2);
+
+            const Tensor& xyz2_tensor = context->input(1);
+            OP_REQUIRES(context, xyz2_tensor.dims()==3 && xyz2_tensor.shape().dim_size(0)==b && xyz2_tensor.shape().dim_size(2)==c, errors::InvalidArgument("KnnPoint expects (batch_size, npoint, c) xyz2 shape."));
+            int m = xyz2_tensor.shape().dim_size(1);
+
+            Tensor *val_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(0, TensorShape{b,m,k_}, &val_tensor));
+            Tensor *idx_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(1, TensorShape{b,m,k_}, &idx_tensor));
+            if (b==0 || m==0) return;
+            OP_REQUIRES(context, n>0, errors::InvalidArgument("KnnPoint expects at least one input point"));
+
+            knn_point_cpu(*context->device()->tensorflow_cpu_worker_threads(), b, n, c, m, k_,
+                          xyz1_tensor.flat<float>().data(), xyz2_tensor.flat<float>().data(),
+                          val_tensor->flat<float>().data(), idx_tensor->flat<int>().data());
+        }
+    private:
+        int k_;
+};
+REGISTER_KERNEL_BUILDER(Name("KnnPoint").Device(DEVICE_CPU), KnnPointOp);
+
+class GroupPointOp: public OpKernel{
+    public:
+        explicit GroupPointOp(OpKernelConstruction * context):OpKernel(context){}
+
+        void Compute(OpKernelContext * context) override {
+            const Tensor& points_tensor=context->input(0);
+            OP_REQUIRES(context, points_tensor.dims()==3, errors::InvalidArgument("GroupPoint expects (batch_size, num_points, channel) points shape"));
+            int b = points_tensor.shape().dim_size(0);
+            int n = points_tensor.shape().dim_size(1);
+            int c = points_tensor.shape().dim_size(2);
+
+            const Tensor& idx_tensor=context->input(1);
+            OP_REQUIRES(context,idx_tensor.dims()==3 && idx_tensor.shape().dim_size(0)==b, errors::InvalidArgument("GroupPoint expects (batch_size, npoints, nsample) idx shape"));
+            int m = idx_tensor.shape().dim_size(1);
+            int nsample = idx_tensor.shape().dim_size(2);
+
+            Tensor * out_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(0,TensorShape{b,m,nsample,c}, &out_tensor));
+            if (b==0 || m==0 || nsample==0 || c==0) return;
+
+            group_point_cpu(*context->device()->tensorflow_cpu_worker_threads(), b, n, c, m, nsample,
+                            points_tensor.flat<float>().data(), idx_tensor.flat<int>().data(),
+                            out_tensor->flat<float>().data());
+        }
+};
+REGISTER_KERNEL_BUILDER(Name("GroupPoint").Device(DEVICE_CPU),GroupPointOp);
+
+class GroupPointGradOp: public OpKernel{
+    public:
+        explicit GroupPointGradOp(OpKernelConstruction * context):OpKernel(context){}
+
+        void Compute(OpKernelContext * context) override {
+            const Tensor& points_tensor=context->input(0);
+            OP_REQUIRES(context, points_tensor.dims()==3, errors::InvalidArgument("GroupPointGrad expects (batch_size, num_points, channel) points shape"));
+            int b = points_tensor.shape().dim_size(0);
+            int n = points_tensor.shape().dim_size(1);
+            int c = points_tensor.shape().dim_size(2);
+
+            const Tensor& idx_tensor=context->input(1);
+            OP_REQUIRES(context,idx_tensor.dims()==3 && idx_tensor.shape().dim_size(0)==b, errors::InvalidArgument("GroupPointGrad expects (batch_size, npoints, nsample) idx shape"));
+            int m = idx_tensor.shape().dim_size(1);
+            int nsample = idx_tensor.shape().dim_size(2);
+
+            const Tensor& grad_out_tensor=context->input(2);
+            OP_REQUIRES(context,grad_out_tensor.dims()==4 && grad_out_tensor.shape().dim_size(0)==b && grad_out_tensor.shape().dim_size(1)==m && grad_out_tensor.shape().dim_size(2)==nsample && grad_out_tensor.shape().dim_size(3)==c, errors::InvalidArgument("GroupPointGrad expects (batch_size, npoints, nsample, channel) grad_out shape"));
+
+            Tensor * grad_points_tensor = nullptr;
+            OP_REQUIRES_OK(context, context->allocate_output(0,TensorShape{b,n,c}, &grad_points_tensor));
+            if (b==0 || n==0 || c==0) return;
+
+            group_point_grad_cpu(*context->device()->tensorflow_cpu_worker_threads(), b, n, c, m, nsample,
+                                 grad_out_tensor.flat<float>().data(), idx_tensor.flat<int>().data(),
+                                 grad_points_tensor->flat<float>().data());
+        }
+};
+REGISTER_KERNEL_BUILDER(Name("GroupPointGrad").Device(DEVICE_CPU),GroupPointGradOp);
+
+#if GOOGLE_CUDA
 void queryBallPointLauncher(int b, int n, int m, float radius, int nsample, const float *xyz1, const float *xyz2, int *idx, int *pts_cnt);
 class QueryBallPointGpuOp : public OpKernel {
     public:
@@ -206,5 +633,4 @@ class GroupPointGradGpuOp: public OpKernel{
         }
 };
 REGISTER_KERNEL_BUILDER(Name("GroupPointGrad").Device(DEVICE_GPU),GroupPointGradGpuOp);
-
-
+#endif // GOOGLE_CUDA
@@ -2,9 +2,16 @@ import tensorflow as tf
 from tensorflow.python.framework import ops
 import sys
 import os
+import warnings
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
-grouping_module=tf.load_op_library(os.path.join(BASE_DIR, 'tf_grouping_so.so'))
+import np_grouping
+try:
+    grouping_module=tf.load_op_library(os.path.join(BASE_DIR, 'tf_grouping_so.so'))
+except tf.errors.NotFoundError:
+    # compiled ops are missing, use the (slower) NumPy reference implementation
+    warnings.warn('tf_grouping_so.so not found, falling back to NumPy grouping ops')
+    grouping_module=None
 def query_ball_point(radius, nsample, xyz1, xyz2):
     '''
     Input:
@@ -17,6 +24,13 @@ def query_ball_point(radius, nsample, xyz1, xyz2):
         pts_cnt: (batch_size, npoint) int32 array, number of unique points in each local region
     '''
     #return grouping_module.query_ball_point(radius, nsample, xyz1, xyz2)
+    if grouping_module is None:
+        xyz2 = tf.convert_to_tensor(xyz2)
+        idx, pts_cnt = tf.numpy_function(lambda x1, x2: np_grouping.query_ball_point(radius, nsample, x1, x2),
+                                         [xyz1, xyz2], [tf.int32, tf.int32])
+        idx.set_shape(xyz2.get_shape()[0:2].concatenate([nsample]))
+        pts_cnt.set_shape(xyz2.get_shape()[0:2])
+        return idx, pts_cnt
     return grouping_module.query_ball_point(xyz1, xyz2, radius, nsample)
 ops.NoGradient('QueryBallPoint')
 def select_top_k(k, dist):
@@ -28,6 +42,12 @@ def select_top_k(k, dist):
         idx: (b,m,n) int32 array, first k in n are indices to the top k
         dist_out: (b,m,n) float32 array, first k in n are the top k
     '''
+    if grouping_module is None:
+        dist = tf.convert_to_tensor(dist)
+        outi, out = tf.numpy_function(lambda d: np_grouping.select_top_k(k, d), [dist], [tf.int32, tf.float32])
+        outi.set_shape(dist.get_shape())
+        out.set_shape(dist.get_shape())
+        return outi, out
     return grouping_module.selection_sort(dist, k)
 ops.NoGradient('SelectionSort')
 def group_point(points, idx):
@@ -38,6 +58,8 @@ def group_point(points, idx):
     Output:
         out: (batch_size, npoint, nsample, channel) float32 array, values sampled from points
     '''
+    if grouping_module is None:
+        return tf.gather(points, idx, batch_dims=1) # differentiable, no custom gradient needed
     return grouping_module.group_point(points, idx)
 @tf.RegisterGradient('GroupPoint')
 def _group_point_grad(op, grad_out):
@@ -52,25 +74,21 @@ def knn_point(k, xyz1, xyz2):
         xyz1: (batch_size, ndataset, c) float32 array, input points
         xyz2: (batch_size, npoint, c) float32 array, query points
     Output:
-        val: (batch_size, npoint, k) float32 array, L2 distances
+        val: (batch_size, npoint, k) float32 array, squared L2 distances, nearest first
         idx: (batch_size, npoint, k) int32 array, indices to input points
+    Note:
+        Uses a spatial grid on CPU, so memory is O(npoint*k) instead of the
+        (batch_size, npoint, ndataset, c) tile a dense distance matrix needs.
     '''
-    b = xyz1.get_shape()[0].value
-    n = xyz1.get_shape()[1].value
-    c = xyz1.get_shape()[2].value
-    m = xyz2.get_shape()[1].value
-    print b, n, c, m
-    print xyz1, (b,1,n,c)
-    xyz1 = tf.tile(tf.reshape(xyz1, (b,1,n,c)), [1,m,1,1])
-    xyz2 = tf.tile(tf.reshape(xyz2, (b,m,1,c)), [1,1,n,1])
-    dist = tf.reduce_sum((xyz1-xyz2)**2, -1)
-    print dist, k
-    outi, out = select_top_k(k, dist)
-    idx = tf.slice(outi, [0,0,0], [-1,-1,k])
-    val = tf.slice(out, [0,0,0], [-1,-1,k])
-    print idx, val
-    #val, idx = tf.nn.top_k(-dist, k=k) # ONLY SUPPORT CPU
-    return val, idx
+    if grouping_module is None:
+        xyz2 = tf.convert_to_tensor(xyz2)
+        val, idx = tf.numpy_function(lambda x1, x2: np_grouping.knn_point(k, x1, x2),
+                                     [xyz1, xyz2], [tf.float32, tf.int32])
+        val.set_shape(xyz2.get_shape()[0:2].concatenate([k]))
+        idx.set_shape(xyz2.get_shape()[0:2].concatenate([k]))
+        return val, idx
+    return grouping_module.knn_point(xyz1, xyz2, k)
+ops.NoGradient('KnnPoint')
 
 if __name__=='__main__':
     knn=True
@@ -80,7 +98,7 @@ if __name__=='__main__':
     pts = np.random.random((32,512,64)).astype('float32')
     tmp1 = np.random.random((32,512,3)).astype('float32')
     tmp2 = np.random.random((32,128,3)).astype('float32')
-    with tf.device('/gpu:1'):
+    with tf.device('/cpu:0'):
         points = tf.constant(pts)
         xyz1 = tf.constant(tmp1)
         xyz2 = tf.constant(tmp2)
@@ -94,12 +112,15 @@ if __name__=='__main__':
             grouped_points = group_point(points, idx)
             #grouped_points_grad = tf.ones_like(grouped_points)
             #points_grad = tf.gradients(grouped_points, points, grouped_points_grad)
-    with tf.Session('') as sess:
-        now = time.time() 
+        now = time.time()
         for _ in range(100):
-            ret = sess.run(grouped_points)
-        print time.time() - now
-        print ret.shape, ret.dtype
-        print ret
+            if knn:
+                _, idx = knn_point(nsample, xyz1, xyz2)
+            else:
+                idx, _ = query_ball_point(radius, nsample, xyz1, xyz2)
+            ret = group_point(points, idx).numpy()
+        print(time.time() - now)
+        print(ret.shape, ret.dtype)
+        print(ret)
     
     
@@ -16,8 +16,21 @@ TF_INC=$(python -c 'import tensorflow as tf; print(tf.sysconfig.get_include())')
 TF_LIB=$(python -c 'import tensorflow as tf; print(tf.sysconfig.get_lib())')
 CUDA_DIR=/usr/local/cuda-12.3
 
+# nvcc from CUDA_DIR, else from PATH; CPU-only build when neither exists (e.g. inference nodes)
+if [ -x "$CUDA_DIR/bin/nvcc" ]; then
+    NVCC=$CUDA_DIR/bin/nvcc
+else
+    NVCC=$(command -v nvcc)
+fi
+if [ -z "$NVCC" ]; then
+    g++ -std=c++17 -shared -o tf_grouping_so.so tf_grouping.cpp \
+        -I"$TF_INC" -I"$TF_INC/external/nsync/public" \
+        -O2 -fPIC -D_GLIBCXX_USE_CXX11_ABI=1
+    exit 0
+fi
+
 # Step 1: Compile the CUDA code
-$CUDA_DIR/bin/nvcc -std=c++17 -c -o tf_grouping_g.cu.o tf_grouping_g.cu \
+"$NVCC" -std=c++17 -c -o tf_grouping_g.cu.o tf_grouping_g.cu \
     -I$TF_INC -I$TF_INC/external/nsync/public \
     -I$CUDA_DIR/include -DGOOGLE_CUDA=1 -x cu -Xcompiler -fPIC -O2
 
@@ -26,4 +39,4 @@ g++ -std=c++17 -shared -o tf_grouping_so.so tf_grouping.cpp tf_grouping_g.cu.o \
     -I"$TF_INC" -I"$TF_INC/external/nsync/public" \
     -I"$CUDA_DIR/include" \
     -L"$CUDA_DIR/lib64" -lcudart \
-    -O2 -fPIC -D_GLIBCXX_USE_CXX11_ABI=1
+    -O2 -fPIC -DGOOGLE_CUDA=1 -D_GLIBCXX_USE_CXX11_ABI=1
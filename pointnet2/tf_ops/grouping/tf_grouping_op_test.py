@@ -1,28 +1,81 @@
 import tensorflow as tf
 import numpy as np
-from tf_grouping import query_ball_point, group_point
+from tf_grouping import query_ball_point, group_point, select_top_k, knn_point, grouping_module
+import np_grouping
 
 class GroupPointTest(tf.test.TestCase):
   def test(self):
     pass
 
+  def test_query_ball_point(self):
+    xyz1 = np.random.random((2,2048,3)).astype('float32')
+    xyz2 = np.random.random((2,64,3)).astype('float32')
+    radius = 0.15
+    nsample = 16
+    with tf.device('/cpu:0'):
+      idx, pts_cnt = self.evaluate(query_ball_point(radius, nsample, tf.constant(xyz1), tf.constant(xyz2)))
+    for b in range(2):
+      for j in range(64):
+        # the FIRST nsample points inside the ball, padded with the first one
+        d = np.sqrt(np.sum((xyz1[b]-xyz2[b,j])**2, -1))
+        inside = np.where(d<radius)[0][:nsample]
+        self.assertEqual(pts_cnt[b,j], len(inside))
+        if len(inside)>0:
+          expected = np.concatenate([inside, np.repeat(inside[0], nsample-len(inside))])
+          self.assertAllEqual(idx[b,j], expected)
+    if grouping_module is not None: # otherwise this would compare np_grouping with itself
+      ref_idx, ref_cnt = np_grouping.query_ball_point(radius, nsample, xyz1, xyz2)
+      self.assertAllEqual(idx, ref_idx)
+      self.assertAllEqual(pts_cnt, ref_cnt)
+
+  def test_select_top_k(self):
+    dist = np.random.random((2,16,100)).astype('float32')
+    with tf.device('/cpu:0'):
+      outi, out = self.evaluate(select_top_k(5, tf.constant(dist)))
+    self.assertAllEqual(outi[:,:,:5], np.argsort(dist, -1)[:,:,:5])
+    self.assertAllClose(out[:,:,:5], np.sort(dist, -1)[:,:,:5])
+
+  def test_knn_point(self):
+    for c in (3, 5):
+      xyz1 = np.random.random((2,3000,c)).astype('float32')
+      xyz2 = (np.random.random((2,50,c))*1.4-0.2).astype('float32') # some queries outside the cloud
+      with tf.device('/cpu:0'):
+        val, idx = self.evaluate(knn_point(8, tf.constant(xyz1), tf.constant(xyz2)))
+      dist = np.sum((xyz2[:,:,None,:]-xyz1[:,None,:,:])**2, -1)
+      self.assertAllEqual(idx, np.argsort(dist, -1, kind='stable')[:,:,:8])
+      self.assertAllClose(val, np.sort(dist, -1)[:,:,:8], atol=1e-5)
+      if grouping_module is not None:
+        ref_val, ref_idx = np_grouping.knn_point(8, xyz1, xyz2)
+        self.assertAllEqual(idx, ref_idx)
+        self.assertAllClose(val, ref_val, atol=1e-5)
+
+  def test_hand_computed(self):
+    xyz1 = np.array([[[0,0,0],[1,0,0],[0.2,0,0],[3,0,0]]], dtype='float32')
+    xyz2 = np.array([[[0,0,0],[0.9,0,0],[10,0,0]]], dtype='float32')
+    points = np.array([[[1],[2],[3],[4]]], dtype='float32')
+    with tf.device('/cpu:0'):
+      idx, pts_cnt = self.evaluate(query_ball_point(0.5, 3, tf.constant(xyz1), tf.constant(xyz2)))
+      grouped = self.evaluate(group_point(tf.constant(points), tf.constant(idx)))
+      val, knn_idx = self.evaluate(knn_point(2, tf.constant(xyz1), tf.constant(xyz2)))
+    # balls of radius 0.5: {0, 2} around the origin, {1} around 0.9, none around 10
+    self.assertAllEqual(pts_cnt, [[2,1,0]])
+    self.assertAllEqual(idx[0,0:2], [[0,2,0],[1,1,1]])
+    self.assertAllEqual(grouped[0,0:2,:,0], [[1,3,1],[2,2,2]])
+    self.assertAllEqual(knn_idx, [[[0,2],[1,2],[3,1]]])
+    self.assertAllClose(val, [[[0,0.04],[0.01,0.49],[49,81]]], atol=1e-5)
+
   def test_grad(self):
-    with tf.device('/gpu:0'):
+    with tf.device('/cpu:0'):
       points = tf.constant(np.random.random((1,128,16)).astype('float32'))
-      print points
       xyz1 = tf.constant(np.random.random((1,128,3)).astype('float32'))
       xyz2 = tf.constant(np.random.random((1,8,3)).astype('float32'))
-      radius = 0.3 
+      radius = 0.3
       nsample = 32
       idx, pts_cnt = query_ball_point(radius, nsample, xyz1, xyz2)
-      grouped_points = group_point(points, idx)
-      print grouped_points
-
-    with self.test_session():
-      print "---- Going to compute gradient error"
-      err = tf.test.compute_gradient_error(points, (1,128,16), grouped_points, (1,8,32,16))
-      print err
-      self.assertLess(err, 1e-4) 
+      theoretical, numerical = tf.test.compute_gradient(lambda p: group_point(p, idx), [points])
+    err = np.max(np.abs(theoretical[0]-numerical[0]))
+    print(err)
+    self.assertLess(err, 1e-4)
 
 if __name__=='__main__':
-  tf.test.main() 
+  tf.test.main()
@@ -0,0 +1,55 @@
+''' NumPy reference implementation of the sampling ops.
+
+Used by tf_sampling when tf_sampling_so.so is not available, and as a
+correctness oracle for the compiled kernels.
+'''
+import numpy as np
+
+def prob_sample(inp, inpr):
+    '''
+input:
+    batch_size * ncategory float32
+    batch_size * npoints   float32
+returns:
+    batch_size * npoints   int32
+    '''
+    inp = np.asarray(inp, dtype=np.float64)
+    inpr = np.asarray(inpr, dtype=np.float64)
+    out = np.zeros(inpr.shape, dtype=np.int32)
+    for i in range(inp.shape[0]):
+        cum = np.cumsum(inp[i])
+        out[i] = np.minimum(np.searchsorted(cum, inpr[i]*cum[-1]), inp.shape[1]-1)
+    return out
+
+def gather_point(inp, idx):
+    '''
+input:
+    batch_size * ndataset * 3   float32
+    batch_size * npoints        int32
+returns:
+    batch_size * npoints * 3    float32
+    '''
+    return np.take_along_axis(np.asarray(inp), np.asarray(idx)[:,:,None].astype(np.int64), 1)
+
+def farthest_point_sample(npoint, inp):
+    '''
+input:
+    int32
+    batch_size * ndataset * 3   float32
+returns:
+    batch_size * npoint         int32
+    '''
+    inp = np.asarray(inp, dtype=np.float32)
+    b, n = inp.shape[0:2]
+    out = np.zeros((b, npoint), dtype=np.int32)
+    if n == 0:
+        return out
+    batch = np.arange(b)
+    dists = np.full((b, n), 1e38, dtype=np.float32)
+    old = np.zeros(b, dtype=np.int64)
+    for j in range(1, npoint):
+        d = np.sum((inp - inp[batch, old][:,None,:])**2, -1)
+        np.minimum(dists, d, out=dists)
+        old = np.argmax(dists, 1)
+        out[:, j] = old
+    return out
@@ -8,7 +8,11 @@
 #include "tensorflow/core/framework/shape_inference.h"
 #include "tensorflow/core/framework/common_shape_fns.h"
 #include "tensorflow/core/platform/status.h" 
+#include "tensorflow/core/util/work_sharder.h"
+#include <algorithm>
+#if GOOGLE_CUDA
 #include <cuda_runtime.h>
+#endif
 
 using namespace tensorflow;
 
@@ -63,6 +67,201 @@ REGISTER_OP("GatherPointGrad")
     return tsl::OkStatus();
   });
 
+// CPU kernels. Work is split over the batch (or batch*points) with the
+// TensorFlow intra-op thread pool so they scale with the host cores.
+
+// input: inp_p (b,n) unnormalized weights, inp_r (b,m) uniform samples in [0,1)
+// temp: (b,n) working space for the running sums
+// output: out (b,m)
+void probsample_cpu(const DeviceBase::CpuWorkerThreads& workers,int b,int n,int m,const float * inp_p,const float * inp_r,float * temp,int * out){
+  auto work=[&](int64 start,int64 limit){
+    for (int64 i=start;i<limit;i++){
+      const float * p=inp_p+i*n;
+      float * cum=temp+i*n;
+      double runningsum=0;
+      for (int j=0;j<n;j++){
+        runningsum+=p[j];
+        cum[j]=runningsum;
+      }
+      for (int j=0;j<m;j++){
+        float q=inp_r[i*m+j]*cum[n-1];
+        int r=std::lower_bound(cum,cum+n,q)-cum;
+        out[i*m+j]=std::min(r,n-1);
+      }
+    }
+  };
+  Shard(workers.num_threads,workers.workers,b,int64(n+m)*20,work);
+}
+
+// Incremental farthest point sampling: temp keeps, for every input point, the
+// squared distance to the closest point selected so far.
+// input: inp (b,n,3), temp (b,n)
+// output: out (b,m)
+void farthestpointsampling_cpu(const DeviceBase::CpuWorkerThreads& workers,int b,int n,int m,const float * inp,float * temp,int * out){
+  auto work=[&](int64 start,int64 limit){
+    for (int64 i=start;i<limit;i++){
+      const float * dataset=inp+i*n*3;
+      float * dists=temp+i*n;
+      int * idxs=out+i*m;
+      std::fill(dists,dists+n,1e38f);
+      int old=0;
+      idxs[0]=old;
+      for (int j=1;j<m;j++){
+        float x1=dataset[old*3+0];
+        float y1=dataset[old*3+1];
+        float z1=dataset[old*3+2];
+        int besti=0;
+        float best=-1;
+        for (int k=0;k<n;k++){
+          float x2=dataset[k*3+0]-x1;
+          float y2=dataset[k*3+1]-y1;
+          float z2=dataset[k*3+2]-z1;
+          float d=std::min(x2*x2+y2*y2+z2*z2,dists[k]);
+          dists[k]=d;
+          if (d>best){
+            best=d;
+            besti=k;
+          }
+        }
+        old=besti;
+        idxs[j]=old;
+      }
+    }
+  };
+  Shard(workers.num_threads,workers.workers,b,int64(n)*m*10,work);
+}
+
+// input: inp (b,n,3), idx (b,m)
+// output: out (b,m,3)
+void gatherpoint_cpu(const DeviceBase::CpuWorkerThreads& workers,int b,int n,int m,const float * inp,const int * idx,float * out){
+  auto work=[&](int64 start,int64 limit){
+    for (int64 t=start;t<limit;t++){
+      int64 i=t/m;
+      int a=idx[t];
+      out[t*3+0]=inp[(i*n+a)*3+0];
+      out[t*3+1]=inp[(i*n+a)*3+1];
+      out[t*3+2]=inp[(i*n+a)*3+2];
+    }
+  };
+  Shard(workers.num_threads,workers.workers,int64(b)*m,10,work);
+}
+
+// Batch elements never share outputs, so each thread owns whole batches and
+// no atomics are needed.
+// input: out_g (b,m,3), idx (b,m)
+// output: inp_g (b,n,3)
+void scatteraddpoint_cpu(const DeviceBase::CpuWorkerThreads& workers,int b,int n,int m,const float * out_g,const int * idx,float * inp_g){
+  auto work=[&](int64 start,int64 limit){
+    for (int64 i=start;i<limit;i++){
+      std::fill(inp_g+i*n*3,inp_g+(i+1)*n*3,0.0f);
+      for (int j=0;j<m;j++){
+        int a=idx[i*m+j];
+        inp_g[(i*n+a)*3+0]+=out_g[(i*m+j)*3+0];
+        inp_g[(i*n+a)*3+1]+=out_g[(i*m+j)*3+1];
+        inp_g[(i*n+a)*3+2]+=out_g[(i*m+j)*3+2];
+      }
+    }
+  };
+  Shard(workers.num_threads,workers.workers,b,int64(n+m)*10,work);
+}
+
+class ProbSampleOp: public OpKernel{
+  public:
+    explicit ProbSampleOp(OpKernelConstruction* context):OpKernel(context){}
+    void Compute(OpKernelContext * context)override{
+      const Tensor& inp_tensor=context->input(0);
+      const Tensor& inpr_tensor=context->input(1);
+      OP_REQUIRES(context,inp_tensor.dims()==2,errors::InvalidArgument("ProbSample expects (batch_size,num_choices) inp shape"));
+      int b=inp_tensor.shape().dim_size(0);
+      int n=inp_tensor.shape().dim_size(1);
+      OP_REQUIRES(context,inpr_tensor.dims()==2 && inpr_tensor.shape().dim_size(0)==b,errors::InvalidArgument("ProbSample expects (batch_size,num_points) inpr shape"));
+      int m=inpr_tensor.shape().dim_size(1);
+      Tensor * out_tensor=NULL;
+      OP_REQUIRES_OK(context,context->allocate_output(0,TensorShape{b,m},&out_tensor));
+      if (b==0 || m==0) return;
+      OP_REQUIRES(context,n>0,errors::InvalidArgument("ProbSample expects at least one choice"));
+      Tensor temp_tensor;
+      OP_REQUIRES_OK(context,context->allocate_temp(DataTypeToEnum<float>::value,TensorShape{b,n},&temp_tensor));
+      probsample_cpu(*context->device()->tensorflow_cpu_worker_threads(),b,n,m,
+                     inp_tensor.flat<float>().data(),inpr_tensor.flat<float>().data(),
+                     temp_tensor.flat<float>().data(),out_tensor->flat<int>().data());
+    }
+};
+REGISTER_KERNEL_BUILDER(Name("ProbSample").Device(DEVICE_CPU), ProbSampleOp);
+
+class FarthestPointSampleOp: public OpKernel{
+  public:
+    explicit FarthestPointSampleOp(OpKernelConstruction* context):OpKernel(context) {
+                    OP_REQUIRES_OK(context, context->GetAttr("npoint", &npoint_));
+                    OP_REQUIRES(context, npoint_ > 0, errors::InvalidArgument("FarthestPointSample expects positive npoint"));
+                }
+    void Compute(OpKernelContext * context)override{
+      int m = npoint_;
+
+      const Tensor& inp_tensor=context->input(0);
+      OP_REQUIRES(context,inp_tensor.dims()==3 && inp_tensor.shape().dim_size(2)==3,errors::InvalidArgument("FarthestPointSample expects (batch_size,num_points,3) inp shape"));
+      int b=inp_tensor.shape().dim_size(0);
+      int n=inp_tensor.shape().dim_size(1);
+      Tensor * out_tensor;
+      OP_REQUIRES_OK(context,context->allocate_output(0,TensorShape{b,m},&out_tensor));
+      if (b==0) return;
+      OP_REQUIRES(context,n>0,errors::InvalidArgument("FarthestPointSample expects at least one input point"));
+      Tensor temp_tensor;
+      OP_REQUIRES_OK(context,context->allocate_temp(DataTypeToEnum<float>::value,TensorShape{b,n},&temp_tensor));
+      farthestpointsampling_cpu(*context->device()->tensorflow_cpu_worker_threads(),b,n,m,
+                                inp_tensor.flat<float>().data(),temp_tensor.flat<float>().data(),
+                                out_tensor->flat<int>().data());
+    }
+    private:
+        int npoint_;
+};
+REGISTER_KERNEL_BUILDER(Name("FarthestPointSample").Device(DEVICE_CPU),FarthestPointSampleOp);
+
+class GatherPointOp: public OpKernel{
+  public:
+    explicit GatherPointOp(OpKernelConstruction * context):OpKernel(context){}
+    void Compute(OpKernelContext * context)override{
+      const Tensor& inp_tensor=context->input(0);
+      OP_REQUIRES(context,inp_tensor.dims()==3 && inp_tensor.shape().dim_size(2)==3,errors::InvalidArgument("GatherPoint expects (batch_size,num_points,3) inp shape"));
+      int b=inp_tensor.shape().dim_size(0);
+      int n=inp_tensor.shape().dim_size(1);
+      const Tensor& idx_tensor=context->input(1);
+      OP_REQUIRES(context,idx_tensor.dims()==2 && idx_tensor.shape().dim_size(0)==b,errors::InvalidArgument("GatherPoint expects (batch_size,num_result) idx shape"));
+      int m=idx_tensor.shape().dim_size(1);
+      Tensor * out_tensor=NULL;
+      OP_REQUIRES_OK(context,context->allocate_output(0,TensorShape{b,m,3},&out_tensor));
+      if (b==0 || m==0) return;
+      gatherpoint_cpu(*context->device()->tensorflow_cpu_worker_threads(),b,n,m,
+                      inp_tensor.flat<float>().data(),idx_tensor.flat<int>().data(),
+                      out_tensor->flat<float>().data());
+    }
+};
+REGISTER_KERNEL_BUILDER(Name("GatherPoint").Device(DEVICE_CPU),GatherPointOp);
+
+class GatherPointGradOp: public OpKernel{
+  public:
+    explicit GatherPointGradOp(OpKernelConstruction * context):OpKernel(context){}
+    void Compute(OpKernelContext * context)override{
+      const Tensor& inp_tensor=context->input(0);
+      OP_REQUIRES(context,inp_tensor.dims()==3 && inp_tensor.shape().dim_size(2)==3,errors::InvalidArgument("GatherPointGradOp expects (batch_size,num_points,3) inp"));
+      int b=inp_tensor.shape().dim_size(0);
+      int n=inp_tensor.shape().dim_size(1);
+      const Tensor& idx_tensor=context->input(1);
+      OP_REQUIRES(context,idx_tensor.dims()==2 && idx_tensor.shape().dim_size(0)==b,errors::InvalidArgument("GatherPointGradOp expects (batch_size,num_result) idx shape"));
+      int m=idx_tensor.shape().dim_size(1);
+      const Tensor& out_g_tensor=context->input(2);
+      OP_REQUIRES(context,out_g_tensor.dims()==3 && out_g_tensor.shape().dim_size(0)==b && out_g_tensor.shape().dim_size(1)==m && out_g_tensor.shape().dim_size(2)==3,errors::InvalidArgument("GatherPointGradOp expects (batch_size,num_result,3) out_g shape"));
+      Tensor * inp_g_tensor=NULL;
+      OP_REQUIRES_OK(context,context->allocate_output(0,TensorShape{b,n,3},&inp_g_tensor));
+      if (b==0 || n==0) return;
+      scatteraddpoint_cpu(*context->device()->tensorflow_cpu_worker_threads(),b,n,m,
+                          out_g_tensor.flat<float>().data(),idx_tensor.flat<int>().data(),
+                          inp_g_tensor->flat<float>().data());
+    }
+};
+REGISTER_KERNEL_BUILDER(Name("GatherPointGrad").Device(DEVICE_CPU),GatherPointGradOp);
+
+#if GOOGLE_CUDA
 void probsampleLauncher(int b,int n,int m,const float * inp_p,const float * inp_r,float * temp,int * out);
 class ProbSampleGpuOp: public OpKernel{
   public:
@@ -177,4 +376,4 @@ class GatherPointGradGpuOp: public OpKernel{
     }
 };
 REGISTER_KERNEL_BUILDER(Name("GatherPointGrad").Device(DEVICE_GPU),GatherPointGradGpuOp);
-
+#endif // GOOGLE_CUDA
@@ -7,9 +7,16 @@ import tensorflow as tf
 from tensorflow.python.framework import ops
 import sys
 import os
+import warnings
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
-sampling_module=tf.load_op_library(os.path.join(BASE_DIR, 'tf_sampling_so.so'))
+import np_sampling
+try:
+    sampling_module=tf.load_op_library(os.path.join(BASE_DIR, 'tf_sampling_so.so'))
+except tf.errors.NotFoundError:
+    # compiled ops are missing, use the (slower) NumPy reference implementation
+    warnings.warn('tf_sampling_so.so not found, falling back to NumPy sampling ops')
+    sampling_module=None
 def prob_sample(inp,inpr):
     '''
 input:
@@ -18,6 +25,11 @@ input:
 returns:
     batch_size * npoints   int32
     '''
+    if sampling_module is None:
+        inpr=tf.convert_to_tensor(inpr)
+        out=tf.numpy_function(np_sampling.prob_sample,[inp,inpr],tf.int32)
+        out.set_shape(inpr.get_shape())
+        return out
     return sampling_module.prob_sample(inp,inpr)
 ops.NoGradient('ProbSample')
 # TF1.0 API requires set shape in C++
@@ -34,6 +46,8 @@ input:
 returns:
     batch_size * npoints * 3    float32
     '''
+    if sampling_module is None:
+        return tf.gather(inp,idx,batch_dims=1) # differentiable, no custom gradient needed
     return sampling_module.gather_point(inp,idx)
 #@tf.RegisterShape('GatherPoint')
 #def _gather_point_shape(op):
@@ -53,6 +67,11 @@ input:
 returns:
     batch_size * npoint         int32
     '''
+    if sampling_module is None:
+        inp=tf.convert_to_tensor(inp)
+        out=tf.numpy_function(lambda x: np_sampling.farthest_point_sample(npoint,x),[inp],tf.int32)
+        out.set_shape([inp.get_shape()[0],npoint])
+        return out
     return sampling_module.farthest_point_sample(inp, npoint)
 ops.NoGradient('FarthestPointSample')
     
@@ -66,24 +85,23 @@ if __name__=='__main__':
         tria=inp[:,:,0,:]
         trib=inp[:,:,1,:]
         tric=inp[:,:,2,:]
-        areas=tf.sqrt(tf.reduce_sum(tf.cross(trib-tria,tric-tria)**2,2)+1e-9)
-        randomnumbers=tf.random_uniform((1,8192))
+        areas=tf.sqrt(tf.reduce_sum(tf.linalg.cross(trib-tria,tric-tria)**2,2)+1e-9)
+        randomnumbers=tf.random.uniform((1,8192))
         triids=prob_sample(areas,randomnumbers)
         tria_sample=gather_point(tria,triids)
         trib_sample=gather_point(trib,triids)
         tric_sample=gather_point(tric,triids)
-        us=tf.random_uniform((1,8192))
-        vs=tf.random_uniform((1,8192))
+        us=tf.random.uniform((1,8192))
+        vs=tf.random.uniform((1,8192))
         uplusv=1-tf.abs(us+vs-1)
         uminusv=us-vs
         us=(uplusv+uminusv)*0.5
         vs=(uplusv-uminusv)*0.5
         pt_sample=tria_sample+(trib_sample-tria_sample)*tf.expand_dims(us,-1)+(tric_sample-tria_sample)*tf.expand_dims(vs,-1)
-        print 'pt_sample: ', pt_sample
+        print('pt_sample: ', pt_sample)
         reduced_sample=gather_point(pt_sample,farthest_point_sample(1024,pt_sample))
-        print reduced_sample
-    with tf.Session('') as sess:
-        ret=sess.run(reduced_sample)
-    print ret.shape,ret.dtype
-    import cPickle as pickle
+        print(reduced_sample)
+    ret=reduced_sample.numpy()
+    print(ret.shape,ret.dtype)
+    import pickle
     pickle.dump(ret,open('1.pkl','wb'),-1)
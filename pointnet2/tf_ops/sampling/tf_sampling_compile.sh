@@ -20,8 +20,23 @@ EOF
 CUDA_DIR=/usr/local/cuda-12.3
 CUDA_LIB_DIR=${CUDA_DIR}/lib64
 
+# nvcc from CUDA_DIR, else from PATH; CPU-only build when neither exists (e.g. inference nodes)
+if [ -x "${CUDA_DIR}/bin/nvcc" ]; then
+    NVCC=${CUDA_DIR}/bin/nvcc
+else
+    NVCC=$(command -v nvcc)
+fi
+if [ -z "$NVCC" ]; then
+    g++ -std=c++17 -shared tf_sampling.cpp \
+        ${TF_CPPFLAGS} \
+        ${TF_LDFLAGS} \
+        -fPIC -O2 -D_GLIBCXX_USE_CXX11_ABI=1 \
+        -o tf_sampling_so.so
+    exit 0
+fi
+
 # Compile the CUDA kernel
-nvcc -std=c++17 -c tf_sampling_g.cu \
+"$NVCC" -std=c++17 -c tf_sampling_g.cu \
     ${TF_CPPFLAGS} \
     -I${CUDA_DIR}/include \
     -DGOOGLE_CUDA=1 \
@@ -34,5 +49,5 @@ g++ -std=c++17 -shared tf_sampling.cpp tf_sampling_g.cu.o \
     -I${CUDA_DIR}/include \
     ${TF_LDFLAGS} \
     -L${CUDA_LIB_DIR} -lcudart \
-    -fPIC -O2 -D_GLIBCXX_USE_CXX11_ABI=1 \
+    -fPIC -O2 -DGOOGLE_CUDA=1 -D_GLIBCXX_USE_CXX11_ABI=1 \
     -o tf_sampling_so.so
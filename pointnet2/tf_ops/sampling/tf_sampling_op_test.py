@@ -0,0 +1,49 @@
+import tensorflow as tf
+import numpy as np
+from tf_sampling import farthest_point_sample, gather_point, prob_sample, sampling_module
+import np_sampling
+
+class SamplingTest(tf.test.TestCase):
+  def test_farthest_point_sample(self):
+    with tf.device('/cpu:0'):
+      xyz = np.random.random((4,256,3)).astype('float32')
+      idx = self.evaluate(farthest_point_sample(32, tf.constant(xyz)))
+    self.assertEqual(idx.shape, (4,32))
+    for b in range(4):
+      # brute force reference: greedy max-min distance selection from point 0
+      ref = [0]
+      dists = np.full(256, np.inf)
+      for _ in range(31):
+        dists = np.minimum(dists, np.sum((xyz[b]-xyz[b,ref[-1]])**2, -1))
+        ref.append(int(np.argmax(dists)))
+      self.assertAllEqual(idx[b], ref)
+    if sampling_module is not None: # otherwise this would compare np_sampling with itself
+      self.assertAllEqual(idx, np_sampling.farthest_point_sample(32, xyz))
+
+  def test_hand_computed(self):
+    # points 0..9 on a line: start at 0, then the far end, then the first of the two middle points
+    xyz = np.zeros((1,10,3), dtype='float32')
+    xyz[0,:,0] = np.arange(10)
+    with tf.device('/cpu:0'):
+      idx = self.evaluate(farthest_point_sample(4, tf.constant(xyz)))
+      gathered = self.evaluate(gather_point(tf.constant(xyz), tf.constant(idx)))
+    self.assertAllEqual(idx, [[0,9,4,2]])
+    self.assertAllEqual(gathered[0,:,0], [0,9,4,2])
+
+  def test_prob_sample(self):
+    with tf.device('/cpu:0'):
+      inp = tf.constant([[0.0,1.0,0.0,3.0]]*2)
+      inpr = tf.constant(np.random.random((2,1000)).astype('float32'))
+      idx = self.evaluate(prob_sample(inp, inpr))
+    self.assertTrue(np.all((idx==1) | (idx==3)))
+    self.assertNear(np.mean(idx==3), 0.75, 0.1)
+
+  def test_grad(self):
+    with tf.device('/cpu:0'):
+      inp = tf.constant(np.random.random((2,64,3)).astype('float32'))
+      idx = tf.constant(np.random.randint(0,64,(2,16)).astype('int32'))
+      err = tf.test.compute_gradient(lambda x: gather_point(x, idx), [inp])
+    self.assertAllClose(err[0][0], err[1][0], atol=1e-3)
+
+if __name__=='__main__':
+  tf.test.main()
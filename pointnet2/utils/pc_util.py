@@ -9,13 +9,22 @@ import sys
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
 
-# Draw point cloud
-from eulerangles import euler2mat
-
 # Point cloud IO
 import numpy as np
 from plyfile import PlyData, PlyElement
 
+# Draw point cloud
+try:
+    from eulerangles import euler2mat
+except ImportError:
+    def euler2mat(z=0, y=0, x=0):
+        """ Rotation matrix rotating by z, then y, then x (radians), as eulerangles.euler2mat """
+        cz, sz, cy, sy, cx, sx = np.cos(z), np.sin(z), np.cos(y), np.sin(y), np.cos(x), np.sin(x)
+        Rz = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+        Ry = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+        Rx = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+        return np.dot(Rx, np.dot(Ry, Rz))
+
  
 # ----------------------------------------
 # Point Cloud/Volume Conversions
@@ -25,17 +34,15 @@ def point_cloud_to_volume_batch(point_clouds, vsize=12, radius=1.0, flatten=True
     """ Input is BxNx3 batch of point cloud
         Output is Bx(vsize^3)
     """
-    vol_list = []
-    for b in range(point_clouds.shape[0]):
-        vol = point_cloud_to_volume(np.squeeze(point_clouds[b,:,:]), vsize, radius)
-        if flatten:
-            vol_list.append(vol.flatten())
-        else:
-            vol_list.append(np.expand_dims(np.expand_dims(vol, -1), 0))
+    B, N = point_clouds.shape[0:2]
+    vol = np.zeros((B,vsize,vsize,vsize))
+    voxel = 2*radius/float(vsize)
+    locations = ((point_clouds + radius)/voxel).astype(int).reshape(-1,3)
+    vol[np.repeat(np.arange(B), N),locations[:,0],locations[:,1],locations[:,2]] = 1.0
     if flatten:
-        return np.vstack(vol_list)
+        return vol.reshape(B, -1)
     else:
-        return np.concatenate(vol_list, 0)
+        return vol[..., np.newaxis]
 
 
 def point_cloud_to_volume(points, vsize, radius=1.0):
@@ -59,27 +66,56 @@ def volume_to_point_cloud(vol):
     """
     vsize = vol.shape[0]
     assert(vol.shape[1] == vsize and vol.shape[1] == vsize)
-    points = []
-    for a in range(vsize):
-        for b in range(vsize):
-            for c in range(vsize):
-                if vol[a,b,c] == 1:
-                    points.append(np.array([a,b,c]))
-    if len(points) == 0:
-        return np.zeros((0,3))
-    points = np.vstack(points)
-    return points
+    return np.argwhere(vol == 1)
+
+def _sample_grid_cells(point_clouds, gridsize, radius, num_sample, ndim):
+    """ Group a batch of point clouds into the cells of a regular grid over
+        their first ndim coordinates and sample num_sample points per cell.
+        Input:
+            point_clouds: BxNx3, assumed in range [-radius, radius]
+        Output:
+            B x gridsize^ndim x num_sample x 3, cells without points are zero.
+            Cells with more than num_sample points are randomly subsampled,
+            cells with fewer repeat their last point. The first ndim
+            coordinates are shifted to the cell center and scaled by the cell size.
+    """
+    B, N = point_clouds.shape[0:2]
+    cell = 2*radius/float(gridsize)
+    points = point_clouds.reshape(-1, 3)
+    locations = ((points[:,0:ndim] + radius)/cell).astype(int) # (B*N)xndim
+    valid = np.all((locations >= 0) & (locations < gridsize), axis=1)
+    keys = np.repeat(np.arange(B), N)*gridsize**ndim + np.ravel_multi_index(
+        tuple(np.clip(locations, 0, gridsize-1).T), (gridsize,)*ndim)
+    keys[~valid] = -1
+
+    # Sort by cell; inside a cell keep the input order, or a random order
+    # when the cell holds more than num_sample points
+    counts = np.bincount(keys[valid], minlength=B*gridsize**ndim)
+    oversized = valid.copy()
+    oversized[valid] = counts[keys[valid]] > num_sample
+    tiebreak = np.arange(len(points), dtype=np.float64)
+    tiebreak[oversized] = np.random.rand(np.count_nonzero(oversized))
+    order = np.lexsort((tiebreak, keys))
+    order = order[np.count_nonzero(~valid):]
+    cell_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+    choices = starts[:,None] + np.minimum(np.arange(num_sample), counts[:,None]-1) # Cxnum_sample
+    pc = points[order[choices]] # Cxnum_samplex3
+    cell_index = np.array(np.unravel_index(cell_keys % gridsize**ndim, (gridsize,)*ndim)).T
+    pc_center = (cell_index+0.5)*cell - radius
+    pc[:,:,0:ndim] = (pc[:,:,0:ndim] - pc_center[:,None,:])/cell # shift and scale
+
+    out = np.zeros((B*gridsize**ndim, num_sample, 3))
+    out[cell_keys] = pc
+    return out.reshape(B, gridsize**ndim, num_sample, 3)
 
 def point_cloud_to_volume_v2_batch(point_clouds, vsize=12, radius=1.0, num_sample=128):
     """ Input is BxNx3 a batch of point cloud
         Output is BxVxVxVxnum_samplex3
         Added on Feb 19
     """
-    vol_list = []
-    for b in range(point_clouds.shape[0]):
-        vol = point_cloud_to_volume_v2(point_clouds[b,:,:], vsize, radius, num_sample)
-        vol_list.append(np.expand_dims(vol, 0))
-    return np.concatenate(vol_list, 0)
+    vol = _sample_grid_cells(point_clouds, vsize, radius, num_sample, 3)
+    return vol.reshape(-1, vsize, vsize, vsize, num_sample, 3)
 
 def point_cloud_to_volume_v2(points, vsize, radius=1.0, num_sample=128):
     """ input is Nx3 points
@@ -89,50 +125,15 @@ def point_cloud_to_volume_v2(points, vsize, radius=1.0, num_sample=128):
         num_sample points, replicate the points
         Added on Feb 19
     """
-    vol = np.zeros((vsize,vsize,vsize,num_sample,3))
-    voxel = 2*radius/float(vsize)
-    locations = (points + radius)/voxel
-    locations = locations.astype(int)
-    loc2pc = {}
-    for n in range(points.shape[0]):
-        loc = tuple(locations[n,:])
-        if loc not in loc2pc:
-            loc2pc[loc] = []
-        loc2pc[loc].append(points[n,:])
-    #print loc2pc
-
-    for i in range(vsize):
-        for j in range(vsize):
-            for k in range(vsize):
-                if (i,j,k) not in loc2pc:
-                    vol[i,j,k,:,:] = np.zeros((num_sample,3))
-                else:
-                    pc = loc2pc[(i,j,k)] # a list of (3,) arrays
-                    pc = np.vstack(pc) # kx3
-                    # Sample/pad to num_sample points
-                    if pc.shape[0]>num_sample:
-                        choices = np.random.choice(pc.shape[0], num_sample, replace=False)
-                        pc = pc[choices,:]
-                    elif pc.shape[0]<num_sample:
-                        pc = np.lib.pad(pc, ((0,num_sample-pc.shape[0]),(0,0)), 'edge')
-                    # Normalize
-                    pc_center = (np.array([i,j,k])+0.5)*voxel - radius
-                    #print 'pc center: ', pc_center
-                    pc = (pc - pc_center) / voxel # shift and scale
-                    vol[i,j,k,:,:] = pc 
-                #print (i,j,k), vol[i,j,k,:,:]
-    return vol
+    return point_cloud_to_volume_v2_batch(points[np.newaxis], vsize, radius, num_sample)[0]
 
 def point_cloud_to_image_batch(point_clouds, imgsize, radius=1.0, num_sample=128):
     """ Input is BxNx3 a batch of point cloud
         Output is BxIxIxnum_samplex3
         Added on Feb 19
     """
-    img_list = []
-    for b in range(point_clouds.shape[0]):
-        img = point_cloud_to_image(point_clouds[b,:,:], imgsize, radius, num_sample)
-        img_list.append(np.expand_dims(img, 0))
-    return np.concatenate(img_list, 0)
+    img = _sample_grid_cells(point_clouds, imgsize, radius, num_sample, 2)
+    return img.reshape(-1, imgsize, imgsize, num_sample, 3)
 
 
 def point_cloud_to_image(points, imgsize, radius=1.0, num_sample=128):
@@ -143,50 +144,69 @@ def point_cloud_to_image(points, imgsize, radius=1.0, num_sample=128):
         num_sample points, replicate the points
         Added on Feb 19
     """
-    img = np.zeros((imgsize, imgsize, num_sample, 3))
-    pixel = 2*radius/float(imgsize)
-    locations = (points[:,0:2] + radius)/pixel # Nx2
-    locations = locations.astype(int)
-    loc2pc = {}
-    for n in range(points.shape[0]):
-        loc = tuple(locations[n,:])
-        if loc not in loc2pc:
-            loc2pc[loc] = []
-        loc2pc[loc].append(points[n,:])
-    for i in range(imgsize):
-        for j in range(imgsize):
-            if (i,j) not in loc2pc:
-                img[i,j,:,:] = np.zeros((num_sample,3))
-            else:
-                pc = loc2pc[(i,j)]
-                pc = np.vstack(pc)
-                if pc.shape[0]>num_sample:
-                    choices = np.random.choice(pc.shape[0], num_sample, replace=False)
-                    pc = pc[choices,:]
-                elif pc.shape[0]<num_sample:
-                    pc = np.lib.pad(pc, ((0,num_sample-pc.shape[0]),(0,0)), 'edge')
-                pc_center = (np.array([i,j])+0.5)*pixel - radius
-                pc[:,0:2] = (pc[:,0:2] - pc_center)/pixel
-                img[i,j,:,:] = pc
-    return img
+    return point_cloud_to_image_batch(points[np.newaxis], imgsize, radius, num_sample)[0]
 # ----------------------------------------
 # Point cloud IO
 # ----------------------------------------
 
-def read_ply(filename):
-    """ read XYZ point cloud from filename PLY file """
-    plydata = PlyData.read(filename)
-    pc = plydata['vertex'].data
-    pc_array = np.array([[x, y, z] for x,y,z in pc])
-    return pc_array
+PLY_COLOR_FIELDS = ('red', 'green', 'blue')
+PLY_NORMAL_FIELDS = ('nx', 'ny', 'nz')
+PLY_LABEL_FIELD = 'label'
 
 
-def write_ply(points, filename, text=True):
-    """ input: Nx3, write points to filename as PLY format. """
-    points = [(points[i,0], points[i,1], points[i,2]) for i in range(points.shape[0])]
-    vertex = np.array(points, dtype=[('x', 'f4'), ('y', 'f4'),('z', 'f4')])
+def _ply_fields(vertex, names, dtype=None):
+    """ Stack the named vertex fields into an NxK array, None if any is missing """
+    if not all(name in vertex.dtype.names for name in names):
+        return None
+    return np.stack([vertex[name] for name in names], axis=-1).astype(dtype or vertex[names[0]].dtype, copy=False)
+
+
+def read_ply(filename, return_colors=False, return_normals=False, return_labels=False):
+    """ read XYZ point cloud from filename PLY file
+        Input:
+            return_colors, return_normals, return_labels: also return the
+              red/green/blue (Nx3 uint8), nx/ny/nz (Nx3) and label (N) vertex
+              properties, None when the file does not have them
+        Output:
+            Nx3 points, or a tuple (points, [colors], [normals], [labels]) with
+            the requested extra arrays
+    """
+    plydata = PlyData.read(filename)
+    vertex = plydata['vertex'].data
+    pc_array = _ply_fields(vertex, ('x', 'y', 'z'))
+    if not (return_colors or return_normals or return_labels):
+        return pc_array
+    outputs = [pc_array]
+    if return_colors:
+        outputs.append(_ply_fields(vertex, PLY_COLOR_FIELDS, np.uint8))
+    if return_normals:
+        outputs.append(_ply_fields(vertex, PLY_NORMAL_FIELDS))
+    if return_labels:
+        labels = _ply_fields(vertex, (PLY_LABEL_FIELD,))
+        outputs.append(None if labels is None else labels[:, 0])
+    return tuple(outputs)
+
+
+def write_ply(points, filename, text=False, colors=None, normals=None, labels=None):
+    """ input: Nx3, write points to filename as PLY format.
+        Binary little-endian unless text is True. Optional Nx3 colors (0-255),
+        Nx3 normals and N labels are written as red/green/blue, nx/ny/nz and
+        label vertex properties.
+    """
+    points = np.asarray(points)
+    fields = [(('x', 'y', 'z'), 'f4', points)]
+    if colors is not None:
+        fields.append((PLY_COLOR_FIELDS, 'u1', np.asarray(colors)))
+    if normals is not None:
+        fields.append((PLY_NORMAL_FIELDS, 'f4', np.asarray(normals)))
+    if labels is not None:
+        fields.append(((PLY_LABEL_FIELD,), 'i4', np.asarray(labels).reshape(-1, 1)))
+    vertex = np.empty(points.shape[0], dtype=[(name, dtype) for names, dtype, _ in fields for name in names])
+    for names, _, values in fields:
+        for i, name in enumerate(names):
+            vertex[name] = values[:, i]
     el = PlyElement.describe(vertex, 'vertex', comments=['vertices'])
-    PlyData([el], text=text).write(filename)
+    PlyData([el], text=text, byte_order='<').write(filename)
 
 
 # ----------------------------------------
@@ -219,50 +239,55 @@ def draw_point_cloud(input_points, canvasSize=500, space=200, diameter=25,
 
     # Pre-compute the Gaussian disk
     radius = (diameter-1)/2.0
-    disk = np.zeros((diameter, diameter))
-    for i in range(diameter):
-        for j in range(diameter):
-            if (i - radius) * (i-radius) + (j-radius) * (j-radius) <= radius * radius:
-                disk[i, j] = np.exp((-(i-radius)**2 - (j-radius)**2)/(radius**2))
+    i, j = np.mgrid[0:diameter, 0:diameter] - radius
+    disk = np.where(i*i + j*j <= radius*radius, np.exp(-(i*i + j*j)/(radius**2)), 0)
     mask = np.argwhere(disk > 0)
     dx = mask[:, 0]
     dy = mask[:, 1]
     dv = disk[disk > 0]
-    
-    # Order points by z-buffer
-    zorder = np.argsort(points[:, 2])
-    points = points[zorder, :]
-    points[:, 2] = (points[:, 2] - np.min(points[:, 2])) / (np.max(points[:, 2] - np.min(points[:, 2])))
+
+    # Project all points and keep the nearest one (largest max_depth - z) per pixel
+    depth_range = np.max(points[:, 2]) - np.min(points[:, 2])
+    points[:, 2] = (points[:, 2] - np.min(points[:, 2])) / (depth_range if depth_range > 0 else 1.0)
     max_depth = np.max(points[:, 2])
-       
-    for i in range(points.shape[0]):
-        j = points.shape[0] - i - 1
-        x = points[j, 0]
-        y = points[j, 1]
-        xc = canvasSize/2 + (x*space)
-        yc = canvasSize/2 + (y*space)
-        xc = int(np.round(xc))
-        yc = int(np.round(yc))
-        
-        px = dx + xc
-        py = dy + yc
-        
-        image[px, py] = image[px, py] * 0.7 + dv * (max_depth - points[j, 2]) * 0.3
-    
+    xc = np.round(canvasSize/2 + points[:, 0]*space).astype(int)
+    yc = np.round(canvasSize/2 + points[:, 1]*space).astype(int)
+    inside = (xc >= 0) & (xc < canvasSize) & (yc >= 0) & (yc < canvasSize)
+    zbuffer = np.zeros((canvasSize, canvasSize))
+    np.maximum.at(zbuffer, (xc[inside], yc[inside]), max_depth - points[inside, 2])
+    if not zbuffer.any():
+        return image
+
+    # Splat the disk centred on each pixel, each pixel keeps its brightest (nearest) contribution
+    image = np.zeros((canvasSize + diameter - 1, canvasSize + diameter - 1))
+    rows = np.flatnonzero(zbuffer.any(axis=1))
+    cols = np.flatnonzero(zbuffer.any(axis=0))
+    r0, r1, c0, c1 = rows[0], rows[-1]+1, cols[0], cols[-1]+1
+    zbuffer = zbuffer[r0:r1, c0:c1]
+    for px, py, v in zip(dx, dy, dv):
+        window = image[r0+px:r1+px, c0+py:c1+py]
+        np.maximum(window, v*zbuffer, out=window)
+    offset = int(radius)
+    image = image[offset:offset+canvasSize, offset:offset+canvasSize]
+
     image = image / np.max(image)
     return image
 
-def point_cloud_three_views(points):
+# (zrot, xrot, yrot) of the three views, +y is up direction
+# xrot is azimuth
+# yrot is in-plane
+# zrot is elevation
+THREE_VIEWS = [(110/180.0*np.pi, 45/180.0*np.pi, 0/180.0*np.pi),
+               (70/180.0*np.pi, 135/180.0*np.pi, 0/180.0*np.pi),
+               (180.0/180.0*np.pi, 90/180.0*np.pi, 0/180.0*np.pi)]
+
+def point_cloud_three_views(points, **kwargs):
     """ input points Nx3 numpy array (+y is up direction).
-        return an numpy array gray image of size 500x1500. """ 
-    # +y is up direction
-    # xrot is azimuth
-    # yrot is in-plane
-    # zrot is elevation
-    img1 = draw_point_cloud(points, zrot=110/180.0*np.pi, xrot=45/180.0*np.pi, yrot=0/180.0*np.pi)
-    img2 = draw_point_cloud(points, zrot=70/180.0*np.pi, xrot=135/180.0*np.pi, yrot=0/180.0*np.pi)
-    img3 = draw_point_cloud(points, zrot=180.0/180.0*np.pi, xrot=90/180.0*np.pi, yrot=0/180.0*np.pi)
-    image_large = np.concatenate([img1, img2, img3], 1)
+        return an numpy array gray image of size 500x1500.
+        kwargs are passed to draw_point_cloud. """
+    images = [draw_point_cloud(points, zrot=zrot, xrot=xrot, yrot=yrot, **kwargs)
+              for zrot, xrot, yrot in THREE_VIEWS]
+    image_large = np.concatenate(images, 1)
     return image_large
 
 
@@ -296,20 +321,23 @@ def pyplot_draw_volume(vol, output_filename):
     points = volume_to_point_cloud(vol)
     pyplot_draw_point_cloud(points, output_filename)
 
-def write_ply_color(points, labels, out_filename, num_classes=None):
-    """ Color (N,3) points with labels (N) within range 0 ~ num_classes-1 as OBJ file """
+def write_ply_color(points, labels, out_filename, num_classes=None, ply=False):
+    """ Color (N,3) points with labels (N) within range 0 ~ num_classes-1 as OBJ file
+        If ply is True, write a binary PLY with red/green/blue and label vertex properties instead
+    """
     import matplotlib.pyplot as pyplot
     labels = labels.astype(int)
-    N = points.shape[0]
     if num_classes is None:
         num_classes = np.max(labels)+1
     else:
         assert(num_classes>np.max(labels))
-    fout = open(out_filename, 'w')
-    #colors = [pyplot.cm.hsv(i/float(num_classes)) for i in range(num_classes)]
-    colors = [pyplot.cm.jet(i/float(num_classes)) for i in range(num_classes)]
-    for i in range(N):
-        c = colors[labels[i]]
-        c = [int(x*255) for x in c]
-        fout.write('v %f %f %f %d %d %d\n' % (points[i,0],points[i,1],points[i,2],c[0],c[1],c[2]))
-    fout.close()
+    #colors = pyplot.cm.hsv(np.arange(num_classes)/float(num_classes))
+    colors = pyplot.cm.jet(np.arange(num_classes)/float(num_classes))
+    colors = (colors[:, 0:3]*255).astype(int)[labels]
+    if ply:
+        write_ply(points, out_filename, colors=colors, labels=labels)
+    else:
+        # one formatting pass over all rows, much faster than np.savetxt's per-row writes
+        rows = np.hstack([points[:, 0:3], colors])
+        with open(out_filename, 'w') as fout:
+            fout.write(('v %f %f %f %d %d %d\n' * rows.shape[0]) % tuple(rows.ravel().tolist()))
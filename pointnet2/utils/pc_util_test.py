@@ -0,0 +1,136 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pc_util
+
+class PlyTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    rng = np.random.RandomState(0)
+    self.points = rng.randn(50, 3).astype(np.float32)
+    self.colors = rng.randint(0, 256, (50, 3)).astype(np.uint8)
+    self.normals = rng.randn(50, 3).astype(np.float32)
+    self.labels = rng.randint(0, 8, 50)
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def test_round_trip(self):
+    for text in (False, True):
+      filename = os.path.join(self.tmp_dir.name, 'points_%d.ply'%(text))
+      pc_util.write_ply(self.points, filename, text=text, colors=self.colors, normals=self.normals,
+                        labels=self.labels)
+      points, colors, normals, labels = pc_util.read_ply(filename, return_colors=True, return_normals=True,
+                                                         return_labels=True)
+      np.testing.assert_allclose(points, self.points, rtol=1e-6)
+      np.testing.assert_array_equal(colors, self.colors)
+      self.assertEqual(colors.dtype, np.uint8)
+      np.testing.assert_allclose(normals, self.normals, rtol=1e-6)
+      np.testing.assert_array_equal(labels, self.labels)
+
+  def test_missing_fields(self):
+    filename = os.path.join(self.tmp_dir.name, 'points.ply')
+    pc_util.write_ply(self.points, filename)
+    np.testing.assert_array_equal(pc_util.read_ply(filename), self.points)
+    points, colors, labels = pc_util.read_ply(filename, return_colors=True, return_labels=True)
+    self.assertEqual(points.shape, (50, 3))
+    self.assertIsNone(colors)
+    self.assertIsNone(labels)
+
+def reference_grid_cells(points, gridsize, radius, num_sample, ndim):
+  """ Per-cell loop of the original point_cloud_to_volume_v2 / point_cloud_to_image,
+      with the cell counts. Cells with more than num_sample points are left zero. """
+  cell = 2*radius/float(gridsize)
+  locations = ((points[:,0:ndim] + radius)/cell).astype(int)
+  loc2pc = {}
+  for n in range(points.shape[0]):
+    loc2pc.setdefault(tuple(locations[n]), []).append(points[n])
+  out = np.zeros((gridsize,)*ndim + (num_sample, 3))
+  counts = np.zeros((gridsize,)*ndim, dtype=int)
+  for loc, pcs in loc2pc.items():
+    pc = np.vstack(pcs)
+    counts[loc] = pc.shape[0]
+    if pc.shape[0] > num_sample:
+      continue
+    pc = np.pad(pc, ((0, num_sample-pc.shape[0]), (0, 0)), 'edge')
+    pc_center = (np.array(loc)+0.5)*cell - radius
+    pc[:,0:ndim] = (pc[:,0:ndim] - pc_center)/cell
+    out[loc] = pc
+  return out, counts
+
+class GridCellsTest(unittest.TestCase):
+  def setUp(self):
+    self.points = np.random.RandomState(1).uniform(-1, 1, (2, 300, 3))
+
+  def check(self, fn, batch_fn, gridsize, ndim):
+    num_sample = 4
+    batch = batch_fn(self.points, gridsize, 1.0, num_sample)
+    for b in range(len(self.points)):
+      result = fn(self.points[b], gridsize, 1.0, num_sample)
+      expected, counts = reference_grid_cells(self.points[b], gridsize, 1.0, num_sample, ndim)
+      exact = counts <= num_sample
+      self.assertTrue(exact.any() and (~exact).any())
+      np.testing.assert_allclose(result[exact], expected[exact])
+      np.testing.assert_allclose(batch[b][exact], expected[exact])
+      # subsampled cells hold num_sample distinct points of that cell
+      self.assertTrue(all(len(np.unique(pc, axis=0)) == num_sample for pc in result[~exact]))
+
+  def test_point_cloud_to_volume_v2(self):
+    self.check(pc_util.point_cloud_to_volume_v2, pc_util.point_cloud_to_volume_v2_batch, 4, 3)
+
+  def test_point_cloud_to_image(self):
+    self.check(pc_util.point_cloud_to_image, pc_util.point_cloud_to_image_batch, 8, 2)
+
+  def test_volume_to_point_cloud(self):
+    vol = pc_util.point_cloud_to_volume(self.points[0], 6)
+    expected = [(i, j, k) for i in range(6) for j in range(6) for k in range(6) if vol[i,j,k] == 1]
+    np.testing.assert_array_equal(pc_util.volume_to_point_cloud(vol), expected)
+
+class WritePlyColorTest(unittest.TestCase):
+  def test_obj_and_ply(self):
+    import matplotlib.pyplot as pyplot
+    rng = np.random.RandomState(3)
+    points = rng.randn(40, 3)
+    labels = rng.randint(0, 5, 40)
+    expected_colors = [(np.array(pyplot.cm.jet(l/5.0))[0:3]*255).astype(int) for l in labels]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      obj_file = os.path.join(tmp_dir, 'labels.obj')
+      pc_util.write_ply_color(points, labels, obj_file, num_classes=5)
+      with open(obj_file) as f:
+        rows = [line.split() for line in f]
+      ply_file = os.path.join(tmp_dir, 'labels.ply')
+      pc_util.write_ply_color(points, labels, ply_file, num_classes=5, ply=True)
+      ply_points, colors, ply_labels = pc_util.read_ply(ply_file, return_colors=True, return_labels=True)
+    self.assertTrue(all(row[0] == 'v' for row in rows))
+    np.testing.assert_allclose(np.array([row[1:4] for row in rows], dtype=float), points, atol=1e-6)
+    np.testing.assert_array_equal(np.array([row[4:7] for row in rows], dtype=int), expected_colors)
+    np.testing.assert_allclose(ply_points, points, rtol=1e-6)
+    np.testing.assert_array_equal(colors, expected_colors)
+    np.testing.assert_array_equal(ply_labels, labels)
+
+class DrawPointCloudTest(unittest.TestCase):
+  def test_silhouette(self):
+    rng = np.random.RandomState(2)
+    points = np.concatenate([rng.uniform(-1, 1, (100, 3)),
+                             [[10, 0, 2]]]) # farthest point, off the canvas, so every drawn point has depth > 0
+    image = pc_util.draw_point_cloud(points, canvasSize=100, space=40, diameter=5, normalize=False)
+    expected = np.zeros((100, 100), dtype=bool)
+    a, b = np.mgrid[-2:3, -2:3]
+    disk = a*a + b*b <= 4
+    for x, y in np.round(50 + points[:, 0:2]*40).astype(int):
+      if 0 <= x < 100 and 0 <= y < 100:
+        px, py = x + a[disk], y + b[disk]
+        inside = (px >= 0) & (px < 100) & (py >= 0) & (py < 100)
+        expected[px[inside], py[inside]] = True
+    np.testing.assert_array_equal(image > 0, expected)
+    nearest = np.argmin(points[:, 2])
+    self.assertEqual(image.max(), 1.0)
+    self.assertEqual(image[tuple(np.round(50 + points[nearest, 0:2]*40).astype(int))], 1.0)
+
+  def test_empty(self):
+    self.assertFalse(pc_util.draw_point_cloud(np.zeros((0, 3)), canvasSize=10).any())
+    self.assertEqual(pc_util.point_cloud_three_views(np.random.randn(20, 3)).shape, (500, 1500))
+
+if __name__=='__main__':
+  unittest.main()
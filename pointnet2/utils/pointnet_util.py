@@ -68,11 +68,11 @@ def sample_and_group_all(xyz, points, use_xyz=True):
     Note:
         Equivalent to sample_and_group with npoint=1, radius=inf, use (0,0,0) as the centroid
     '''
-    batch_size = xyz.get_shape()[0].value
-    nsample = xyz.get_shape()[1].value
-    new_xyz = tf.constant(np.tile(np.array([0,0,0]).reshape((1,1,3)), (batch_size,1,1)),dtype=tf.float32) # (batch_size, 1, 3)
-    idx = tf.constant(np.tile(np.array(range(nsample)).reshape((1,1,nsample)), (batch_size,1,1)))
-    grouped_xyz = tf.reshape(xyz, (batch_size, 1, nsample, 3)) # (batch_size, npoint=1, nsample, 3)
+    batch_size = tf.shape(xyz)[0]
+    nsample = tf.shape(xyz)[1]
+    new_xyz = tf.zeros_like(xyz[:,0:1,:]) # (batch_size, 1, 3)
+    idx = tf.tile(tf.reshape(tf.range(nsample), (1,1,-1)), tf.stack([batch_size,1,1]))
+    grouped_xyz = tf.expand_dims(xyz, 1) # (batch_size, npoint=1, nsample, 3)
     if points is not None:
         if use_xyz:
             new_points = tf.concat([xyz, points], axis=2) # (batch_size, 16, 259)
@@ -84,6 +84,51 @@ def sample_and_group_all(xyz, points, use_xyz=True):
     return new_xyz, new_points, idx, grouped_xyz
 
 
+def pool_local_regions(new_points, grouped_xyz, pooling='max'):
+    '''
+    Input:
+        new_points: (batch_size, npoint, nsample, channel) TF tensor
+        grouped_xyz: (batch_size, npoint, nsample, 3) TF tensor, normalized point XYZs
+        pooling: 'max', 'avg', 'weighted_avg' or 'max_and_avg'
+    Output:
+        new_points: (batch_size, npoint, 1, channel) TF tensor, 2*channel for 'max_and_avg'
+    '''
+    if pooling=='max':
+        new_points = tf.reduce_max(new_points, axis=[2], keepdims=True, name='maxpool')
+    elif pooling=='avg':
+        new_points = tf.reduce_mean(new_points, axis=[2], keepdims=True, name='avgpool')
+    elif pooling=='weighted_avg':
+        with tf.name_scope('weighted_avg'):
+            dists = tf.norm(grouped_xyz,axis=-1,ord=2,keepdims=True)
+            exp_dists = tf.exp(-dists * 5)
+            weights = exp_dists/tf.reduce_sum(exp_dists,axis=2,keepdims=True) # (batch_size, npoint, nsample, 1)
+            new_points *= weights # (batch_size, npoint, nsample, mlp[-1])
+            new_points = tf.reduce_sum(new_points, axis=2, keepdims=True)
+    elif pooling=='max_and_avg':
+        max_points = tf.reduce_max(new_points, axis=[2], keepdims=True, name='maxpool')
+        avg_points = tf.reduce_mean(new_points, axis=[2], keepdims=True, name='avgpool')
+        new_points = tf.concat([avg_points, max_points], axis=-1)
+    return new_points
+
+
+def interpolate_points(xyz1, xyz2, points2):
+    '''
+    Input:
+        xyz1: (batch_size, ndataset1, 3) TF tensor
+        xyz2: (batch_size, ndataset2, 3) TF tensor, sparser than xyz1
+        points2: (batch_size, ndataset2, nchannel2) TF tensor
+    Output:
+        interpolated_points: (batch_size, ndataset1, nchannel2) TF tensor, inverse distance
+            weighted average of the three nearest points in xyz2
+    '''
+    dist, idx = three_nn(xyz1, xyz2)
+    dist = tf.maximum(dist, 1e-10)
+    norm = tf.reduce_sum((1.0/dist),axis=2,keepdims=True)
+    norm = tf.tile(norm,[1,1,3])
+    weight = (1.0/dist) / norm
+    return three_interpolate(points2, idx, weight)
+
+
 def pointnet_sa_module(xyz, points, npoint, radius, nsample, mlp, mlp2, group_all, is_training, bn_decay, scope, bn=True, pooling='max', knn=False, use_xyz=True, use_nchw=False):
     ''' PointNet Set Abstraction (SA) Module
         Input:
@@ -104,10 +149,9 @@ def pointnet_sa_module(xyz, points, npoint, radius, nsample, mlp, mlp2, group_al
             idx: (batch_size, npoint, nsample) int32 -- indices for local regions
     '''
     data_format = 'NCHW' if use_nchw else 'NHWC'
-    with tf.variable_scope(scope) as sc:
+    with tf.compat.v1.variable_scope(scope) as sc:
         # Sample and Grouping
         if group_all:
-            nsample = xyz.get_shape()[1].value
             new_xyz, new_points, idx, grouped_xyz = sample_and_group_all(xyz, points, use_xyz)
         else:
             new_xyz, new_points, idx, grouped_xyz = sample_and_group(npoint, radius, nsample, xyz, points, knn, use_xyz)
@@ -123,21 +167,7 @@ def pointnet_sa_module(xyz, points, npoint, radius, nsample, mlp, mlp2, group_al
         if use_nchw: new_points = tf.transpose(new_points, [0,2,3,1])
 
         # Pooling in Local Regions
-        if pooling=='max':
-            new_points = tf.reduce_max(new_points, axis=[2], keep_dims=True, name='maxpool')
-        elif pooling=='avg':
-            new_points = tf.reduce_mean(new_points, axis=[2], keep_dims=True, name='avgpool')
-        elif pooling=='weighted_avg':
-            with tf.variable_scope('weighted_avg'):
-                dists = tf.norm(grouped_xyz,axis=-1,ord=2,keep_dims=True)
-                exp_dists = tf.exp(-dists * 5)
-                weights = exp_dists/tf.reduce_sum(exp_dists,axis=2,keep_dims=True) # (batch_size, npoint, nsample, 1)
-                new_points *= weights # (batch_size, npoint, nsample, mlp[-1])
-                new_points = tf.reduce_sum(new_points, axis=2, keep_dims=True)
-        elif pooling=='max_and_avg':
-            max_points = tf.reduce_max(new_points, axis=[2], keep_dims=True, name='maxpool')
-            avg_points = tf.reduce_mean(new_points, axis=[2], keep_dims=True, name='avgpool')
-            new_points = tf.concat([avg_points, max_points], axis=-1)
+        new_points = pool_local_regions(new_points, grouped_xyz, pooling)
 
         # [Optional] Further Processing 
         if mlp2 is not None:
@@ -169,7 +199,7 @@ def pointnet_sa_module_msg(xyz, points, npoint, radius_list, nsample_list, mlp_l
             new_points: (batch_size, npoint, \sum_k{mlp[k][-1]}) TF tensor
     '''
     data_format = 'NCHW' if use_nchw else 'NHWC'
-    with tf.variable_scope(scope) as sc:
+    with tf.compat.v1.variable_scope(scope) as sc:
         new_xyz = gather_point(xyz, farthest_point_sample(npoint, xyz))
         new_points_list = []
         for i in range(len(radius_list)):
@@ -207,13 +237,8 @@ def pointnet_fp_module(xyz1, xyz2, points1, points2, mlp, is_training, bn_decay,
         Return:
             new_points: (batch_size, ndataset1, mlp[-1]) TF tensor
     '''
-    with tf.variable_scope(scope) as sc:
-        dist, idx = three_nn(xyz1, xyz2)
-        dist = tf.maximum(dist, 1e-10)
-        norm = tf.reduce_sum((1.0/dist),axis=2,keep_dims=True)
-        norm = tf.tile(norm,[1,1,3])
-        weight = (1.0/dist) / norm
-        interpolated_points = three_interpolate(points2, idx, weight)
+    with tf.compat.v1.variable_scope(scope) as sc:
+        interpolated_points = interpolate_points(xyz1, xyz2, points2)
 
         if points1 is not None:
             new_points1 = tf.concat(axis=2, values=[interpolated_points, points1]) # B,ndataset1,nchannel1+nchannel2
@@ -227,3 +252,86 @@ def pointnet_fp_module(xyz1, xyz2, points1, points2, mlp, is_training, bn_decay,
                                          scope='conv_%d'%(i), bn_decay=bn_decay)
         new_points1 = tf.squeeze(new_points1, [2]) # B,ndataset1,mlp[-1]
         return new_points1
+
+
+class PointNetSAModule(tf.keras.layers.Layer):
+    ''' Keras version of pointnet_sa_module, see there for the arguments.
+        Batch norm decay is a float here, use_nchw is not supported.
+        call(xyz, points, training) returns new_xyz, new_points, idx
+    '''
+    def __init__(self, npoint, radius, nsample, mlp, mlp2=None, group_all=False, bn=True, bn_decay=None,
+                 pooling='max', knn=False, use_xyz=True, jit_compile=False, **kwargs):
+        super().__init__(**kwargs)
+        self.npoint = npoint
+        self.radius = radius
+        self.nsample = nsample
+        self.group_all = group_all
+        self.pooling = pooling
+        self.knn = knn
+        self.use_xyz = use_xyz
+        self.mlp = tf_util.SharedMLP(mlp, bn=bn, bn_decay=bn_decay, jit_compile=jit_compile, name='mlp')
+        self.mlp2 = None
+        if mlp2 is not None:
+            self.mlp2 = tf_util.SharedMLP(mlp2, bn=bn, bn_decay=bn_decay, jit_compile=jit_compile, name='mlp2')
+
+    def call(self, xyz, points=None, training=None):
+        if self.group_all:
+            new_xyz, new_points, idx, grouped_xyz = sample_and_group_all(xyz, points, self.use_xyz)
+        else:
+            new_xyz, new_points, idx, grouped_xyz = sample_and_group(self.npoint, self.radius, self.nsample,
+                                                                     xyz, points, self.knn, self.use_xyz)
+        new_points = self.mlp(new_points, training=training)
+        new_points = pool_local_regions(new_points, grouped_xyz, self.pooling)
+        if self.mlp2 is not None:
+            new_points = self.mlp2(new_points, training=training)
+        new_points = tf.squeeze(new_points, [2]) # (batch_size, npoints, mlp2[-1])
+        return new_xyz, new_points, idx
+
+
+class PointNetSAModuleMSG(tf.keras.layers.Layer):
+    ''' Keras version of pointnet_sa_module_msg, see there for the arguments.
+        call(xyz, points, training) returns new_xyz, new_points
+    '''
+    def __init__(self, npoint, radius_list, nsample_list, mlp_list, bn=True, bn_decay=None,
+                 use_xyz=True, jit_compile=False, **kwargs):
+        super().__init__(**kwargs)
+        self.npoint = npoint
+        self.radius_list = radius_list
+        self.nsample_list = nsample_list
+        self.use_xyz = use_xyz
+        self.mlps = [tf_util.SharedMLP(mlp, bn=bn, bn_decay=bn_decay, jit_compile=jit_compile, name='mlp%d'%(i))
+                     for i, mlp in enumerate(mlp_list)]
+
+    def call(self, xyz, points=None, training=None):
+        new_xyz = gather_point(xyz, farthest_point_sample(self.npoint, xyz))
+        new_points_list = []
+        for radius, nsample, mlp in zip(self.radius_list, self.nsample_list, self.mlps):
+            idx, pts_cnt = query_ball_point(radius, nsample, xyz, new_xyz)
+            grouped_xyz = group_point(xyz, idx)
+            grouped_xyz -= tf.tile(tf.expand_dims(new_xyz, 2), [1,1,nsample,1])
+            if points is not None:
+                grouped_points = group_point(points, idx)
+                if self.use_xyz:
+                    grouped_points = tf.concat([grouped_points, grouped_xyz], axis=-1)
+            else:
+                grouped_points = grouped_xyz
+            grouped_points = mlp(grouped_points, training=training)
+            new_points_list.append(tf.reduce_max(grouped_points, axis=[2]))
+        return new_xyz, tf.concat(new_points_list, axis=-1)
+
+
+class PointNetFPModule(tf.keras.layers.Layer):
+    ''' Keras version of pointnet_fp_module, see there for the arguments.
+        call(xyz1, xyz2, points1, points2, training) returns new_points
+    '''
+    def __init__(self, mlp, bn=True, bn_decay=None, jit_compile=False, **kwargs):
+        super().__init__(**kwargs)
+        self.mlp = tf_util.SharedMLP(mlp, bn=bn, bn_decay=bn_decay, jit_compile=jit_compile, name='mlp')
+
+    def call(self, xyz1, xyz2, points1, points2, training=None):
+        interpolated_points = interpolate_points(xyz1, xyz2, points2)
+        if points1 is not None:
+            new_points1 = tf.concat(axis=2, values=[interpolated_points, points1]) # B,ndataset1,nchannel1+nchannel2
+        else:
+            new_points1 = interpolated_points
+        return self.mlp(new_points1, training=training) # B,ndataset1,mlp[-1]
@@ -1,5 +1,7 @@
 import os
 import sys
+import threading
+import queue
 import numpy as np
 import h5py
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -29,159 +31,141 @@ def shuffle_points(batch_data):
     np.random.shuffle(idx)
     return batch_data[:,idx,:]
 
-def rotate_point_cloud(batch_data):
+def _axis_rotation_entries(axis, cos, sin, zeros, ones):
+    """ Row-major entries of the rotation matrices about axis ('x', 'y' or 'z').
+        The entries are built from the given cos, sin, zeros and ones, so the
+        numpy helpers here and the TensorFlow ones in tf_data_util share the layout.
+    """
+    if axis == 'x':
+        return [ones, zeros, zeros, zeros, cos, -sin, zeros, sin, cos]
+    if axis == 'y':
+        return [cos, zeros, sin, zeros, ones, zeros, -sin, zeros, cos]
+    return [cos, -sin, zeros, sin, cos, zeros, zeros, zeros, ones]
+
+def _axis_rotation(axis, angles):
+    """ Bx3x3 rotation matrices about axis """
+    angles = np.asarray(angles, dtype=np.float64)
+    entries = _axis_rotation_entries(axis, np.cos(angles), np.sin(angles),
+                                     np.zeros_like(angles), np.ones_like(angles))
+    return np.stack(entries, axis=-1).reshape(-1, 3, 3)
+
+def _rotation_y(angles):
+    """ Bx3x3 rotation matrices about the up (y) axis, laid out for pc.dot(R) """
+    return _axis_rotation('y', angles)
+
+def _rotation_z(angles):
+    """ Bx3x3 rotation matrices about the z axis, laid out for pc.dot(R) """
+    return _axis_rotation('z', -np.asarray(angles))
+
+def _xyz_rotation(angles):
+    """ Bx3x3 matrices Rz.Ry.Rx from Bx3 angles about each axis """
+    return _axis_rotation('z', angles[:,2]) @ _axis_rotation('y', angles[:,1]) @ _axis_rotation('x', angles[:,0])
+
+def _perturbation_rotation(batch_size, angle_sigma, angle_clip):
+    """ Bx3x3 matrices Rz.Ry.Rx from small random angles about each axis """
+    return _xyz_rotation(np.clip(angle_sigma*np.random.randn(batch_size, 3), -angle_clip, angle_clip))
+
+def _rotate(batch_data, R, out=None, with_normal=False):
+    """ Apply one rotation per shape to XYZ (and normal) channels with a batched matmul.
+        Input:
+          batch_data: BxNxC array
+          R: Bx3x3 array, shape k is rotated as batch_data[k,:,0:3].dot(R[k])
+          out: BxNxC array to write into, a new zero-filled float32 array if None.
+            Channels that are not rotated are left untouched. May be batch_data itself.
+        Return:
+          out
+    """
+    if out is None:
+        out = np.zeros(batch_data.shape, dtype=np.float32)
+    R = R.astype(out.dtype, copy=False)
+    np.matmul(batch_data[:,:,0:3], R, out=out[:,:,0:3])
+    if with_normal:
+        np.matmul(batch_data[:,:,3:6], R, out=out[:,:,3:6])
+    return out
+
+def rotate_point_cloud(batch_data, out=None):
     """ Randomly rotate the point clouds to augument the dataset
         rotation is per shape based along up direction
         Input:
           BxNx3 array, original batch of point clouds
+          out: optional BxNx3 output buffer, may be batch_data for in-place rotation
         Return:
           BxNx3 array, rotated batch of point clouds
     """
-    rotated_data = np.zeros(batch_data.shape, dtype=np.float32)
-    for k in xrange(batch_data.shape[0]):
-        rotation_angle = np.random.uniform() * 2 * np.pi
-        cosval = np.cos(rotation_angle)
-        sinval = np.sin(rotation_angle)
-        rotation_matrix = np.array([[cosval, 0, sinval],
-                                    [0, 1, 0],
-                                    [-sinval, 0, cosval]])
-        shape_pc = batch_data[k, ...]
-        rotated_data[k, ...] = np.dot(shape_pc.reshape((-1, 3)), rotation_matrix)
-    return rotated_data
-
-def rotate_point_cloud_z(batch_data):
+    rotation_angle = np.random.uniform(size=batch_data.shape[0]) * 2 * np.pi
+    return _rotate(batch_data, _rotation_y(rotation_angle), out)
+
+def rotate_point_cloud_z(batch_data, out=None):
     """ Randomly rotate the point clouds to augument the dataset
         rotation is per shape based along up direction
         Input:
           BxNx3 array, original batch of point clouds
+          out: optional BxNx3 output buffer, may be batch_data for in-place rotation
         Return:
           BxNx3 array, rotated batch of point clouds
     """
-    rotated_data = np.zeros(batch_data.shape, dtype=np.float32)
-    for k in xrange(batch_data.shape[0]):
-        rotation_angle = np.random.uniform() * 2 * np.pi
-        cosval = np.cos(rotation_angle)
-        sinval = np.sin(rotation_angle)
-        rotation_matrix = np.array([[cosval, sinval, 0],
-                                    [-sinval, cosval, 0],
-                                    [0, 0, 1]])
-        shape_pc = batch_data[k, ...]
-        rotated_data[k, ...] = np.dot(shape_pc.reshape((-1, 3)), rotation_matrix)
-    return rotated_data
-
-def rotate_point_cloud_with_normal(batch_xyz_normal):
+    rotation_angle = np.random.uniform(size=batch_data.shape[0]) * 2 * np.pi
+    return _rotate(batch_data, _rotation_z(rotation_angle), out)
+
+def rotate_point_cloud_with_normal(batch_xyz_normal, out=None):
     ''' Randomly rotate XYZ, normal point cloud.
         Input:
             batch_xyz_normal: B,N,6, first three channels are XYZ, last 3 all normal
+            out: optional B,N,6 output buffer, the input is rotated in place if None
         Output:
             B,N,6, rotated XYZ, normal point cloud
     '''
-    for k in xrange(batch_xyz_normal.shape[0]):
-        rotation_angle = np.random.uniform() * 2 * np.pi
-        cosval = np.cos(rotation_angle)
-        sinval = np.sin(rotation_angle)
-        rotation_matrix = np.array([[cosval, 0, sinval],
-                                    [0, 1, 0],
-                                    [-sinval, 0, cosval]])
-        shape_pc = batch_xyz_normal[k,:,0:3]
-        shape_normal = batch_xyz_normal[k,:,3:6]
-        batch_xyz_normal[k,:,0:3] = np.dot(shape_pc.reshape((-1, 3)), rotation_matrix)
-        batch_xyz_normal[k,:,3:6] = np.dot(shape_normal.reshape((-1, 3)), rotation_matrix)
-    return batch_xyz_normal
-
-def rotate_perturbation_point_cloud_with_normal(batch_data, angle_sigma=0.06, angle_clip=0.18):
+    rotation_angle = np.random.uniform(size=batch_xyz_normal.shape[0]) * 2 * np.pi
+    out = batch_xyz_normal if out is None else out
+    return _rotate(batch_xyz_normal, _rotation_y(rotation_angle), out, with_normal=True)
+
+def rotate_perturbation_point_cloud_with_normal(batch_data, angle_sigma=0.06, angle_clip=0.18, out=None):
     """ Randomly perturb the point clouds by small rotations
         Input:
           BxNx6 array, original batch of point clouds and point normals
+          out: optional BxNx6 output buffer, may be batch_data for in-place rotation
         Return:
           BxNx3 array, rotated batch of point clouds
     """
-    rotated_data = np.zeros(batch_data.shape, dtype=np.float32)
-    for k in xrange(batch_data.shape[0]):
-        angles = np.clip(angle_sigma*np.random.randn(3), -angle_clip, angle_clip)
-        Rx = np.array([[1,0,0],
-                       [0,np.cos(angles[0]),-np.sin(angles[0])],
-                       [0,np.sin(angles[0]),np.cos(angles[0])]])
-        Ry = np.array([[np.cos(angles[1]),0,np.sin(angles[1])],
-                       [0,1,0],
-                       [-np.sin(angles[1]),0,np.cos(angles[1])]])
-        Rz = np.array([[np.cos(angles[2]),-np.sin(angles[2]),0],
-                       [np.sin(angles[2]),np.cos(angles[2]),0],
-                       [0,0,1]])
-        R = np.dot(Rz, np.dot(Ry,Rx))
-        shape_pc = batch_data[k,:,0:3]
-        shape_normal = batch_data[k,:,3:6]
-        rotated_data[k,:,0:3] = np.dot(shape_pc.reshape((-1, 3)), R)
-        rotated_data[k,:,3:6] = np.dot(shape_normal.reshape((-1, 3)), R)
-    return rotated_data
-
-
-def rotate_point_cloud_by_angle(batch_data, rotation_angle):
+    R = _perturbation_rotation(batch_data.shape[0], angle_sigma, angle_clip)
+    return _rotate(batch_data, R, out, with_normal=True)
+
+
+def rotate_point_cloud_by_angle(batch_data, rotation_angle, out=None):
     """ Rotate the point cloud along up direction with certain angle.
         Input:
           BxNx3 array, original batch of point clouds
+          out: optional BxNx3 output buffer, may be batch_data for in-place rotation
         Return:
           BxNx3 array, rotated batch of point clouds
     """
-    rotated_data = np.zeros(batch_data.shape, dtype=np.float32)
-    for k in xrange(batch_data.shape[0]):
-        #rotation_angle = np.random.uniform() * 2 * np.pi
-        cosval = np.cos(rotation_angle)
-        sinval = np.sin(rotation_angle)
-        rotation_matrix = np.array([[cosval, 0, sinval],
-                                    [0, 1, 0],
-                                    [-sinval, 0, cosval]])
-        shape_pc = batch_data[k,:,0:3]
-        rotated_data[k,:,0:3] = np.dot(shape_pc.reshape((-1, 3)), rotation_matrix)
-    return rotated_data
-
-def rotate_point_cloud_by_angle_with_normal(batch_data, rotation_angle):
+    rotation_angle = np.full(batch_data.shape[0], rotation_angle)
+    return _rotate(batch_data, _rotation_y(rotation_angle), out)
+
+def rotate_point_cloud_by_angle_with_normal(batch_data, rotation_angle, out=None):
     """ Rotate the point cloud along up direction with certain angle.
         Input:
           BxNx6 array, original batch of point clouds with normal
           scalar, angle of rotation
+          out: optional BxNx6 output buffer, may be batch_data for in-place rotation
         Return:
           BxNx6 array, rotated batch of point clouds iwth normal
     """
-    rotated_data = np.zeros(batch_data.shape, dtype=np.float32)
-    for k in xrange(batch_data.shape[0]):
-        #rotation_angle = np.random.uniform() * 2 * np.pi
-        cosval = np.cos(rotation_angle)
-        sinval = np.sin(rotation_angle)
-        rotation_matrix = np.array([[cosval, 0, sinval],
-                                    [0, 1, 0],
-                                    [-sinval, 0, cosval]])
-        shape_pc = batch_data[k,:,0:3]
-        shape_normal = batch_data[k,:,3:6]
-        rotated_data[k,:,0:3] = np.dot(shape_pc.reshape((-1, 3)), rotation_matrix)
-        rotated_data[k,:,3:6] = np.dot(shape_normal.reshape((-1,3)), rotation_matrix)
-    return rotated_data
-
-
-
-def rotate_perturbation_point_cloud(batch_data, angle_sigma=0.06, angle_clip=0.18):
+    rotation_angle = np.full(batch_data.shape[0], rotation_angle)
+    return _rotate(batch_data, _rotation_y(rotation_angle), out, with_normal=True)
+
+
+
+def rotate_perturbation_point_cloud(batch_data, angle_sigma=0.06, angle_clip=0.18, out=None):
     """ Randomly perturb the point clouds by small rotations
         Input:
           BxNx3 array, original batch of point clouds
+          out: optional BxNx3 output buffer, may be batch_data for in-place rotation
         Return:
           BxNx3 array, rotated batch of point clouds
     """
-    rotated_data = np.zeros(batch_data.shape, dtype=np.float32)
-    for k in xrange(batch_data.shape[0]):
-        angles = np.clip(angle_sigma*np.random.randn(3), -angle_clip, angle_clip)
-        Rx = np.array([[1,0,0],
-                       [0,np.cos(angles[0]),-np.sin(angles[0])],
-                       [0,np.sin(angles[0]),np.cos(angles[0])]])
-        Ry = np.array([[np.cos(angles[1]),0,np.sin(angles[1])],
-                       [0,1,0],
-                       [-np.sin(angles[1]),0,np.cos(angles[1])]])
-        Rz = np.array([[np.cos(angles[2]),-np.sin(angles[2]),0],
-                       [np.sin(angles[2]),np.cos(angles[2]),0],
-                       [0,0,1]])
-        R = np.dot(Rz, np.dot(Ry,Rx))
-        shape_pc = batch_data[k, ...]
-        rotated_data[k, ...] = np.dot(shape_pc.reshape((-1, 3)), R)
-    return rotated_data
+    R = _perturbation_rotation(batch_data.shape[0], angle_sigma, angle_clip)
+    return _rotate(batch_data, R, out)
 
 
 def jitter_point_cloud(batch_data, sigma=0.01, clip=0.05):
@@ -206,8 +190,7 @@ def shift_point_cloud(batch_data, shift_range=0.1):
     """
     B, N, C = batch_data.shape
     shifts = np.random.uniform(-shift_range, shift_range, (B,3))
-    for batch_index in range(B):
-        batch_data[batch_index,:,:] += shifts[batch_index,:]
+    batch_data += shifts[:,None,:]
     return batch_data
 
 
@@ -220,17 +203,15 @@ def random_scale_point_cloud(batch_data, scale_low=0.8, scale_high=1.25):
     """
     B, N, C = batch_data.shape
     scales = np.random.uniform(scale_low, scale_high, B)
-    for batch_index in range(B):
-        batch_data[batch_index,:,:] *= scales[batch_index]
+    batch_data *= scales[:,None,None]
     return batch_data
 
 def random_point_dropout(batch_pc, max_dropout_ratio=0.875):
     ''' batch_pc: BxNx3 '''
-    for b in range(batch_pc.shape[0]):
-        dropout_ratio =  np.random.random()*max_dropout_ratio # 0~0.875
-        drop_idx = np.where(np.random.random((batch_pc.shape[1]))<=dropout_ratio)[0]
-        if len(drop_idx)>0:
-            batch_pc[b,drop_idx,:] = batch_pc[b,0,:] # set to the first point
+    B, N = batch_pc.shape[0:2]
+    dropout_ratio = np.random.random(B)*max_dropout_ratio # 0~0.875
+    drop_b, drop_n = np.nonzero(np.random.random((B, N)) <= dropout_ratio[:,None])
+    batch_pc[drop_b,drop_n,:] = batch_pc[drop_b,0,:] # set to the first point
     return batch_pc
 
 
@@ -238,10 +219,124 @@ def getDataFiles(list_filename):
     return [line.rstrip() for line in open(list_filename)]
 
 def load_h5(h5_filename):
-    f = h5py.File(h5_filename)
-    data = f['data'][:]
-    label = f['label'][:]
+    with h5py.File(h5_filename, 'r') as f:
+        data = f['data'][:]
+        label = f['label'][:]
     return (data, label)
 
 def loadDataFile(filename):
     return load_h5(filename)
+
+
+class H5Dataset(object):
+    """ Lazy reader for datasets stored as HDF5 files with one sample per row.
+
+    Instead of loading whole files like load_h5, rows are read in chunks of
+    chunk_size consecutive samples. A background thread reads the next
+    chunks while the current one is consumed, and at most prefetch chunks
+    are held in the queue, so memory stays bounded no matter how many files
+    there are.
+
+    Chunks from all files are numbered in one global list. With num_shards > 1,
+    shard i reads every num_shards-th chunk, so parallel workers see disjoint
+    data. With shuffle=True the chunk order and the rows inside each chunk
+    are reshuffled every epoch, from seed + epoch.
+
+    Args:
+        filenames: list of HDF5 paths, e.g. from getDataFiles
+        keys: datasets read for every sample, e.g. ('data', 'label', 'smpw')
+        chunk_size: rows read per HDF5 access
+        shuffle: bool, shuffle chunk order and rows within a chunk
+        num_shards, shard_index: split the chunks across workers
+        prefetch: chunks read ahead by the background thread
+        seed: base seed for the shuffling
+    """
+    def __init__(self, filenames, keys=('data', 'label'), chunk_size=256, shuffle=True,
+                 num_shards=1, shard_index=0, prefetch=2, seed=0):
+        assert 0 <= shard_index < num_shards
+        self.filenames = list(filenames)
+        self.keys = tuple(keys)
+        self.shuffle = shuffle
+        self.prefetch = prefetch
+        self.seed = seed
+        self._chunks = []
+        for file_index, filename in enumerate(self.filenames):
+            with h5py.File(filename, 'r') as f:
+                num_rows = len(f[self.keys[0]])
+            for start in range(0, num_rows, chunk_size):
+                self._chunks.append((file_index, start, min(start+chunk_size, num_rows)))
+        self._chunks = self._chunks[shard_index::num_shards]
+
+    def __len__(self):
+        """ Number of samples in this shard """
+        return sum(stop-start for _, start, stop in self._chunks)
+
+    @staticmethod
+    def _put(out_queue, item, stop):
+        """ Put item in the queue unless the consumer stopped. Returns False if it did """
+        while not stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read_chunks(self, order, rng, out_queue, stop):
+        files = {}
+        try:
+            for i in order:
+                file_index, start, stop_row = self._chunks[i]
+                if file_index not in files:
+                    files[file_index] = h5py.File(self.filenames[file_index], 'r')
+                f = files[file_index]
+                arrays = tuple(f[key][start:stop_row] for key in self.keys)
+                if self.shuffle:
+                    perm = rng.permutation(stop_row-start)
+                    arrays = tuple(a[perm] for a in arrays)
+                if not self._put(out_queue, arrays, stop):
+                    return
+            self._put(out_queue, None, stop)
+        except Exception as e:
+            self._put(out_queue, e, stop)
+        finally:
+            for f in files.values():
+                f.close()
+
+    def iter_chunks(self, epoch=0):
+        """ Yield one tuple of arrays (one per key) per chunk, read in a background thread """
+        rng = np.random.RandomState(self.seed + epoch)
+        order = rng.permutation(len(self._chunks)) if self.shuffle else np.arange(len(self._chunks))
+        out_queue = queue.Queue(maxsize=max(1, self.prefetch))
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read_chunks, args=(order, rng, out_queue, stop), daemon=True)
+        reader.start()
+        try:
+            while True:
+                item = out_queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            reader.join()
+
+    def iter_batches(self, batch_size, epoch=0, drop_remainder=False):
+        """ Yield batches of batch_size samples, as one tuple of arrays per batch """
+        pending = []
+        num_pending = 0
+        for arrays in self.iter_chunks(epoch):
+            pending.append(arrays)
+            num_pending += len(arrays[0])
+            if num_pending < batch_size:
+                continue
+            merged = tuple(np.concatenate(a) for a in zip(*pending))
+            num_full = num_pending // batch_size * batch_size
+            for start in range(0, num_full, batch_size):
+                yield tuple(a[start:start+batch_size] for a in merged)
+            pending = [tuple(a[num_full:] for a in merged)]
+            num_pending -= num_full
+        if num_pending > 0 and not drop_remainder:
+            yield tuple(np.concatenate(a) for a in zip(*pending))
@@ -0,0 +1,141 @@
+import os
+import tempfile
+import threading
+import unittest
+import numpy as np
+import h5py
+import provider
+
+class H5DatasetTest(unittest.TestCase):
+  def setUp(self):
+    self.tmp_dir = tempfile.TemporaryDirectory()
+    self.filename = os.path.join(self.tmp_dir.name, 'data.h5')
+    with h5py.File(self.filename, 'w') as f:
+      f['data'] = np.arange(20*3, dtype='float32').reshape(20, 3)
+      f['label'] = np.arange(20, dtype='int32')
+
+  def tearDown(self):
+    self.tmp_dir.cleanup()
+
+  def test_iter_batches(self):
+    dataset = provider.H5Dataset([self.filename], chunk_size=6, shuffle=True)
+    labels = np.concatenate([label for _, label in dataset.iter_batches(4)])
+    self.assertEqual(sorted(labels), list(range(20)))
+
+  def test_early_stop(self):
+    # the reader has queued its last chunk and waits to put the end marker
+    blocked = threading.Event()
+    class Dataset(provider.H5Dataset):
+      @staticmethod
+      def _put(out_queue, item, stop):
+        if item is None:
+          blocked.set()
+        return provider.H5Dataset._put(out_queue, item, stop)
+    dataset = Dataset([self.filename], chunk_size=10, shuffle=False, prefetch=1)
+    it = dataset.iter_chunks()
+    next(it)
+    # the second chunk fills the queue, so the end marker cannot be put
+    self.assertTrue(blocked.wait(timeout=5))
+    closer = threading.Thread(target=it.close, daemon=True)
+    closer.start()
+    closer.join(timeout=5)
+    self.assertFalse(closer.is_alive())
+
+def rotation_y(angle):
+  c, s = np.cos(angle), np.sin(angle)
+  return np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])
+
+def rotation_z(angle):
+  c, s = np.cos(angle), np.sin(angle)
+  return np.array([[c, s, 0], [-s, c, 0], [0, 0, 1]])
+
+def perturbation_rotation(angle_sigma, angle_clip):
+  a = np.clip(angle_sigma*np.random.randn(3), -angle_clip, angle_clip)
+  Rx = np.array([[1, 0, 0], [0, np.cos(a[0]), -np.sin(a[0])], [0, np.sin(a[0]), np.cos(a[0])]])
+  Ry = np.array([[np.cos(a[1]), 0, np.sin(a[1])], [0, 1, 0], [-np.sin(a[1]), 0, np.cos(a[1])]])
+  Rz = np.array([[np.cos(a[2]), -np.sin(a[2]), 0], [np.sin(a[2]), np.cos(a[2]), 0], [0, 0, 1]])
+  return np.dot(Rz, np.dot(Ry, Rx))
+
+def reference_rotate(batch_data, make_rotation, with_normal=False):
+  """ Per-shape loop of the original augmentations, one rotation drawn per shape """
+  out = np.array(batch_data, dtype=np.float64)
+  for k in range(len(batch_data)):
+    R = make_rotation()
+    out[k,:,0:3] = np.dot(batch_data[k,:,0:3], R)
+    if with_normal:
+      out[k,:,3:6] = np.dot(batch_data[k,:,3:6], R)
+  return out
+
+class AugmentationTest(unittest.TestCase):
+  def setUp(self):
+    rng = np.random.RandomState(0)
+    self.xyz = rng.randn(4, 64, 3).astype(np.float32)
+    self.xyz_normal = rng.randn(4, 64, 6).astype(np.float32)
+
+  def check(self, fn, reference, data, **kwargs):
+    """ fn on a new buffer, on an out= buffer and in place, each against the reference loop """
+    np.random.seed(1)
+    expected = reference(data)
+    for out in ('new', 'buffer', 'inplace'):
+      batch = data.copy()
+      np.random.seed(1)
+      if out == 'new':
+        result = fn(batch, **kwargs)
+      else:
+        buf = np.zeros_like(batch) if out == 'buffer' else batch
+        result = fn(batch, out=buf, **kwargs)
+        self.assertIs(result, buf)
+      np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-5, err_msg=out)
+
+  def test_rotate_point_cloud(self):
+    self.check(provider.rotate_point_cloud,
+               lambda d: reference_rotate(d, lambda: rotation_y(np.random.uniform()*2*np.pi)), self.xyz)
+
+  def test_rotate_point_cloud_z(self):
+    self.check(provider.rotate_point_cloud_z,
+               lambda d: reference_rotate(d, lambda: rotation_z(np.random.uniform()*2*np.pi)), self.xyz)
+
+  def test_rotate_point_cloud_by_angle(self):
+    self.check(provider.rotate_point_cloud_by_angle,
+               lambda d: reference_rotate(d, lambda: rotation_y(0.7)), self.xyz, rotation_angle=0.7)
+    self.check(provider.rotate_point_cloud_by_angle_with_normal,
+               lambda d: reference_rotate(d, lambda: rotation_y(0.7), True), self.xyz_normal,
+               rotation_angle=0.7)
+
+  def test_rotate_point_cloud_with_normal(self):
+    self.check(provider.rotate_point_cloud_with_normal,
+               lambda d: reference_rotate(d, lambda: rotation_y(np.random.uniform()*2*np.pi), True),
+               self.xyz_normal)
+
+  def test_rotate_perturbation(self):
+    self.check(provider.rotate_perturbation_point_cloud,
+               lambda d: reference_rotate(d, lambda: perturbation_rotation(0.06, 0.18)), self.xyz)
+    self.check(provider.rotate_perturbation_point_cloud_with_normal,
+               lambda d: reference_rotate(d, lambda: perturbation_rotation(0.06, 0.18), True),
+               self.xyz_normal)
+
+  def test_shift_and_scale(self):
+    np.random.seed(2)
+    shifts = [np.random.uniform(-0.1, 0.1, 3) for _ in range(4)]
+    scales = [np.random.uniform(0.8, 1.25) for _ in range(4)]
+    batch = self.xyz.copy()
+    np.random.seed(2)
+    self.assertIs(provider.shift_point_cloud(batch), batch)
+    self.assertIs(provider.random_scale_point_cloud(batch), batch)
+    for k in range(4):
+      np.testing.assert_allclose(batch[k], (self.xyz[k] + shifts[k])*scales[k], rtol=1e-5, atol=1e-6)
+
+  def test_random_point_dropout(self):
+    np.random.seed(3)
+    ratios = np.random.random(4)*0.875
+    masks = [np.random.random(64) <= ratios[k] for k in range(4)]
+    batch = self.xyz.copy()
+    np.random.seed(3)
+    self.assertIs(provider.random_point_dropout(batch), batch)
+    for k in range(4):
+      expected = self.xyz[k].copy()
+      expected[masks[k]] = self.xyz[k, 0]
+      np.testing.assert_array_equal(batch[k], expected)
+
+if __name__=='__main__':
+  unittest.main()
@@ -0,0 +1,128 @@
+""" tf.data input pipeline for the segmentation models.
+
+Reads HDF5 shards through provider.H5Dataset and emits (points, labels, smpw)
+batches matching pointnet2_sem_seg.placeholder_inputs. The augmentations are
+batched TensorFlow versions of the provider ones, so they run in the tf.data
+thread pool instead of holding the GIL.
+"""
+
+import os
+import sys
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+import numpy as np
+import tensorflow as tf
+import provider
+
+
+def _axis_rotation(axis, angles):
+    """ Bx3x3 rotation matrices about axis, same layout as provider._axis_rotation """
+    entries = provider._axis_rotation_entries(axis, tf.cos(angles), tf.sin(angles),
+                                              tf.zeros_like(angles), tf.ones_like(angles))
+    return tf.reshape(tf.stack(entries, axis=-1), [-1, 3, 3])
+
+
+def _rotation_y(angles):
+    """ Bx3x3 rotation matrices about the up (y) axis, as provider._rotation_y """
+    return _axis_rotation('y', angles)
+
+
+def _rotation_z(angles):
+    """ Bx3x3 rotation matrices about the z axis, as provider._rotation_z """
+    return _axis_rotation('z', -angles)
+
+
+def _xyz_rotation(angles):
+    """ Bx3x3 matrices Rz.Ry.Rx from Bx3 angles, as provider._xyz_rotation """
+    return tf.matmul(_axis_rotation('z', angles[:,2]),
+                     tf.matmul(_axis_rotation('y', angles[:,1]), _axis_rotation('x', angles[:,0])))
+
+
+def _perturbation_rotation(batch_size, angle_sigma, angle_clip):
+    """ Bx3x3 matrices Rz.Ry.Rx from small random angles, as provider._perturbation_rotation """
+    return _xyz_rotation(tf.clip_by_value(angle_sigma*tf.random.normal([batch_size, 3]), -angle_clip, angle_clip))
+
+
+def augment_batch(points, rotation='y', perturb=True, jitter_sigma=0.01, jitter_clip=0.05,
+                  scale_range=None, shift_range=None):
+    """ Batched augmentation of BxNx3 point clouds.
+        Input:
+          points: BxNx3 float32 tensor
+          rotation: 'y', 'z' or None, random rotation about that axis (rotate_point_cloud / _z)
+          perturb: bool, small random rotation about all axes (rotate_perturbation_point_cloud)
+          jitter_sigma, jitter_clip: per point noise (jitter_point_cloud), no jitter if sigma is 0
+          scale_range: (low, high) per shape scale (random_scale_point_cloud) or None
+          shift_range: float, per shape shift (shift_point_cloud) or None
+        Return:
+          BxNx3 float32 tensor
+    """
+    batch_size = tf.shape(points)[0]
+    R = tf.eye(3, batch_shape=[batch_size])
+    if rotation is not None:
+        angles = tf.random.uniform([batch_size]) * 2 * np.pi
+        R = _rotation_y(angles) if rotation == 'y' else _rotation_z(angles)
+    if perturb:
+        R = tf.matmul(R, _perturbation_rotation(batch_size, 0.06, 0.18))
+    points = tf.matmul(points, R)
+    if jitter_sigma:
+        points += tf.clip_by_value(jitter_sigma*tf.random.normal(tf.shape(points)), -jitter_clip, jitter_clip)
+    if scale_range is not None:
+        points *= tf.random.uniform([batch_size, 1, 1], scale_range[0], scale_range[1])
+    if shift_range is not None:
+        points += tf.random.uniform([batch_size, 1, 3], -shift_range, shift_range)
+    return points
+
+
+def h5_dataset(filenames, batch_size, num_point=None, augment=True, shuffle=True, cache=False,
+               weights_key='smpw', chunk_size=256, num_shards=1, shard_index=0, seed=0,
+               drop_remainder=True, num_parallel_calls=tf.data.AUTOTUNE, **augment_args):
+    """ Build a tf.data pipeline over HDF5 shards holding 'data' (BxNx3), 'label' (BxN)
+        and optionally per-point weights (BxN).
+
+        Input:
+          filenames: list of HDF5 paths
+          batch_size: int
+          num_point: int or None, randomly subsample each sample to num_point points
+          augment: bool, apply augment_batch (augment_args are passed to it)
+          shuffle: bool, reshuffle chunks and rows every epoch
+          cache: False, True (in memory) or a filename, cache the decoded samples
+            after the first epoch; the HDF5 files are then not read again
+          weights_key: name of the weight dataset, or None to use weights of 1
+          chunk_size, num_shards, shard_index, seed: passed to provider.H5Dataset
+        Return:
+          tf.data.Dataset of (points BxNx3 float32, labels BxN int32, smpw BxN float32)
+    """
+    keys = ('data', 'label') if weights_key is None else ('data', 'label', weights_key)
+    reader = provider.H5Dataset(filenames, keys=keys, chunk_size=chunk_size, shuffle=shuffle,
+                                num_shards=num_shards, shard_index=shard_index, seed=seed)
+    epoch = [0]
+
+    def chunks():
+        for arrays in reader.iter_chunks(epoch[0]):
+            points, labels = arrays[0][:,:,0:3].astype(np.float32), arrays[1].astype(np.int32)
+            smpw = arrays[2].astype(np.float32) if weights_key is not None else np.ones(labels.shape, np.float32)
+            yield points, labels, smpw
+        epoch[0] += 1
+
+    dataset = tf.data.Dataset.from_generator(chunks, output_signature=(
+        tf.TensorSpec([None, None, 3], tf.float32),
+        tf.TensorSpec([None, None], tf.int32),
+        tf.TensorSpec([None, None], tf.float32)))
+    dataset = dataset.unbatch()
+    if cache:
+        dataset = dataset.cache('' if cache is True else cache)
+        if shuffle:
+            # once cached the reader no longer shuffles, so shuffle the samples here
+            dataset = dataset.shuffle(max(chunk_size, 4*batch_size), seed=seed)
+
+    if num_point is not None:
+        def subsample(points, labels, smpw):
+            idx = tf.random.shuffle(tf.range(tf.shape(points)[0]))[:num_point]
+            return tf.gather(points, idx), tf.gather(labels, idx), tf.gather(smpw, idx)
+        dataset = dataset.map(subsample, num_parallel_calls=num_parallel_calls)
+
+    dataset = dataset.batch(batch_size, drop_remainder=drop_remainder)
+    if augment:
+        dataset = dataset.map(lambda points, labels, smpw: (augment_batch(points, **augment_args), labels, smpw),
+                              num_parallel_calls=num_parallel_calls)
+    return dataset.prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+import numpy as np
+import h5py
+import tensorflow as tf
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '../models'))
+import provider
+import tf_data_util
+import pointnet2_sem_seg
+
+class TfDataUtilTest(tf.test.TestCase):
+  def test_rotations_match_provider(self):
+    angles = np.random.uniform(-np.pi, np.pi, (5, 3))
+    for name in ('_rotation_y', '_rotation_z'):
+      self.assertAllClose(getattr(tf_data_util, name)(tf.constant(angles[:,0])),
+                          getattr(provider, name)(angles[:,0]))
+    self.assertAllClose(tf_data_util._xyz_rotation(tf.constant(angles)), provider._xyz_rotation(angles))
+
+  def test_pipeline_matches_placeholders(self):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      filename = os.path.join(tmp_dir, 'data.h5')
+      with h5py.File(filename, 'w') as f:
+        f['data'] = np.random.random((10, 64, 6)).astype('float32')
+        f['label'] = np.random.randint(0, 4, (10, 64)).astype('uint8')
+        f['smpw'] = np.random.random((10, 64))
+      dataset = tf_data_util.h5_dataset([filename], batch_size=4, num_point=32, scale_range=(0.8, 1.25),
+                                        shift_range=0.1)
+      batches = list(dataset)
+    with tf.Graph().as_default():
+      placeholders = pointnet2_sem_seg.placeholder_inputs(4, 32)
+    self.assertEqual(len(batches), 2)
+    for batch in batches:
+      for tensor, placeholder in zip(batch, placeholders):
+        self.assertEqual(tensor.dtype, placeholder.dtype)
+        self.assertEqual(tensor.shape.as_list(), placeholder.shape.as_list())
+
+if __name__=='__main__':
+  tf.test.main()
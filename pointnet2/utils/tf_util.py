@@ -18,7 +18,7 @@ def _variable_on_cpu(name, shape, initializer, use_fp16=False):
   """
   with tf.device("/cpu:0"):
     dtype = tf.float16 if use_fp16 else tf.float32
-    var = tf.get_variable(name, shape, initializer=initializer, dtype=dtype)
+    var = tf.compat.v1.get_variable(name, shape, initializer=initializer, dtype=dtype)
   return var
 
 def _variable_with_weight_decay(name, shape, stddev, wd, use_xavier=True):
@@ -39,13 +39,13 @@ def _variable_with_weight_decay(name, shape, stddev, wd, use_xavier=True):
     Variable Tensor
   """
   if use_xavier:
-    initializer = tf.contrib.layers.xavier_initializer()
+    initializer = tf.compat.v1.glorot_uniform_initializer()
   else:
-    initializer = tf.truncated_normal_initializer(stddev=stddev)
+    initializer = tf.compat.v1.truncated_normal_initializer(stddev=stddev)
   var = _variable_on_cpu(name, shape, initializer)
   if wd is not None:
     weight_decay = tf.multiply(tf.nn.l2_loss(var), wd, name='weight_loss')
-    tf.add_to_collection('losses', weight_decay)
+    tf.compat.v1.add_to_collection('losses', weight_decay)
   return var
 
 
@@ -84,12 +84,12 @@ def conv1d(inputs,
   Returns:
     Variable tensor
   """
-  with tf.variable_scope(scope) as sc:
+  with tf.compat.v1.variable_scope(scope) as sc:
     assert(data_format=='NHWC' or data_format=='NCHW')
     if data_format == 'NHWC':
-      num_in_channels = inputs.get_shape()[-1].value
+      num_in_channels = tf.compat.dimension_value(inputs.get_shape()[-1])
     elif data_format=='NCHW':
-      num_in_channels = inputs.get_shape()[1].value
+      num_in_channels = tf.compat.dimension_value(inputs.get_shape()[1])
     kernel_shape = [kernel_size,
                     num_in_channels, num_output_channels]
     kernel = _variable_with_weight_decay('weights',
@@ -102,7 +102,7 @@ def conv1d(inputs,
                            padding=padding,
                            data_format=data_format)
     biases = _variable_on_cpu('biases', [num_output_channels],
-                              tf.constant_initializer(0.0))
+                              tf.compat.v1.constant_initializer(0.0))
     outputs = tf.nn.bias_add(outputs, biases, data_format=data_format)
 
     if bn:
@@ -152,13 +152,13 @@ def conv2d(inputs,
   Returns:
     Variable tensor
   """
-  with tf.variable_scope(scope) as sc:
+  with tf.compat.v1.variable_scope(scope) as sc:
       kernel_h, kernel_w = kernel_size
       assert(data_format=='NHWC' or data_format=='NCHW')
       if data_format == 'NHWC':
-        num_in_channels = inputs.get_shape()[-1].value
+        num_in_channels = tf.compat.dimension_value(inputs.get_shape()[-1])
       elif data_format=='NCHW':
-        num_in_channels = inputs.get_shape()[1].value
+        num_in_channels = tf.compat.dimension_value(inputs.get_shape()[1])
       kernel_shape = [kernel_h, kernel_w,
                       num_in_channels, num_output_channels]
       kernel = _variable_with_weight_decay('weights',
@@ -172,7 +172,7 @@ def conv2d(inputs,
                              padding=padding,
                              data_format=data_format)
       biases = _variable_on_cpu('biases', [num_output_channels],
-                                tf.constant_initializer(0.0))
+                                tf.compat.v1.constant_initializer(0.0))
       outputs = tf.nn.bias_add(outputs, biases, data_format=data_format)
 
       if bn:
@@ -220,9 +220,9 @@ def conv2d_transpose(inputs,
 
   Note: conv2d(conv2d_transpose(a, num_out, ksize, stride), a.shape[-1], ksize, stride) == a
   """
-  with tf.variable_scope(scope) as sc:
+  with tf.compat.v1.variable_scope(scope) as sc:
       kernel_h, kernel_w = kernel_size
-      num_in_channels = inputs.get_shape()[-1].value
+      num_in_channels = tf.compat.dimension_value(inputs.get_shape()[-1])
       kernel_shape = [kernel_h, kernel_w,
                       num_output_channels, num_in_channels] # reversed to conv2d
       kernel = _variable_with_weight_decay('weights',
@@ -241,9 +241,9 @@ def conv2d_transpose(inputs,
           return dim_size
 
       # caculate output shape
-      batch_size = inputs.get_shape()[0].value
-      height = inputs.get_shape()[1].value
-      width = inputs.get_shape()[2].value
+      batch_size = tf.compat.dimension_value(inputs.get_shape()[0])
+      height = tf.compat.dimension_value(inputs.get_shape()[1])
+      width = tf.compat.dimension_value(inputs.get_shape()[2])
       out_height = get_deconv_dim(height, stride_h, kernel_h, padding)
       out_width = get_deconv_dim(width, stride_w, kernel_w, padding)
       output_shape = [batch_size, out_height, out_width, num_output_channels]
@@ -252,7 +252,7 @@ def conv2d_transpose(inputs,
                              [1, stride_h, stride_w, 1],
                              padding=padding)
       biases = _variable_on_cpu('biases', [num_output_channels],
-                                tf.constant_initializer(0.0))
+                                tf.compat.v1.constant_initializer(0.0))
       outputs = tf.nn.bias_add(outputs, biases)
 
       if bn:
@@ -298,9 +298,9 @@ def conv3d(inputs,
   Returns:
     Variable tensor
   """
-  with tf.variable_scope(scope) as sc:
+  with tf.compat.v1.variable_scope(scope) as sc:
     kernel_d, kernel_h, kernel_w = kernel_size
-    num_in_channels = inputs.get_shape()[-1].value
+    num_in_channels = tf.compat.dimension_value(inputs.get_shape()[-1])
     kernel_shape = [kernel_d, kernel_h, kernel_w,
                     num_in_channels, num_output_channels]
     kernel = _variable_with_weight_decay('weights',
@@ -313,7 +313,7 @@ def conv3d(inputs,
                            [1, stride_d, stride_h, stride_w, 1],
                            padding=padding)
     biases = _variable_on_cpu('biases', [num_output_channels],
-                              tf.constant_initializer(0.0))
+                              tf.compat.v1.constant_initializer(0.0))
     outputs = tf.nn.bias_add(outputs, biases)
     
     if bn:
@@ -343,8 +343,8 @@ def fully_connected(inputs,
   Returns:
     Variable tensor of size B x num_outputs.
   """
-  with tf.variable_scope(scope) as sc:
-    num_input_units = inputs.get_shape()[-1].value
+  with tf.compat.v1.variable_scope(scope) as sc:
+    num_input_units = tf.compat.dimension_value(inputs.get_shape()[-1])
     weights = _variable_with_weight_decay('weights',
                                           shape=[num_input_units, num_outputs],
                                           use_xavier=use_xavier,
@@ -352,7 +352,7 @@ def fully_connected(inputs,
                                           wd=weight_decay)
     outputs = tf.matmul(inputs, weights)
     biases = _variable_on_cpu('biases', [num_outputs],
-                             tf.constant_initializer(0.0))
+                             tf.compat.v1.constant_initializer(0.0))
     outputs = tf.nn.bias_add(outputs, biases)
      
     if bn:
@@ -378,7 +378,7 @@ def max_pool2d(inputs,
   Returns:
     Variable tensor
   """
-  with tf.variable_scope(scope) as sc:
+  with tf.compat.v1.variable_scope(scope) as sc:
     kernel_h, kernel_w = kernel_size
     stride_h, stride_w = stride
     outputs = tf.nn.max_pool(inputs,
@@ -403,7 +403,7 @@ def avg_pool2d(inputs,
   Returns:
     Variable tensor
   """
-  with tf.variable_scope(scope) as sc:
+  with tf.compat.v1.variable_scope(scope) as sc:
     kernel_h, kernel_w = kernel_size
     stride_h, stride_w = stride
     outputs = tf.nn.avg_pool(inputs,
@@ -429,7 +429,7 @@ def max_pool3d(inputs,
   Returns:
     Variable tensor
   """
-  with tf.variable_scope(scope) as sc:
+  with tf.compat.v1.variable_scope(scope) as sc:
     kernel_d, kernel_h, kernel_w = kernel_size
     stride_d, stride_h, stride_w = stride
     outputs = tf.nn.max_pool3d(inputs,
@@ -454,7 +454,7 @@ def avg_pool3d(inputs,
   Returns:
     Variable tensor
   """
-  with tf.variable_scope(scope) as sc:
+  with tf.compat.v1.variable_scope(scope) as sc:
     kernel_d, kernel_h, kernel_w = kernel_size
     stride_d, stride_h, stride_w = stride
     outputs = tf.nn.avg_pool3d(inputs,
@@ -479,19 +479,19 @@ def batch_norm_template_unused(inputs, is_training, scope, moments_dims, bn_deca
   Return:
       normed:        batch-normalized maps
   """
-  with tf.variable_scope(scope) as sc:
-    num_channels = inputs.get_shape()[-1].value
+  with tf.compat.v1.variable_scope(scope) as sc:
+    num_channels = tf.compat.dimension_value(inputs.get_shape()[-1])
     beta = _variable_on_cpu(name='beta',shape=[num_channels],
-                            initializer=tf.constant_initializer(0))
+                            initializer=tf.compat.v1.constant_initializer(0))
     gamma = _variable_on_cpu(name='gamma',shape=[num_channels],
-                            initializer=tf.constant_initializer(1.0))
+                            initializer=tf.compat.v1.constant_initializer(1.0))
     batch_mean, batch_var = tf.nn.moments(inputs, moments_dims, name='moments')
     decay = bn_decay if bn_decay is not None else 0.9
-    ema = tf.train.ExponentialMovingAverage(decay=decay)
+    ema = tf.compat.v1.train.ExponentialMovingAverage(decay=decay)
     # Operator that maintains moving averages of variables.
     # Need to set reuse=False, otherwise if reuse, will see moments_1/mean/ExponentialMovingAverage/ does not exist
     # https://github.com/shekkizh/WassersteinGAN.tensorflow/issues/3
-    with tf.variable_scope(tf.get_variable_scope(), reuse=False):
+    with tf.compat.v1.variable_scope(tf.compat.v1.get_variable_scope(), reuse=False):
         ema_apply_op = tf.cond(is_training,
                                lambda: ema.apply([batch_mean, batch_var]),
                                lambda: tf.no_op())
@@ -524,11 +524,37 @@ def batch_norm_template(inputs, is_training, scope, moments_dims_unused, bn_deca
       normed:        batch-normalized maps
   """
   bn_decay = bn_decay if bn_decay is not None else 0.9
-  return tf.contrib.layers.batch_norm(inputs, 
-                                      center=True, scale=True,
-                                      is_training=is_training, decay=bn_decay,updates_collections=None,
-                                      scope=scope,
-                                      data_format=data_format)
+  # same variables and update rule as tf.contrib.layers.batch_norm with
+  # updates_collections=None, so old checkpoints still restore
+  with tf.compat.v1.variable_scope(scope) as sc:
+    rank = len(inputs.get_shape())
+    axis = 1 if data_format == 'NCHW' else rank-1
+    num_channels = tf.compat.dimension_value(inputs.get_shape()[axis])
+    moments_dims = [i for i in range(rank) if i != axis]
+    beta = tf.compat.v1.get_variable('beta', [num_channels],
+                                     initializer=tf.compat.v1.zeros_initializer())
+    gamma = tf.compat.v1.get_variable('gamma', [num_channels],
+                                      initializer=tf.compat.v1.ones_initializer())
+    moving_mean = tf.compat.v1.get_variable('moving_mean', [num_channels], trainable=False,
+                                            initializer=tf.compat.v1.zeros_initializer())
+    moving_variance = tf.compat.v1.get_variable('moving_variance', [num_channels], trainable=False,
+                                                initializer=tf.compat.v1.ones_initializer())
+
+    def mean_var_with_update():
+      batch_mean, batch_var = tf.nn.moments(inputs, moments_dims, name='moments')
+      update_mean = tf.compat.v1.assign_sub(moving_mean, (moving_mean-batch_mean)*(1-bn_decay))
+      update_var = tf.compat.v1.assign_sub(moving_variance, (moving_variance-batch_var)*(1-bn_decay))
+      with tf.control_dependencies([update_mean, update_var]):
+        return tf.identity(batch_mean), tf.identity(batch_var)
+
+    mean, var = tf.cond(tf.convert_to_tensor(is_training),
+                        mean_var_with_update,
+                        lambda: (tf.identity(moving_mean), tf.identity(moving_variance)))
+    if axis != rank-1:
+      shape = [1]*rank
+      shape[axis] = num_channels
+      mean, var, beta, gamma = [tf.reshape(t, shape) for t in (mean, var, beta, gamma)]
+    return tf.nn.batch_normalization(inputs, mean, var, beta, gamma, 1e-3)
 
 
 def batch_norm_for_fc(inputs, is_training, bn_decay, scope):
@@ -608,8 +634,97 @@ def dropout(inputs,
   Returns:
     tensor variable
   """
-  with tf.variable_scope(scope) as sc:
+  with tf.compat.v1.variable_scope(scope) as sc:
     outputs = tf.cond(is_training,
-                      lambda: tf.nn.dropout(inputs, keep_prob, noise_shape),
+                      lambda: tf.nn.dropout(inputs, rate=1-keep_prob, noise_shape=noise_shape),
                       lambda: inputs)
     return outputs
+
+
+def _in_stateless_scope():
+  """ True while Keras 3 builds a model by calling it symbolically; variables read as
+  their initial values there. Keras 2 has no such scope. """
+  try:
+    from keras.src.backend.common.stateless_scope import in_stateless_scope
+  except ImportError:
+    return False
+  return in_stateless_scope()
+
+
+class SharedMLP(tf.keras.layers.Layer):
+  """ Point-wise MLP with batch norm, the Keras counterpart of a stack of
+  conv2d(..., [1,1], padding='VALID', bn=True) calls.
+
+  The same weights are applied along the last axis, so the input can be
+  BxNxC, BxNxKxC or any other rank. In inference mode the batch norm is
+  folded into the weights and, with jit_compile, the whole stack runs as
+  one XLA cluster (the custom point cloud ops around it cannot be compiled).
+
+  Args:
+    mlp: list of ints, output channels of each layer
+    bn: bool, whether to use batch norm
+    bn_decay: float in [0,1], moving average decay of the batch norm statistics
+    activation_fn: function applied after every layer, including the last
+    jit_compile: bool, compile the inference path with XLA
+  """
+  def __init__(self, mlp, bn=True, bn_decay=None, activation_fn=tf.nn.relu,
+               jit_compile=False, **kwargs):
+    super().__init__(**kwargs)
+    self.mlp = list(mlp)
+    self.bn = bn
+    self.bn_decay = bn_decay if bn_decay is not None else 0.9
+    self.activation_fn = activation_fn
+    self._inference = tf.function(self._fused_inference, jit_compile=jit_compile)
+
+  def build(self, input_shape):
+    num_in_channels = tf.compat.dimension_value(input_shape[-1])
+    self.kernels, self.biases = [], []
+    self.betas, self.gammas, self.moving_means, self.moving_variances = [], [], [], []
+    for i, num_out_channels in enumerate(self.mlp):
+      self.kernels.append(self.add_weight(name='weights_%d'%(i), shape=(num_in_channels, num_out_channels),
+                                          initializer='glorot_uniform'))
+      self.biases.append(self.add_weight(name='biases_%d'%(i), shape=(num_out_channels,),
+                                         initializer='zeros'))
+      if self.bn:
+        self.betas.append(self.add_weight(name='beta_%d'%(i), shape=(num_out_channels,),
+                                          initializer='zeros'))
+        self.gammas.append(self.add_weight(name='gamma_%d'%(i), shape=(num_out_channels,),
+                                           initializer='ones'))
+        self.moving_means.append(self.add_weight(name='moving_mean_%d'%(i), shape=(num_out_channels,),
+                                                 initializer='zeros', trainable=False))
+        self.moving_variances.append(self.add_weight(name='moving_variance_%d'%(i), shape=(num_out_channels,),
+                                                     initializer='ones', trainable=False))
+      num_in_channels = num_out_channels
+    super().build(input_shape)
+
+  def _fused_inference(self, inputs):
+    outputs = inputs
+    for i in range(len(self.mlp)):
+      kernel, bias = self.kernels[i], self.biases[i]
+      if self.bn:
+        scale = self.gammas[i] * tf.math.rsqrt(self.moving_variances[i] + 1e-3)
+        kernel = kernel * scale
+        bias = (bias - self.moving_means[i]) * scale + self.betas[i]
+      outputs = tf.tensordot(outputs, kernel, [[-1], [0]]) + bias
+      if self.activation_fn is not None:
+        outputs = self.activation_fn(outputs)
+    return outputs
+
+  def call(self, inputs, training=None):
+    if not training:
+      if _in_stateless_scope():
+        # a trace made here would keep the initial weights, so run it untraced
+        return self._fused_inference(inputs)
+      return self._inference(inputs)
+    outputs = inputs
+    moments_dims = list(range(len(inputs.shape)-1))
+    for i in range(len(self.mlp)):
+      outputs = tf.tensordot(outputs, self.kernels[i], [[-1], [0]]) + self.biases[i]
+      if self.bn:
+        mean, var = tf.nn.moments(outputs, moments_dims)
+        self.moving_means[i].assign_sub((self.moving_means[i]-mean)*(1-self.bn_decay))
+        self.moving_variances[i].assign_sub((self.moving_variances[i]-var)*(1-self.bn_decay))
+        outputs = tf.nn.batch_normalization(outputs, mean, var, self.betas[i], self.gammas[i], 1e-3)
+      if self.activation_fn is not None:
+        outputs = self.activation_fn(outputs)
+    return outputs
@@ -0,0 +1,43 @@
+"""Checks of the point cloud cache: staleness and sources that share a file name."""
+import os
+
+import numpy as np
+
+from DeepElectrodeMapper.cache import default_cache_file, load_cached
+
+
+def write_points(path, points):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savetxt(path, points)
+
+
+def test_same_name_sources_share_cache_dir(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    files = [str(tmp_path / subj / "model_mesh.txt") for subj in ("sub01", "sub02")]
+    clouds = [np.full((5, 3), i, dtype=np.float32) for i in range(len(files))]
+    for path, points in zip(files, clouds):
+        write_points(path, points)
+    assert default_cache_file(files[0], cache_dir) != default_cache_file(files[1], cache_dir)
+
+    calls = []
+
+    def loader(path):
+        calls.append(path)
+        return np.loadtxt(path)
+
+    for _ in range(2):
+        for path, points in zip(files, clouds):
+            np.testing.assert_array_equal(load_cached(path, loader, cache_dir).points, points)
+    assert calls == files  # the second round is served from the cache
+
+
+def test_stale_entry_is_rebuilt(tmp_path):
+    path = str(tmp_path / "cloud.txt")
+    write_points(path, np.zeros((4, 3)))
+    np.testing.assert_array_equal(load_cached(path, np.loadtxt).points, np.zeros((4, 3)))
+
+    write_points(path, np.ones((4, 3)))  # same size, new content
+    os.utime(path, ns=(0, 0))
+    np.testing.assert_array_equal(load_cached(path, np.loadtxt).points, np.ones((4, 3)))
+    write_points(path, np.ones((6, 3)))
+    assert len(load_cached(path, np.loadtxt)) == 6
@@ -0,0 +1,62 @@
+"""Checks of the centroid extraction against sklearn and hand-computed means."""
+import numpy as np
+from sklearn.cluster import DBSCAN
+
+from DeepElectrodeMapper.centroids import cluster_centroids, dbscan_from_pairs, find_centroids
+from DeepElectrodeMapper.neighbors import NeighborGraph
+
+
+def blobs(n_blobs=6, per_blob=40, n_noise=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.uniform(0, 1, (n_blobs, 3))
+    points = np.concatenate([centres[:, None] + rng.normal(0, 0.01, (n_blobs, per_blob, 3))]).reshape(-1, 3)
+    return np.concatenate([points, rng.uniform(0, 1, (n_noise, 3))]), centres
+
+
+def test_dbscan_from_pairs_matches_sklearn():
+    points, _ = blobs()
+    graph = NeighborGraph(points)
+    pairs, distances = graph.radius_pairs(0.05)
+    for eps in (0.01, 0.02, 0.05):
+        labels, n_clusters = dbscan_from_pairs(len(points), pairs, distances, eps, min_samples=5)
+        model = DBSCAN(eps=eps, min_samples=5).fit(points)
+        expected = model.labels_
+        assert n_clusters == expected.max() + 1
+        np.testing.assert_array_equal(labels < 0, expected < 0)
+        # same partition of the core points, up to the numbering of the clusters
+        core = model.core_sample_indices_
+        assert len(set(zip(labels[core], expected[core]))) == n_clusters
+
+
+def test_cluster_centroids():
+    points = np.array([[0, 0, 0], [2, 0, 0], [5, 5, 5], [9, 9, 9]], dtype=float)
+    labels = np.array([0, 0, 1, -1])
+    centroids, sizes = cluster_centroids(points, labels)
+    np.testing.assert_allclose(centroids, [[1, 0, 0], [5, 5, 5]])
+    np.testing.assert_array_equal(sizes, [2, 1])
+
+    centroids, sizes = cluster_centroids(points, labels, weights=np.array([3.0, 1.0, 0.0, 1.0]))
+    # cluster 0 weighted 3:1, cluster 1 has zero total weight and keeps its plain mean
+    np.testing.assert_allclose(centroids, [[0.5, 0, 0], [5, 5, 5]])
+    np.testing.assert_array_equal(sizes, [2, 1])
+
+
+def test_find_centroids_recovers_blobs():
+    points, centres = blobs(per_blob=100, n_noise=0)
+    for method in ("dbscan", "kmeans"):
+        result = find_centroids(points, len(centres), method)
+        assert len(result.centroids) == len(centres)
+        distance = np.linalg.norm(result.centroids[:, None] - centres[None], axis=-1).min(axis=0)
+        assert distance.max() < 0.01
+
+
+def test_neighbor_graph_subset_matches_a_new_graph():
+    points, _ = blobs()
+    graph = NeighborGraph(points)
+    keep = np.flatnonzero(~graph.statistical_outliers(4, 1.0))
+    subset, expected = graph.subset(keep), NeighborGraph(points[keep])
+    assert subset.tree is graph.tree
+    for k in (3, 5, 12):
+        np.testing.assert_allclose(subset.knn(k)[0], expected.knn(k)[0])
+    pairs = subset.radius_pairs(0.05)[0]
+    assert set(map(tuple, pairs)) == set(map(tuple, expected.radius_pairs(0.05)[0]))
@@ -0,0 +1,57 @@
+"""Checks of the block tiling and the score merging of whole-cloud inference."""
+import numpy as np
+import pytest
+
+from DeepElectrodeMapper.inference import make_blocks, predict_cloud
+
+
+def brute_force_blocks(points, block_size, stride):
+    """Members of every block, found by testing each point against each origin."""
+    lo = points.min(axis=0)
+    n_steps = np.maximum(np.ceil((points.max(axis=0) - lo - block_size) / stride), 0).astype(int) + 1
+    blocks = {}
+    for cell in np.ndindex(*n_steps):
+        origin = lo + np.array(cell) * stride
+        inside = np.all((points >= origin) & (points <= origin + block_size), axis=1)
+        if inside.any():
+            blocks[tuple(np.round(origin + block_size / 2, 9))] = set(np.flatnonzero(inside))
+    return blocks
+
+
+@pytest.mark.parametrize("block_size, stride", [(0.2, 0.1), (0.25, 0.1), (0.3, 0.3)])
+def test_make_blocks_matches_brute_force(block_size, stride):
+    rng = np.random.default_rng(0)
+    # points on the grid lines sit on block borders, where the reach matters
+    points = np.concatenate([rng.uniform(0, 1, (500, 3)), np.round(rng.uniform(0, 1, (100, 3)), 1)])
+    indices, centers = make_blocks(points, block_size, stride, num_point=1024, min_points=1)
+    assert len(indices) == len(np.unique(centers, axis=0))  # one sample per block
+    assert set(indices.ravel()) == set(range(len(points)))
+    found = {tuple(np.round(c, 9)): set(i) for i, c in zip(indices, centers)}
+    assert found == brute_force_blocks(points, block_size, stride)
+
+
+def reference_scores(points, indices, centers, predict_fn, aggregate):
+    """Per-point loop over every sample of every block."""
+    totals = {}
+    for idx, center in zip(indices, centers):
+        logits = predict_fn((points[idx] - center)[None])[0]
+        for i, row in zip(idx, logits):
+            if aggregate == "vote":
+                row = np.eye(len(row))[row.argmax()]
+            totals.setdefault(i, []).append(row)
+    return np.array([np.mean(totals[i], axis=0) for i in range(len(points))])
+
+
+@pytest.mark.parametrize("aggregate", ["mean", "vote"])
+def test_predict_cloud_aggregation(aggregate):
+    rng = np.random.default_rng(1)
+    points = rng.uniform(0, 1, (400, 3)).astype(np.float32)
+
+    def predict_fn(batch):
+        return np.concatenate([batch, -batch.sum(axis=-1, keepdims=True)], axis=-1)
+
+    kwargs = dict(block_size=0.5, stride=0.25, num_point=64, min_points=1, seed=0)
+    scores = predict_cloud(points, predict_fn, batch_size=3, aggregate=aggregate, **kwargs)
+    indices, centers = make_blocks(points, **kwargs)
+    expected = reference_scores(points, indices, centers.astype(np.float32), predict_fn, aggregate)
+    np.testing.assert_allclose(scores, expected, rtol=1e-5, atol=1e-6)
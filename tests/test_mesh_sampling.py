@@ -0,0 +1,32 @@
+"""Checks of the mesh surface sampler."""
+import numpy as np
+
+from DeepElectrodeMapper.data_io import load_obj_vertices
+from DeepElectrodeMapper.mesh_sampling import Mesh, load_obj, sample_surface
+
+
+def test_samples_follow_triangle_areas():
+    # two triangles in the z=0 plane with areas 0.5 and 1
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [3, 0, 0], [3, 1, 0]], dtype=float)
+    faces = np.array([[0, 1, 2], [1, 3, 4]])
+    mesh = Mesh(vertices, faces, None, None, None, None, None)
+    samples = sample_surface(mesh, 40000, seed=0)
+    points = samples["points"]
+    in_first = points[:, 0] + points[:, 1] <= 1 + 1e-6
+    assert abs(in_first.mean() - 1 / 3) < 0.01
+    # every sample lies on its triangle, with the upward normal
+    np.testing.assert_allclose(points[:, 2], 0)
+    assert np.all(points[~in_first, 0] >= 1 - 1e-6)
+    np.testing.assert_allclose(np.abs(samples["normals"][:, 2]), 1, atol=1e-6)
+
+
+def test_load_obj_tabs_and_3d_uvs(tmp_path):
+    obj_file = tmp_path / "mesh.obj"
+    obj_file.write_text("# quad\nv\t0 0 0\nv 1 0 0\nv  1 1 0\nv 0 1 0\n"
+                        "vt 0 0 0\nvt\t1 0 0\nvt 1 1 0\nvt 0 1 0\n"
+                        "f 1/1 2/2 3/3 4/4\n")
+    mesh = load_obj(str(obj_file))
+    assert mesh.vertices.shape == (4, 3) and mesh.uvs.shape == (4, 2)
+    np.testing.assert_array_equal(mesh.faces, [[0, 1, 2], [0, 2, 3]])
+    np.testing.assert_array_equal(mesh.face_uvs, mesh.faces)
+    np.testing.assert_array_equal(load_obj_vertices(str(obj_file)), mesh.vertices)
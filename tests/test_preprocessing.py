@@ -0,0 +1,33 @@
+"""Checks of the voxel downsampling against a per-voxel brute force."""
+import numpy as np
+
+from DeepElectrodeMapper.preprocessing import estimate_normals, voxel_downsample
+
+
+def test_voxel_downsample_matches_brute_force():
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 1, (2000, 3))
+    colors = rng.integers(0, 256, (2000, 3)).astype(np.uint8)
+    labels = rng.integers(0, 3, 2000)
+    voxel_size = 0.2
+    result = voxel_downsample(points, voxel_size, colors=colors, labels=labels)
+
+    cells = np.floor((points - points.min(axis=0)) / voxel_size).astype(int)
+    expected = {}
+    for cell in {tuple(c) for c in cells}:
+        members = np.all(cells == cell, axis=1)
+        expected[tuple(np.round(points[members].mean(axis=0), 9))] = (
+            np.round(colors[members].mean(axis=0)), np.bincount(labels[members]).argmax())
+    assert len(result["points"]) == len(expected)
+    for point, color, label in zip(result["points"], result["colors"], result["labels"]):
+        expected_color, expected_label = expected[tuple(np.round(point, 9))]
+        np.testing.assert_array_equal(color, expected_color)
+        assert label == expected_label
+
+
+def test_estimate_normals_of_a_sphere_point_outward():
+    rng = np.random.default_rng(0)
+    points = rng.normal(size=(3000, 3))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    normals = estimate_normals(points, k=20)
+    assert np.sum(normals * points, axis=1).min() > 0.95